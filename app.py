@@ -1,13 +1,29 @@
 # Filename: app.py
 # --- Imports ---
-import requests
 from flask import (
-    Flask, request, abort, flash, redirect, get_flashed_messages, Response, url_for
+    Flask, request, abort, flash, redirect, get_flashed_messages, Response, url_for, jsonify,
+    make_response, g, send_file
 )
 import html  # For escaping user input in HTML
 import os  # For PORT binding
-import datetime  # To get the current year for the footer
 import json # To pass data to JS safely
+import functools  # Memoized page fragments
+import hashlib  # Content hash for the stylesheet URL and ETags
+import time  # Cache-Control ages
+try:
+    import orjson  # Optional: faster JSON encoding for the API endpoints (pip install orjson)
+except ImportError:
+    orjson = None
+from page_templates import Template, PageCache, current_year  # Precompiled page templates
+from compression import CompressionMiddleware  # gzip/brotli response compression
+from cache import FRESH, STALE  # Rank cache freshness states
+from metrics import REGISTRY, Counter, Gauge, Histogram, RENDER_BUCKETS  # Prometheus metrics (/metrics)
+from structured_log import get_logger  # Queue-backed structured logging
+from content_catalog import tier_catalog  # Competitive tier names, colours and icons by tier id
+from riot_lookup import (  # Cached Riot API lookup pipeline
+    lookup_rank, lookup_rank_many, describe_lookup_error, lookup_error_status, default_regions, parse_riot_id,
+    regions_for, rank_history, suggest_riot_ids, RANK_CACHE_FRESH_TTL, RANK_CACHE_STALE_TTL
+)
 
 # --- Configuration & Hardcoded Values ---
 # !!! WARNING: Use Environment Variables on Render for secrets! Hardcoding is insecure! !!!
@@ -16,12 +32,27 @@ import json # To pass data to JS safely
 RIOT_API_KEY = os.environ.get("RIOT_API_KEY", "RGAPI-Your-Actual-Riot-Api-Key-Here")
 RIOT_VERIFICATION_CODE = os.environ.get("RIOT_VERIFICATION_CODE", "de8de887-acbe-467e-9afd-5feb469e7f41") # Example placeholder
 FLASK_SECRET_KEY = os.environ.get("FLASK_SECRET_KEY", 'a_very_insecure_default_key_for_testing_only_v4') # Changed placeholder
+# Flush the page shell before the Riot API lookup runs (set to 0 to render results in one piece)
+STREAM_RESULTS_PAGE = os.environ.get("STREAM_RESULTS_PAGE", "1").lower() in ("1", "true", "yes", "on")
+BATCH_MAX_PLAYERS = int(os.environ.get("BATCH_MAX_PLAYERS", 50)) # Riot IDs accepted per /api/v1/batch request
+# Fields returned by /api/v1/rank (selectable with ?fields=tier,lp,...)
+RANK_API_FIELDS = ('tier', 'lp', 'wins', 'losses', 'puuid', 'fetched_at', 'cache')
+RANK_HISTORY_SHOWN = int(os.environ.get("RANK_HISTORY_SHOWN", 5)) # Rank changes listed on the results page
+SUGGEST_MAX_RESULTS = int(os.environ.get("SUGGEST_MAX_RESULTS", 10)) # Riot IDs returned by /api/v1/riot-ids
+TIER_ICON_MAX_AGE = int(os.environ.get("TIER_ICON_MAX_AGE", 86400)) # Seconds browsers reuse a tier icon (URLs are not fingerprinted)
 
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY  # Set the secret key for flashing
+log = get_logger("app")
+# Compresses responses per Accept-Encoding; fully static bodies are registered via compressor.precompress()
+app.wsgi_app = compressor = CompressionMiddleware(app.wsgi_app)
+
+# --- Metrics ---
+HTTP_IN_FLIGHT = Gauge(REGISTRY, "ecaly_http_requests_in_flight", "Requests being handled (streamed bodies count until sent).", ("endpoint",))
+HTTP_RESPONSES = Counter(REGISTRY, "ecaly_http_responses_total", "Responses by Flask endpoint and status.", ("endpoint", "status"))
+RENDER_SECONDS = Histogram(REGISTRY, "ecaly_render_duration_seconds", "Results page render time.", ("page",), buckets=RENDER_BUCKETS)
 
-# --- Rank Tier to Color Mapping (Example) ---
-# You might want to refine these colors based on official Valorant rank colors
+# --- Rank Tier to Color Mapping (fallback for tiers missing from the content catalog) ---
 RANK_COLORS = {
     "Iron": "#505050",
     "Bronze": "#a97142",
@@ -375,6 +406,23 @@ main {
 .stats-row .wins { color: #66bb6a; } /* Green for wins */
 .stats-row .losses { color: #ef5350; } /* Red for losses */
 
+/* Rank History (recorded rank changes, newest first) */
+.rank-history {
+    margin-top: 1.5rem;
+    padding-top: 1.5rem;
+    border-top: 1px solid var(--border-color);
+    text-align: center;
+}
+.rank-history h4 {
+    color: var(--text-secondary);
+    font-size: 1rem;
+    font-weight: 600;
+    margin-bottom: 0.75rem;
+}
+.rank-history ul { list-style: none; padding: 0; margin: 0; }
+.rank-history li { color: var(--text-secondary); padding: 0.2rem 0; }
+.rank-history li strong { color: var(--text-primary); margin: 0 0.5em; }
+
 /* Alert Styling */
 .alert {
     border: 1px solid var(--border-color);
@@ -439,39 +487,27 @@ footer a:hover {
 
 """
 
-# --- HTML Templates (as Python functions returning strings) ---
+# --- Fingerprinted Stylesheet ---
+# CUSTOM_CSS is served from a URL containing its content hash, so browsers/CDNs can cache it forever;
+# any CSS change yields a new URL.
+STYLESHEET_BYTES = compressor.precompress(CUSTOM_CSS.encode('utf-8'))
+STYLESHEET_FINGERPRINT = hashlib.sha256(STYLESHEET_BYTES).hexdigest()[:16]
+STYLESHEET_URL = f"/static/app.{STYLESHEET_FINGERPRINT}.css"
 
-def render_base_html(title="Ecaly", content="", head_extra="", scripts_extra=""):
-    """Simulates base.html template with enhanced styling."""
-    flashed_messages_html = ""
-    messages = get_flashed_messages(with_categories=True)
-    # Use a container *outside* the main content for flashed messages for better layout control
-    if messages:
-        flashed_messages_html += "<div class='container flashed-messages-container'><div class='row justify-content-center'><div class='col-lg-8 col-md-10'>"
-        for category, message in messages:
-            safe_message = html.escape(message)
-            alert_class = category if category in ['danger', 'warning', 'success', 'info'] else 'info'
-            flashed_messages_html += f"""
-            <div class="alert alert-{alert_class} alert-dismissible fade show" role="alert">
-                <span>{safe_message}</span>
-                <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
-            </div>
-            """
-        flashed_messages_html += "</div></div></div>"
-
-    current_year = datetime.datetime.now().year
-    return f"""
+# --- HTML Templates (compiled once into static segments, rendered by functions below) ---
+# Base page before the content
+BASE_HEAD_HTML = """
 <!doctype html>
 <html lang="en">
 <head>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>{html.escape(title)}</title>
+    <title>{title}</title>
     {head_extra}
     <link rel="preconnect" href="https://fonts.googleapis.com">
     <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>{CUSTOM_CSS}</style>
+    <link href="{stylesheet_url}" rel="stylesheet">
     </head>
 <body>
     <nav class="navbar">
@@ -482,7 +518,10 @@ def render_base_html(title="Ecaly", content="", head_extra="", scripts_extra="")
 
     <main>
         <div class="container">
-            {content}
+"""
+
+# Base page after the content
+BASE_TAIL_HTML = """
         </div>
     </main>
 
@@ -499,9 +538,12 @@ def render_base_html(title="Ecaly", content="", head_extra="", scripts_extra="")
 </html>
 """
 
-def render_index_page():
-    """Renders the content for the index page with new styles."""
-    index_content = """
+# Compiled once; the stylesheet URL is baked into the static segments at import time
+BASE_PAGE_TEMPLATE = Template(BASE_HEAD_HTML + "{content}" + BASE_TAIL_HTML, stylesheet_url=STYLESHEET_URL)
+BASE_HEAD_TEMPLATE = Template(BASE_HEAD_HTML, stylesheet_url=STYLESHEET_URL) # For streamed pages
+BASE_TAIL_TEMPLATE = Template(BASE_TAIL_HTML)
+
+INDEX_CONTENT = """
 <div class="row justify-content-center">
     <div class="col-lg-6 col-md-8">
         <div class="styled-card">
@@ -510,7 +552,9 @@ def render_index_page():
             <form action="/lookup" method="post">
                 <div class="mb-3">
                     <label for="username" class="form-label">Username</label>
-                    <input type="text" class="form-control" id="username" name="username" placeholder="PlayerName" required>
+                    <input type="text" class="form-control" id="username" name="username" placeholder="PlayerName" required
+                           list="riot-id-suggestions" autocomplete="off">
+                    <datalist id="riot-id-suggestions"></datalist>
                 </div>
                 <div class="mb-4">
                      <label for="tag" class="form-label">Tagline</label>
@@ -527,110 +571,295 @@ def render_index_page():
     </div>
 </div>
 """
-    return render_base_html(title="Ecaly - Valorant Rank Lookup", content=index_content)
-
-def render_results_page(player_name, player_tag, rank_data=None, error=None):
-    """Renders the content for the results page with new styles."""
-    safe_player_name = html.escape(player_name)
-    safe_player_tag = html.escape(player_tag)
-    safe_error = html.escape(error) if error else None
 
-    # Prepare data to potentially pass to JavaScript
-    results_data_json = json.dumps({'rank': rank_data, 'error': safe_error})
+# Typeahead for the index form: suggests Riot IDs the site has resolved before; picking "name#tag" fills both fields
+INDEX_SCRIPTS = """
+<script>
+(() => {
+    const username = document.getElementById('username'), tag = document.getElementById('tag');
+    const suggestions = document.getElementById('riot-id-suggestions');
+    let timer = null, shown = '';
+    username.addEventListener('input', () => {
+        const value = username.value, sep = value.lastIndexOf('#');
+        if (sep > 0) { // A suggestion (or a pasted Riot ID): split it across the two fields
+            username.value = value.slice(0, sep);
+            tag.value = value.slice(sep + 1);
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            if (value.trim().length < 2 || value === shown) return;
+            const response = await fetch('/api/v1/riot-ids?prefix=' + encodeURIComponent(value));
+            if (!response.ok) return;
+            const { riot_ids } = await response.json();
+            suggestions.replaceChildren(...riot_ids.map(riotId => new Option(riotId)));
+            shown = value;
+        }, 120);
+    });
+})();
+</script>
+"""
 
-    results_content = f"""
+# Result card opening (player header)
+RESULTS_HEADER_TEMPLATE = Template("""
 <div class="row justify-content-center">
     <div class="col-lg-6 col-md-8">
         <div class="styled-card result-card">
             <h2 class="text-center">Rank Result</h2>
             <p class="text-center player-id">{safe_player_name}<span>#{safe_player_tag}</span></p>
             <hr>
-"""
+""")
+
+# Result card closing: "lookup another" button, then end card, col, row
+RESULTS_FOOTER = '<div class="text-center mt-5"><a href="/" class="btn btn-secondary">Lookup Another Player</a></div></div></div></div>'
+
+# Fully rendered pages that only change with the footer year (e.g. the index page without flashed messages)
+static_pages = PageCache()
+
+
+def render_base_html(title="Ecaly", content="", head_extra="", scripts_extra="", with_flashes=True):
+    """Simulates base.html template with enhanced styling.
+
+    Pass with_flashes=False for publicly cacheable pages: it leaves the session (and a visitor's flashes) untouched.
+    """
+    return BASE_PAGE_TEMPLATE.render(
+        title=html.escape(title), head_extra=head_extra, flashed_messages_html=render_flashed_messages() if with_flashes else "",
+        content=content, current_year=str(current_year()), scripts_extra=scripts_extra
+    )
+
+def render_base_html_head(title="Ecaly", head_extra=""):
+    """Everything before the page content: <head>, CSS, navbar, flashed messages (needs a request context)."""
+    return BASE_HEAD_TEMPLATE.render(title=html.escape(title), head_extra=head_extra, flashed_messages_html=render_flashed_messages())
+
+def render_base_html_tail(scripts_extra=""):
+    """Everything after the page content: closes <main>, footer and scripts."""
+    return BASE_TAIL_TEMPLATE.render(current_year=str(current_year()), scripts_extra=scripts_extra)
+
+def render_flashed_messages():
+    flashed_messages_html = ""
+    messages = get_flashed_messages(with_categories=True)
+    # Use a container *outside* the main content for flashed messages for better layout control
+    if messages:
+        flashed_messages_html += "<div class='container flashed-messages-container'><div class='row justify-content-center'><div class='col-lg-8 col-md-10'>"
+        for category, message in messages:
+            safe_message = html.escape(message)
+            alert_class = category if category in ['danger', 'warning', 'success', 'info'] else 'info'
+            flashed_messages_html += f"""
+            <div class="alert alert-{alert_class} alert-dismissible fade show" role="alert">
+                <span>{safe_message}</span>
+                <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+            </div>
+            """
+        flashed_messages_html += "</div></div></div>"
+
+    return flashed_messages_html
+
+def render_index_page():
+    """Renders the content for the index page with new styles."""
+    if get_flashed_messages(): # Flashed messages make the page dynamic; otherwise it is fully static
+        return render_base_html(title="Ecaly - Valorant Rank Lookup", content=INDEX_CONTENT, scripts_extra=INDEX_SCRIPTS)
+    return render_static_index_page()
+
+def render_static_index_page():
+    """Returns the cached, encoded index page; its gzip/brotli variants are built once per render."""
+    return static_pages.get_or_render('index', lambda: compressor.precompress(BASE_PAGE_TEMPLATE.render(
+        title=html.escape("Ecaly - Valorant Rank Lookup"), head_extra="", flashed_messages_html="",
+        content=INDEX_CONTENT, current_year=str(current_year()), scripts_extra=INDEX_SCRIPTS
+    ).encode('utf-8')))
+
+def render_results_page(player_name, player_tag, rank_data=None, error=None, cache_status=None, history=None, with_flashes=True):
+    """Renders the content for the results page with new styles."""
+    with RENDER_SECONDS.time("results"):
+        safe_player_name = html.escape(player_name)
+        safe_player_tag = html.escape(player_tag)
+        results_content = RESULTS_HEADER_TEMPLATE.render(safe_player_name=safe_player_name, safe_player_tag=safe_player_tag)
+        results_content += render_results_body(player_name, player_tag, rank_data, error, cache_status, history)
+        return render_base_html(title=f"Rank: {safe_player_name}#{safe_player_tag} - Ecaly", content=results_content, with_flashes=with_flashes)
+
+def results_page_title(player_name, player_tag):
+    return f"Rank: {html.escape(player_name)}#{html.escape(player_tag)} - Ecaly"
+
+def render_results_header(player_name, player_tag):
+    """Opening of the result card (known before the lookup runs, so it can be flushed early)."""
+    return RESULTS_HEADER_TEMPLATE.render(safe_player_name=html.escape(player_name), safe_player_tag=html.escape(player_tag))
+
+def render_results_body(player_name, player_tag, rank_data=None, error=None, cache_status=None, history=None):
+    """Rank fragment or error alert, then closes the result card."""
+    safe_error = html.escape(error) if error else None
+
+    # Prepare data to potentially pass to JavaScript
+    results_data_json = json.dumps({'rank': rank_data, 'error': safe_error})
+
     # Add script tag to pass data to JS (will be picked up by base template's script)
-    results_content += f"""
+    parts = [f"""
     <script id="results-data" type="application/json">
         {results_data_json}
     </script>
-    """
+    """]
 
     if safe_error:
-        results_content += f'<div class="alert alert-danger" role="alert"><strong>Lookup Failed:</strong> {safe_error}</div>'
+        parts.append(f'<div class="alert alert-danger" role="alert"><strong>Lookup Failed:</strong> {safe_error}</div>')
     elif rank_data is not None:
-        # Extract and sanitize data
-        tier_raw = rank_data.get('tier', 'Unranked')
-        # Basic tier name extraction (e.g., "Immortal 1" -> "Immortal")
-        tier_base = tier_raw.split(' ')[0] if tier_raw != 'Unranked' else 'Unranked'
+        parts.append(render_rank_fragment(
+            rank_data.get('tier', 'Unranked'), rank_data.get('lp', '--'), rank_data.get('wins', '--'), rank_data.get('losses', '--'),
+            rank_data.get('currenttier'), tier_catalog.version
+        ))
+    else:
+        # Case where rank_data is None but no specific error was caught (shouldn't happen often)
+         parts.append('<div class="alert alert-warning" role="alert">Could not retrieve rank information.</div>')
+
+
+    if cache_status in (FRESH, STALE) and rank_data is not None:
+        # Served from cache - offer a forced refresh (re-POSTs to /lookup with refresh=1)
+        parts.append(f"""
+    <form action="/lookup" method="post" class="text-center mt-4">
+        <input type="hidden" name="username" value="{html.escape(player_name)}">
+        <input type="hidden" name="tag" value="{html.escape(player_tag)}">
+        <input type="hidden" name="refresh" value="1">
+        <p class="small">Showing a recently cached result. <button type="submit" class="btn btn-secondary btn-sm">Refresh</button></p>
+    </form>
+    """)
+
+    if history and len(history) > 1 and not safe_error: # Only worth showing once the rank has changed
+        parts.append(render_rank_history(history))
+
+    parts.append(RESULTS_FOOTER)
+
+    return "".join(parts) # Single join instead of repeated string concatenation
+
 
-        tier = html.escape(tier_raw)
-        # Division is often part of the tier name in Valorant API (e.g., "Diamond 2")
-        # Let's keep LP separate if available
-        lp = html.escape(str(rank_data.get('lp', '--')))
-        wins = html.escape(str(rank_data.get('wins', '--')))
-        losses = html.escape(str(rank_data.get('losses', '--')))
-        icon_url = rank_data.get('rank_icon_url') # Note: Valorant Ranked API v1 doesn't directly provide icon URL
-
-        # Determine colors and styles based on rank
-        rank_color = RANK_COLORS.get(tier_base, RANK_COLORS["Unranked"]) # Use base tier for color lookup
-        icon_border_style = f"border-color: {rank_color}; box-shadow: 0 0 15px {rank_color}60;" # Add glow effect
-
-
-        results_content += '<div class="rank-display">'
-        results_content += '<div class="rank-icon-wrapper">' # Wrapper for icon
-        # --- Icon Placeholder - Replace with actual icon if API provided it ---
-        # The standard Valorant Ranked v1 API *doesn't* give an icon URL.
-        # You usually map tier names to static image assets you host yourself.
-        # Example: <img src="/static/images/ranks/{tier_base.lower()}.png" alt="{tier}" style="{icon_border_style}">
-        # For now, using a placeholder div:
-        results_content += f'<div class="rank-icon-placeholder" style="{icon_border_style}">{tier_base}</div>'
-        results_content += '</div>' # End rank-icon-wrapper
-
-        results_content += '<div class="rank-details text-center">'
-        tier_display = tier # Already escaped, includes division like "Diamond 2"
-        results_content += f'<h3 class="rank-tier" style="color: {rank_color};">{tier_display}</h3>'
-        if lp != '--' and tier_base != 'Unranked' and tier_base != 'Radiant': # LP usually shown except for Unranked/Radiant
-             results_content += f'<p><strong>{lp}</strong> RR</p>' # Using RR (Rank Rating) common term
-
-        results_content += '</div>' # End rank-details
-
-        # Only show Wins/Losses if they are available (not '--')
-        if wins != '--' or losses != '--':
-            results_content += '<div class="stats-row">'
-            if wins != '--':
-                 results_content += f'<div class="wins">Wins: <strong>{wins}</strong></div>'
-            if losses != '--':
-                 results_content += f'<div class="losses">Losses: <strong>{losses}</strong></div>'
-            results_content += '</div>' # End stats-row
-
-        results_content += '</div>' # End rank-display
-
-        # Add message for unranked players if found but no rank tier
-        if tier_base == 'Unranked' and not safe_error:
-            results_content += '<div class="alert alert-info mt-4" role="alert">Player found, but appears unranked in the current competitive season.</div>'
+def render_rank_history(history):
+    """Compact list of recorded rank changes (newest first) from the local snapshot store."""
+    items = []
+    for entry in history:
+        seen_on = time.strftime('%Y-%m-%d', time.gmtime(entry['fetched_at']))
+        rr = f" {html.escape(str(entry['lp']))} RR" if entry['lp'] not in (None, '--') and entry['tier'] != 'Unranked' else ''
+        items.append(f"<li>{seen_on}<strong>{html.escape(str(entry['tier']))}</strong>{rr}</li>")
+    return f'<div class="rank-history"><h4>Rank History</h4><ul>{"".join(items)}</ul></div>'
 
+@functools.lru_cache(maxsize=4096)
+def render_rank_fragment(tier_raw, lp, wins, losses, tier_id=None, catalog_version=0):
+    """Rank icon/tier/RR/stats block; memoized since popular players re-render identical values.
+
+    `catalog_version` is only part of the memo key, so fragments re-render after the tier catalog changes.
+    """
+    # Tier metadata is an array lookup by the numeric tier id (name match as a fallback)
+    catalog_tier = tier_catalog.resolve(tier_id, tier_raw)
+    if catalog_tier is not None:
+        tier_base, rank_color, icon_url = catalog_tier.division, catalog_tier.color, catalog_tier.icon_url
+    else: # Unknown to the catalog: derive the division from the name (e.g., "Immortal 1" -> "Immortal")
+        tier_base = tier_raw.split(' ')[0] if tier_raw != 'Unranked' else 'Unranked'
+        rank_color, icon_url = RANK_COLORS.get(tier_base, RANK_COLORS["Unranked"]), None
+
+    tier = html.escape(tier_raw)
+    # Division is often part of the tier name in Valorant API (e.g., "Diamond 2")
+    # Let's keep LP separate if available
+    lp = html.escape(str(lp))
+    wins = html.escape(str(wins))
+    losses = html.escape(str(losses))
+
+    icon_border_style = f"border-color: {rank_color}; box-shadow: 0 0 15px {rank_color}60;" # Add glow effect
+
+    parts = []
+    parts.append('<div class="rank-display">')
+    parts.append('<div class="rank-icon-wrapper rank-icon">') # Wrapper for icon
+    if icon_url:
+        parts.append(f'<img src="{html.escape(icon_url)}" alt="{tier}" width="120" height="120" style="{icon_border_style}">')
     else:
-        # Case where rank_data is None but no specific error was caught (shouldn't happen often)
-         results_content += '<div class="alert alert-warning" role="alert">Could not retrieve rank information.</div>'
+        parts.append(f'<div class="rank-icon-placeholder" style="{icon_border_style}">{html.escape(tier_base)}</div>')
+    parts.append('</div>') # End rank-icon-wrapper
+
+    parts.append('<div class="rank-details text-center">')
+    tier_display = tier # Already escaped, includes division like "Diamond 2"
+    parts.append(f'<h3 class="rank-tier" style="color: {rank_color};">{tier_display}</h3>')
+    if lp != '--' and tier_base != 'Unranked' and tier_base != 'Radiant': # LP usually shown except for Unranked/Radiant
+         parts.append(f'<p><strong>{lp}</strong> RR</p>') # Using RR (Rank Rating) common term
+
+    parts.append('</div>') # End rank-details
+
+    # Only show Wins/Losses if they are available (not '--')
+    if wins != '--' or losses != '--':
+        parts.append('<div class="stats-row">')
+        if wins != '--':
+             parts.append(f'<div class="wins">Wins: <strong>{wins}</strong></div>')
+        if losses != '--':
+             parts.append(f'<div class="losses">Losses: <strong>{losses}</strong></div>')
+        parts.append('</div>') # End stats-row
 
+    parts.append('</div>') # End rank-display
 
-    results_content += '<div class="text-center mt-5"><a href="/" class="btn btn-secondary">Lookup Another Player</a></div>'
-    results_content += '</div></div></div>' # End card, col, row
+    # Add message for unranked players if found but no rank tier
+    if tier_base == 'Unranked':
+        parts.append('<div class="alert alert-info mt-4" role="alert">Player found, but appears unranked in the current competitive season.</div>')
 
-    return render_base_html(title=f"Rank: {safe_player_name}#{safe_player_tag} - Ecaly", content=results_content)
+    return "".join(parts)
 
 
 # --- Flask Routes ---
 
+def riot_api_key_missing():
+    """True (and logs an error) if RIOT_API_KEY is unset or still the placeholder."""
+    current_api_key = RIOT_API_KEY
+    if not current_api_key or current_api_key == "RGAPI-Your-Actual-Riot-Api-Key-Here":
+        log.error("config.api_key_missing", "RIOT_API_KEY environment variable not set or is using the placeholder value.")
+        return True
+    return False
+
+@app.before_request
+def track_request_start():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    HTTP_IN_FLIGHT.inc(g.metrics_endpoint)
+
+@app.after_request
+def track_request_end(response):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        HTTP_RESPONSES.inc(endpoint, str(response.status_code))
+        response.call_on_close(lambda: HTTP_IN_FLIGHT.dec(endpoint)) # Runs once a streamed body is fully sent
+    return response
+
+@app.teardown_request
+def track_request_teardown(error):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None: # after_request never ran
+        HTTP_IN_FLIGHT.dec(endpoint)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this host's metrics, merged across gunicorn workers."""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8', headers={'Cache-Control': 'no-store'})
+
 @app.route('/riot.txt')
 def serve_riot_txt():
     """Serves the verification code directly."""
     # IMPORTANT: Ensure RIOT_VERIFICATION_CODE is correctly set in your environment!
     current_verification_code = RIOT_VERIFICATION_CODE
     if not current_verification_code or current_verification_code == "de8de887-acbe-467e-9afd-5feb469e7f41": # Default placeholder check
-        print("WARNING: RIOT_VERIFICATION_CODE is not set via ENV or is using the placeholder!")
+        log.warning("config.verification_code_placeholder", "RIOT_VERIFICATION_CODE is not set via ENV or is using the placeholder!")
         # Return a placeholder or error in production if not set, avoid exposing default.
         # For testing, returning the placeholder might be okay.
     return Response(current_verification_code, mimetype='text/plain')
 
+@app.route('/static/app.<fingerprint>.css')
+def serve_stylesheet(fingerprint):
+    """Serves CUSTOM_CSS at its content-hashed URL with a one-year immutable cache lifetime."""
+    if fingerprint != STYLESHEET_FINGERPRINT:
+        abort(404) # Stale fingerprint: never cache old URLs against new content
+    response = Response(STYLESHEET_BYTES, mimetype='text/css')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(STYLESHEET_FINGERPRINT)
+    return response.make_conditional(request)
+
+@app.route('/static/tiers/<int:tier_id>.png')
+def serve_tier_icon(tier_id):
+    """Serves a competitive tier icon from local content (see content_catalog.py) instead of hotlinking it."""
+    path = tier_catalog.icon_path(tier_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='image/png', max_age=TIER_ICON_MAX_AGE)
+
+render_static_index_page() # Compress the index shell at startup rather than on the first request
+
 @app.route('/')
 def index():
     """Renders the homepage."""
@@ -641,15 +870,14 @@ def lookup():
     """Handles form submission, calls API, returns results HTML."""
     username = request.form.get('username', '').strip()
     tag = request.form.get('tag', '').strip()
+    force_refresh = request.form.get('refresh', '') in ('1', 'true', 'on') # Bypass the rank cache
 
     if not username or not tag:
         flash('Please provide both Riot Username and Tagline.', 'warning')
         return redirect(url_for('index')) # Use url_for for routing
 
     # Validate API Key
-    current_api_key = RIOT_API_KEY
-    if not current_api_key or current_api_key == "RGAPI-Your-Actual-Riot-Api-Key-Here":
-        print("ERROR: RIOT_API_KEY environment variable not set or is using the placeholder value.")
+    if riot_api_key_missing():
         flash('Application configuration error: API key missing or invalid. Please contact the administrator.', 'danger')
         # Render results page with error, but don't redirect
         return render_results_page(
@@ -658,146 +886,189 @@ def lookup():
             error='Server configuration error. Please try again later.' # User-friendly message
         )
 
-    rank_data = None
-    error_message = None
-    print(f"Looking up player: {username}#{tag}")
+    if STREAM_RESULTS_PAGE:
+        # Send head/CSS/navbar and the player header now; the rank fragment follows when the lookup completes
+        page_start = render_base_html_head(title=results_page_title(username, tag)) + render_results_header(username, tag)
 
-    try:
-        headers = {"X-Riot-Token": current_api_key}
-        # Use environment variables for regions, default to common ones
-        # Adjust these defaults based on your primary user base
-        account_region = os.environ.get("RIOT_ACCOUNT_REGION", "americas") # e.g., americas, asia, europe, sea
-        valorant_region = os.environ.get("RIOT_VALORANT_REGION", "na")     # e.g., na, eu, ap, kr, latam, br
-
-        # --- 1. Get PUUID using Account API ---
-        account_api_url = f"https://{account_region}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{username}/{tag}"
-        print(f"Calling Account API: {account_api_url}")
-        account_response = requests.get(account_api_url, headers=headers, timeout=10) # Reduced timeout slightly
-
-        # Specific handling for 404 on account lookup
-        if account_response.status_code == 404:
-             raise ValueError(f"Riot ID '{username}#{tag}' not found in the '{account_region}' region. Check spelling, tag, and selected region.")
-        account_response.raise_for_status() # Raise exceptions for other errors (4xx, 5xx)
-
-        account_data = account_response.json()
-        puuid = account_data.get('puuid')
-
-        if not puuid:
-            raise ValueError("Could not extract PUUID from API response.")
-        print(f"Found PUUID: {puuid}")
-
-        # --- 2. Get Rank using Valorant Ranked API ---
-        # NOTE: The v1 endpoint provides data for the *current* competitive season.
-        # It might return very little data if the player hasn't played ranked recently.
-        rank_api_url = f"https://{valorant_region}.api.riotgames.com/val/ranked/v1/by-puuid/{puuid}"
-        # Alternative (Content API - often more info but needs different parsing):
-        # rank_api_url = f"https://{valorant_region}.api.riotgames.com/val/content/v1/contents" # (Less relevant for rank directly)
-        # Alternative (MMR API - gives detailed MMR but structure varies):
-        # rank_api_url = f"https://{valorant_region}.api.riotgames.com/val/match/v1/matchlists/by-puuid/{puuid}" # (Needs more processing)
-
-        print(f"Calling VAL Rank API: {rank_api_url}")
-        rank_response = requests.get(rank_api_url, headers=headers, timeout=15)
-
-        # Handle 404 for Rank API - means player exists but has no data in this specific ranked queue/season
-        if rank_response.status_code == 404:
-            print(f"No VAL ranked data found for PUUID {puuid} in region {valorant_region} (status 404). Treating as Unranked.")
-            rank_data = {'tier': 'Unranked', 'lp': 0, 'wins': 0, 'losses': 0} # Provide default unranked structure
-        else:
-            rank_response.raise_for_status() # Raise for other errors
-            api_result = rank_response.json()
-            print(f"Received rank data: {api_result}") # Log the raw response
-
-            # --- Parse the Ranked v1 Response ---
-            # Structure might be under 'data' or directly at root depending on exact endpoint/version
-            # The 'by-puuid' endpoint (v1) seems to return data in `images` and tier info.
-            # Let's refine parsing based on typical Valorant API structures.
-            # Often MMR data comes from a different endpoint (`/mmr/v1/players/{puuid}`)
-            # The `/ranked/v1/by-puuid/` endpoint is *less* common for detailed rank like tier/RR.
-            # Let's *assume* we are getting data similar to what MMR endpoint might provide,
-            # or fallback gracefully. A common structure has 'data.currentData' or similar.
-
-            # --- IMPORTANT RE-EVALUATION ---
-            # The `/val/ranked/v1/by-puuid/{puuid}` endpoint IS NOT the correct one for detailed Tier/RR.
-            # It seems related to leaderboards.
-            # The correct endpoint is likely `/val/mmr/v1/by-puuid/{puuid}`.
-            # Let's switch to that, assuming it's available for your API key type.
-            mmr_api_url = f"https://{valorant_region}.api.riotgames.com/val/mmr/v1/by-puuid/{puuid}"
-            print(f"Calling VAL MMR API: {mmr_api_url}")
-            mmr_response = requests.get(mmr_api_url, headers=headers, timeout=15)
-
-            if mmr_response.status_code == 404:
-                 print(f"No VAL MMR data found for PUUID {puuid} in region {valorant_region} (status 404). Treating as Unranked.")
-                 rank_data = {'tier': 'Unranked', 'lp': 0, 'wins': 0, 'losses': 0}
-            elif mmr_response.status_code == 204: # No content - player likely unranked or no data
-                 print(f"No VAL MMR content (204) for PUUID {puuid}. Treating as Unranked.")
-                 rank_data = {'tier': 'Unranked', 'lp': 0, 'wins': 0, 'losses': 0}
-            else:
-                mmr_response.raise_for_status()
-                mmr_api_result = mmr_response.json()
-                print(f"Received MMR data: {mmr_api_result}")
-
-                # Parse MMR Data (structure example: {'data': {'currenttier': 21, 'currenttierpatched': 'Immortal 1', 'ranking_in_tier': 55, ...}})
-                if 'data' in mmr_api_result and mmr_api_result['data']:
-                    mmr_data = mmr_api_result['data']
-                    tier_name = mmr_data.get('currenttierpatched', 'Unranked')
-                    tier_lp = mmr_data.get('ranking_in_tier', 0) # Usually called RR or LP
-
-                    # Wins/Losses might not be directly in this response, depends on API version/tier
-                    # Often requires processing match history separately. We'll default to '--'
-                    wins_count = mmr_data.get('wins', '--') # Placeholder if API doesn't provide directly
-
-                    rank_data = {
-                        'tier': tier_name if tier_name else 'Unranked',
-                        'lp': tier_lp,
-                        'wins': wins_count, # Keep as '--' if not available
-                        'losses': '--',     # Keep as '--' if not available
-                        'rank_icon_url': None # No icon URL from this API, handle in template
-                    }
-                else:
-                     # No 'data' object found, treat as unranked
-                     print("MMR API response structure unexpected or missing 'data'. Treating as Unranked.")
-                     rank_data = {'tier': 'Unranked', 'lp': 0, 'wins': 0, 'losses': 0}
-
-            print(f"Parsed rank data: {rank_data}")
-
-
-    # --- Error Handling ---
-    except requests.exceptions.Timeout:
-        print("Error: Request to Riot API timed out.")
-        error_message = "Request to Riot API timed out. The service might be busy. Please try again later."
-    except requests.exceptions.HTTPError as e:
-        status_code = e.response.status_code
-        response_text = e.response.text
-        print(f"Error: Riot API HTTP Error {status_code}. Response: {response_text}")
-        # More specific user messages
-        if status_code == 400: error_message = "Invalid request sent to Riot API. Please check the input format."
-        elif status_code == 401: error_message = "Unauthorized: Invalid Riot API Key. Please contact the site administrator."
-        elif status_code == 403: error_message = "Forbidden: The Riot API Key may be expired, invalid, or lack permissions for the requested data (e.g., MMR API)."
-        elif status_code == 404: # Should be caught earlier for account, but catch here for MMR API
-             error_message = f"Player data not found in region '{valorant_region}'. They might be unranked or the Riot ID is incorrect."
-        elif status_code == 429: error_message = "Rate limit exceeded. Too many requests are being made. Please wait a moment before trying again."
-        elif status_code >= 500: error_message = f"Riot API is temporarily unavailable (Server Error {status_code}). Please try again later."
-        else: error_message = f"An error occurred while contacting Riot API (Code: {status_code})."
-    except requests.exceptions.RequestException as e:
-        print(f"Error: Network error: {e}")
-        error_message = "Network error: Could not connect to Riot API. Please check your internet connection and Riot API status."
-    except ValueError as e: # Catch custom errors raised earlier
-        print(f"Error: Data processing error: {e}")
-        error_message = str(e) # Display the specific ValueError message
-    except Exception as e:
-        print(f"CRITICAL: An unexpected error occurred: {e}")
-        import traceback
-        traceback.print_exc()
-        error_message = "An unexpected server error occurred. Please try again later or contact support."
+        def generate():
+            yield page_start
+            rank_data, error_message, cache_status, history = run_page_lookup(username, tag, force_refresh)
+            with RENDER_SECONDS.time("results_stream"): # Body only: the shell was rendered before the lookup
+                page_end = render_results_body(username, tag, rank_data, error_message, cache_status, history) + render_base_html_tail()
+            yield page_end
+
+        # X-Accel-Buffering: stop nginx-style proxies from holding the early flush back
+        return Response(generate(), mimetype='text/html', headers={'X-Accel-Buffering': 'no'})
+
+    rank_data, error_message, cache_status, history = run_page_lookup(username, tag, force_refresh)
 
     # Always render the results page, passing either rank_data or error_message
     return render_results_page(
         player_name=username,
         player_tag=tag,
         rank_data=rank_data,
-        error=error_message
+        error=error_message,
+        cache_status=cache_status,
+        history=history
     )
 
+@app.route('/player/<region>/<username>/<tag>')
+def player_permalink(region, username, tag):
+    """Shareable, cacheable GET version of the results page (ETag/304, Cache-Control from the rank cache)."""
+    regions = regions_for(region)
+    username, tag = username.strip(), tag.strip()
+    if regions is None or not username or not tag:
+        abort(404)
+    if riot_api_key_missing():
+        response = make_response(render_results_page(
+            username, tag, error='Server configuration error. Please try again later.', with_flashes=False
+        ), 503)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    account_region, valorant_region = regions
+    try:
+        puuid, rank_data, cache_status = lookup_rank(username, tag, account_region, valorant_region)
+    except Exception as e:
+        response = make_response(
+            render_results_page(username, tag, error=describe_lookup_error(e, valorant_region), with_flashes=False), lookup_error_status(e)
+        )
+        response.headers['Cache-Control'] = 'no-store' # Errors are never cached at the edge
+        return response
+
+    etag = rank_etag(rank_data, STYLESHEET_FINGERPRINT, current_year(), tier_catalog.version)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304) # Skip rendering entirely
+    else:
+        response = make_response(render_results_page(
+            username, tag, rank_data=rank_data, cache_status=cache_status, history=rank_history(puuid, RANK_HISTORY_SHOWN),
+            with_flashes=False # Shared at the edge: never embed (or consume) this visitor's flashes
+        ))
+    # Weak: the page also embeds fetched_at/cache state, which may change without the rank changing
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = rank_cache_control(rank_data)
+    return response
+
+def rank_etag(rank_data, *salt):
+    """ETag for a rank result: changes only when the displayed rank (or a salt such as the page version) changes."""
+    fields = [rank_data.get(key) for key in ('tier', 'lp', 'wins', 'losses')]
+    return hashlib.sha1(json.dumps([fields, *salt], default=str).encode()).hexdigest()[:20]
+
+def rank_cache_control(rank_data):
+    """Cache-Control matching the backend rank cache: fresh for its remaining fresh window, then stale-while-revalidate."""
+    age = max(0, time.time() - rank_data.get('fetched_at', time.time()))
+    max_age = int(max(0, RANK_CACHE_FRESH_TTL - age))
+    stale = int(max(0, min(RANK_CACHE_STALE_TTL, RANK_CACHE_FRESH_TTL + RANK_CACHE_STALE_TTL - age)))
+    return f"public, max-age={max_age}, stale-while-revalidate={stale}"
+
+@app.route('/api/v1/rank/<region>/<username>/<tag>')
+def rank_api(region, username, tag):
+    """Rank lookup as compact JSON, with ?fields= projection, ETag/304 and the same caching headers as the permalink."""
+    regions = regions_for(region)
+    username, tag = username.strip(), tag.strip()
+    if regions is None:
+        return json_response({'error': f"Unknown region '{region}'."}, 404)
+    if not username or not tag:
+        return json_response({'error': 'Please provide both Riot Username and Tagline.'}, 400)
+    fields = RANK_API_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(dict.fromkeys(field.strip() for field in request.args['fields'].split(',') if field.strip()))
+        unknown = [field for field in fields if field not in RANK_API_FIELDS]
+        if unknown or not fields:
+            return json_response({'error': f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(RANK_API_FIELDS)}."}, 400)
+    if riot_api_key_missing():
+        return json_response({'error': 'Server configuration error. Please try again later.'}, 503)
+
+    account_region, valorant_region = regions
+    force_refresh = request.args.get('refresh', '') in ('1', 'true', 'on')
+    try:
+        puuid, rank_data, cache_status = lookup_rank(username, tag, account_region, valorant_region, force_refresh=force_refresh)
+    except Exception as e:
+        return json_response({'error': describe_lookup_error(e, valorant_region)}, lookup_error_status(e))
+
+    etag = rank_etag(rank_data, puuid, fields)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        record = {**rank_data, 'puuid': puuid, 'cache': cache_status}
+        response = json_response({field: record.get(field) for field in fields}, 200)
+    response.set_etag(etag, weak=True) # Weak: fetched_at/cache may change while the rank stays the same
+    response.headers['Cache-Control'] = rank_cache_control(rank_data)
+    return response
+
+@app.route('/api/v1/riot-ids')
+def riot_id_suggestions():
+    """Typeahead: resolved Riot IDs starting with ?prefix= (case-insensitive), most looked-up first."""
+    prefix = request.args.get('prefix', '').strip()
+    limit = min(request.args.get('limit', SUGGEST_MAX_RESULTS, type=int), SUGGEST_MAX_RESULTS)
+    if not prefix:
+        return json_response({'error': 'Please provide a ?prefix= to complete.'}, 400)
+    response = json_response({'riot_ids': suggest_riot_ids(prefix, limit)}, 200)
+    # Each worker reloads IDs the others resolved every TYPEAHEAD_REFRESH_INTERVAL, so a new ID can take a
+    # couple of those (plus this max-age) to be suggested everywhere
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+def json_response(payload, status):
+    """Compact JSON response; encoded with orjson when it is installed, else the json module."""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return Response(body, status=status, mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+def run_page_lookup(username, tag, force_refresh=False):
+    """Runs the lookup for an HTML page: returns (rank_data, error_message, cache_status, history)."""
+    account_region, valorant_region = default_regions()
+    try:
+        # --- Cached Account -> Ranked/MMR chain (see riot_lookup.py) ---
+        puuid, rank_data, cache_status = lookup_rank(username, tag, account_region, valorant_region, force_refresh=force_refresh)
+        return rank_data, None, cache_status, rank_history(puuid, RANK_HISTORY_SHOWN)
+    except Exception as e:
+        return None, describe_lookup_error(e, valorant_region), None, None
+
+@app.route('/api/v1/batch', methods=['POST'])
+def batch_lookup():
+    """Resolves a JSON list of Riot IDs, streaming one NDJSON record per player as soon as it is ready."""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('players') # Also accept {"players": [...]}
+    if not isinstance(payload, list) or not payload:
+        return jsonify(error='Expected a JSON list of Riot IDs ("Name#TAG" or {"username": ..., "tag": ...}).'), 400
+    if len(payload) > BATCH_MAX_PLAYERS:
+        return jsonify(error=f"Too many players: at most {BATCH_MAX_PLAYERS} per batch."), 400
+    if riot_api_key_missing():
+        return jsonify(error='Server configuration error. Please try again later.'), 503
+
+    players = [] # Valid (username, tag) pairs
+    player_indices = [] # Position of each valid pair in the request
+    invalid_indices = []
+    for index, entry in enumerate(payload):
+        riot_id = parse_riot_id(entry)
+        if riot_id is None:
+            invalid_indices.append(index)
+        else:
+            players.append(riot_id)
+            player_indices.append(index)
+
+    account_region, valorant_region = default_regions()
+
+    def generate():
+        for index in invalid_indices:
+            yield json.dumps({'index': index, 'status': 'error', 'code': 400, 'error': 'Invalid Riot ID. Use "Name#TAG".'}) + '\n'
+        for position, outcome in lookup_rank_many(players, account_region, valorant_region):
+            username, tag = players[position]
+            record = {'index': player_indices[position], 'riot_id': f"{username}#{tag}"}
+            if isinstance(outcome, Exception):
+                record.update(status='error', code=lookup_error_status(outcome), error=describe_lookup_error(outcome, valorant_region))
+            else:
+                puuid, rank_data, cache_status = outcome
+                record.update(status='ok', puuid=puuid, rank=rank_data, cache=cache_status)
+            yield json.dumps(record) + '\n'
+
+    # X-Accel-Buffering: stop nginx-style proxies from holding records back until the batch ends
+    return Response(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
 # --- Run App Locally (Gunicorn runs it on Render/Production) ---
 if __name__ == '__main__':
     print("--- Starting Ecaly Flask Development Server ---")
@@ -0,0 +1,74 @@
+# Filename: asgi.py
+# --- ASGI entry point for the async lookup pipeline ---
+# Serves JSON rank lookups from a single event loop, e.g.:
+#   uvicorn asgi:app --host 0.0.0.0 --port 5002
+# GET /lookup?username=PlayerName&tag=TAG[&refresh=1]
+# The HTML site stays on the Flask/gunicorn app (app.py); both share riot_lookup.py.
+import json
+from urllib.parse import parse_qs
+
+from riot_lookup import (
+    RIOT_API_KEY, lookup_rank_async, describe_lookup_error, lookup_error_status, default_regions
+)
+from structured_log import get_logger
+
+log = get_logger("asgi")
+
+
+async def app(scope, receive, send):
+    """Minimal ASGI application (no framework dependency)."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] != "/lookup":
+        await _send_json(send, 404, {"error": "Not found."})
+        return
+    if scope["method"] != "GET":
+        await _send_json(send, 405, {"error": "Method not allowed."})
+        return
+
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    username = query.get("username", [""])[0].strip()
+    tag = query.get("tag", [""])[0].strip()
+    force_refresh = query.get("refresh", [""])[0] in ("1", "true", "on")
+    if not username or not tag:
+        await _send_json(send, 400, {"error": "Please provide both Riot Username and Tagline."})
+        return
+    if not RIOT_API_KEY or RIOT_API_KEY == "RGAPI-Your-Actual-Riot-Api-Key-Here":
+        log.error("config.api_key_missing", "RIOT_API_KEY environment variable not set or is using the placeholder value.")
+        await _send_json(send, 503, {"error": "Server configuration error. Please try again later."})
+        return
+
+    account_region, valorant_region = default_regions()
+    try:
+        puuid, rank_data, cache_status = await lookup_rank_async(
+            username, tag, account_region, valorant_region, force_refresh=force_refresh
+        )
+    except Exception as e:
+        await _send_json(send, lookup_error_status(e), {"error": describe_lookup_error(e, valorant_region)})
+        return
+    await _send_json(send, 200, {
+        "username": username, "tag": tag, "puuid": puuid, "rank": rank_data, "cache": cache_status,
+    })
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"cache-control", b"no-store"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
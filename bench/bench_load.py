@@ -0,0 +1,255 @@
+# Filename: bench/bench_load.py
+"""Load benchmark: drives / and /lookup on gunicorn-served app.py against bench/riot_stub.py.
+
+Usage (from the repository root):
+    python bench/bench_load.py                                  # 1x4, 2x4 and 4x8 (workers x threads)
+    python bench/bench_load.py --configs 2x8 --duration 30 --players 50
+    python bench/bench_load.py --configs 4x4 --gunicorn-args=--preload   # workers share the preloaded caches
+    python bench/bench_load.py --stub-args "--latency lognormal:0.08:0.5 --server-error-rate 0.02"
+    python bench/bench_load.py --stub-args "--replay captured.jsonl --replay-latency" --json > after.json
+    python bench/bench_load.py --target http://127.0.0.1:5001   # an already running app (no gunicorn/stub started)
+
+For each configuration a fresh stub and gunicorn are started with their own
+temp directory for the snapshot database, metrics, single-flight and
+rate-limit state, so no run inherits another's warm caches. Clients are
+threads holding keep-alive connections; each picks a route by --mix weight
+and, for /lookup, a Riot ID from a pool of --players (smaller pools mean more
+cache hits). Latencies measured during --warmup are discarded. Reports
+requests per second and p50/p95/p99 per route, plus the upstream calls the
+stub served. Clients share one interpreter with the GIL: keep --concurrency
+modest, or run the generator on another machine with --target.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from urllib.parse import urlencode, urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB = os.path.join(REPO_ROOT, 'bench', 'riot_stub.py')
+
+ROUTES = ('index', 'lookup')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up within {timeout:.0f}s')
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(','):
+        route, _, weight = part.partition('=')
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}' (choose from {', '.join(ROUTES)})")
+        weights[route] = float(weight or 1)
+    return weights
+
+
+def parse_configs(spec):
+    try:
+        return [tuple(int(value) for value in part.lower().split('x')) for part in spec.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid configs '{spec}' (use WORKERSxTHREADS,...)")
+
+
+class Client(threading.Thread):
+    """One keep-alive connection issuing requests back to back until the deadline."""
+
+    def __init__(self, target, routes, weights, players, measure_from, deadline, seed):
+        super().__init__(daemon=True)
+        parts = urlsplit(target)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.routes, self.weights, self.players = routes, weights, players
+        self.measure_from, self.deadline = measure_from, deadline
+        self.rng = random.Random(seed)
+        self.samples = []  # (route, status or 0 for a connection error, seconds) after warm-up
+
+    def run(self):
+        conn = None
+        while time.perf_counter() < self.deadline:
+            route = self.rng.choices(self.routes, self.weights)[0]
+            if conn is None:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            started = time.perf_counter()
+            try:
+                if route == 'index':
+                    conn.request('GET', '/')
+                else:
+                    username, tag = self.rng.choice(self.players)
+                    body = urlencode({'username': username, 'tag': tag})
+                    conn.request('POST', '/lookup', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+                response = conn.getresponse()
+                response.read() # Includes the streamed results page tail
+                status = response.status
+                if response.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+                conn = None
+            if started >= self.measure_from:
+                self.samples.append((route, status, time.perf_counter() - started))
+        if conn is not None:
+            conn.close()
+
+
+def run_load(target, args):
+    routes = list(args.mix)
+    weights = [args.mix[route] for route in routes]
+    players = [(f'Bench{i}', f'B{i % 97}') for i in range(args.players)]
+    now = time.perf_counter()
+    measure_from, deadline = now + args.warmup, now + args.warmup + args.duration
+    clients = [
+        Client(target, routes, weights, players, measure_from, deadline, seed=args.seed + i)
+        for i in range(args.concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    samples = [sample for client in clients for sample in client.samples]
+    return summarize(samples, args.duration)
+
+
+def summarize(samples, duration):
+    report = {}
+    for route in (None,) + ROUTES:
+        selected = [s for s in samples if route is None or s[0] == route]
+        if not selected:
+            continue
+        latencies = sorted(seconds for _, _, seconds in selected)
+        report[route or 'all'] = {
+            'requests': len(selected),
+            'rps': len(selected) / duration,
+            'errors': sum(1 for _, status, _ in selected if status == 0 or status >= 500),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+    return report
+
+
+def run_config(workers, threads, args):
+    """Starts a stub and gunicorn for one configuration, runs the load and returns its report."""
+    with tempfile.TemporaryDirectory(prefix='ecaly-bench-') as tmp:
+        stub_port, app_port = free_port(), free_port()
+        stub = subprocess.Popen(
+            [sys.executable, STUB, '--port', str(stub_port), *shlex.split(args.stub_args)],
+            stderr=subprocess.DEVNULL,
+        )
+        env = {
+            **os.environ,
+            'RIOT_API_KEY': 'RGAPI-bench',
+            'RIOT_API_BASE_URL': f'http://127.0.0.1:{stub_port}/{{region}}',
+            'RIOT_APP_RATE_LIMIT': args.app_rate_limit,
+            'RIOT_RATELIMIT_STATE': os.path.join(tmp, 'ratelimit.json'),
+            'PREWARM_RATELIMIT_STATE': os.path.join(tmp, 'prewarm-ratelimit.json'),
+            'MATCH_RATELIMIT_STATE': os.path.join(tmp, 'match-ratelimit.json'),
+            'LEADERBOARD_RATELIMIT_STATE': os.path.join(tmp, 'leaderboard-ratelimit.json'),
+            'LEADERBOARD_DIR': os.path.join(tmp, 'leaderboards'),
+            'SNAPSHOT_DB': os.path.join(tmp, 'snapshots.sqlite3'),
+            'METRICS_DIR': os.path.join(tmp, 'metrics'),
+            'SINGLEFLIGHT_DIR': os.path.join(tmp, 'singleflight'),
+            'GUNICORN_THREADS': str(threads),
+            'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+        }
+        app = subprocess.Popen(
+            ['gunicorn', '--workers', str(workers), '--threads', str(threads), '--worker-class', 'gthread',
+             '--bind', f'127.0.0.1:{app_port}', '--log-level', 'warning', *shlex.split(args.gunicorn_args), 'app:app'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(f'http://127.0.0.1:{stub_port}/_stats')
+            wait_for(f'http://127.0.0.1:{app_port}/')
+            report = run_load(f'http://127.0.0.1:{app_port}', args)
+            with urllib.request.urlopen(f'http://127.0.0.1:{stub_port}/_stats', timeout=5) as response:
+                report['upstream'] = json.loads(response.read())
+            return report
+        finally:
+            for process in (app, stub):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def print_report(name, report):
+    print(f'\n{name}')
+    print(f"{'route':<10}{'requests':>10}{'rps':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, row in report.items():
+        if route == 'upstream':
+            continue
+        print(f"{route:<10}{row['requests']:>10}{row['rps']:>10.1f}{row['errors']:>8}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    if report.get('upstream'):
+        print('upstream: ' + ', '.join(f'{key}={count}' for key, count in report['upstream'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', type=parse_configs, default=parse_configs('1x4,2x4,4x8'),
+                        help='gunicorn WORKERSxTHREADS configurations to compare')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=15.0, help='measured seconds per configuration')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of load before measuring')
+    parser.add_argument('--players', type=int, default=200, help='distinct Riot IDs looked up')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('index=1,lookup=4'), help='route weights')
+    parser.add_argument('--stub-args', default='--latency lognormal:0.05:0.4', help='extra bench/riot_stub.py arguments')
+    parser.add_argument('--gunicorn-args', default='', help='extra gunicorn arguments')
+    parser.add_argument('--app-rate-limit', default='500:10,30000:600',
+                        help="the app's assumed Riot rate limit (match the stub's --app-limit)")
+    parser.add_argument('--target', help='benchmark this running app instead of starting gunicorn and the stub')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print one JSON object with every report')
+    args = parser.parse_args()
+
+    reports = {}
+    if args.target:
+        reports[args.target] = run_load(args.target.rstrip('/'), args)
+    else:
+        for workers, threads in args.configs:
+            reports[f'{workers}x{threads}'] = run_config(workers, threads, args)
+            if not args.json:
+                name = f'{workers}x{threads}'
+                print_report(f'{name} (workers x threads), {args.concurrency} clients, {args.duration:.0f}s', reports[name])
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    elif args.target:
+        print_report(f'{args.target}, {args.concurrency} clients, {args.duration:.0f}s', reports[args.target])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Filename: bench/bench_render.py
+"""Micro-benchmark for the per-request HTML render cost.
+
+Usage (from the repository root):
+    python bench/bench_render.py                      # time the working tree
+    python bench/bench_render.py --compare HEAD~1     # also time a git revision ("before")
+
+Each page is rendered inside a Flask test request context, so flashed-message
+handling is included; no Riot API calls are made.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_RANK = {'tier': 'Immortal 1', 'currenttier': 24, 'lp': 55, 'wins': 12, 'losses': 9, 'rank_icon_url': None}
+
+# name -> callable(app_module) rendering one page
+CASES = {
+    'index': lambda app: app.render_index_page(),
+    'results (ranked)': lambda app: app.render_results_page('PlayerName', 'TAG', rank_data=SAMPLE_RANK),
+    'results (error)': lambda app: app.render_results_page('PlayerName', 'TAG', error='Riot ID not found.'),
+}
+
+
+def measure(tree, number):
+    """Imports app.py from `tree` and returns {case: microseconds per render}."""
+    sys.path.insert(0, tree)
+    os.chdir(tree)
+    import app  # noqa: E402 - imported from the tree under test
+
+    results = {}
+    with app.app.test_request_context('/'):
+        for name, render in CASES.items():
+            render(app)  # Warm-up (fills any caches)
+            best = min(timeit.repeat(lambda: render(app), number=number, repeat=9))
+            results[name] = best / number * 1e6
+    return results
+
+
+def run_in_subprocess(tree, number):
+    # Fresh interpreter per tree so the two app.py versions never share module state
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--tree', tree, '--number', str(number), '--json'],
+        env={**os.environ, 'RIOT_API_KEY': os.environ.get('RIOT_API_KEY', 'RGAPI-bench')},
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def export_revision(revision, target):
+    archive = subprocess.check_output(['git', 'archive', revision], cwd=REPO_ROOT)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--compare', metavar='REV', help='git revision to benchmark as the baseline')
+    parser.add_argument('--number', type=int, default=2000, help='renders per timing run')
+    parser.add_argument('--tree', help=argparse.SUPPRESS)
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.tree:
+        print(json.dumps(measure(args.tree, args.number)))
+        return
+
+    after = run_in_subprocess(REPO_ROOT, args.number)
+    before = None
+    if args.compare:
+        with tempfile.TemporaryDirectory() as tmp:
+            export_revision(args.compare, tmp)
+            before = run_in_subprocess(tmp, args.number)
+
+    if before:
+        print(f"{'page':<20}{args.compare + ' (us)':>16}{'working tree (us)':>20}{'speedup':>10}")
+        for name in CASES:
+            print(f"{name:<20}{before[name]:>16.1f}{after[name]:>20.1f}{before[name] / after[name]:>9.1f}x")
+    else:
+        print(f"{'page':<20}{'us/render':>12}")
+        for name in CASES:
+            print(f"{name:<20}{after[name]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+# Filename: bench/riot_stub.py
+"""Local stand-in for the Riot Account, Ranked, MMR, Match and Content APIs, for benchmarks that must not spend the API key.
+
+Usage (from the repository root):
+    python bench/riot_stub.py --port 8700
+    RIOT_API_BASE_URL='http://127.0.0.1:8700/{region}' gunicorn app:app
+
+    # Slow, flaky upstream: lognormal latency (median 80ms), 2% 5xx, 1% 429, MMR 3x slower
+    python bench/riot_stub.py --latency lognormal:0.08:0.5 --latency val-mmr-by-puuid=lognormal:0.24:0.5 \\
+        --server-error-rate 0.02 --throttle-rate 0.01
+
+    # Record real responses once, then replay them offline
+    RIOT_API_KEY=RGAPI-... python bench/riot_stub.py --record captured.jsonl
+    python bench/riot_stub.py --replay captured.jsonl --replay-latency
+
+Requests are served under /<region>/<Riot API path>, e.g.
+/americas/riot/account/v1/accounts/by-riot-id/Name/TAG. Every response carries
+the X-App-Rate-Limit / X-Method-Rate-Limit headers (and their -Count
+companions); calls beyond those limits get a real 429 with Retry-After, as
+Riot would send. Synthetic players are derived from their Riot ID, so every
+run sees the same ranks and match histories (the oldest quarter of each
+history belongs to the previous act). The current act's leaderboard lists
+the first --leaderboard-players of bench/bench_load.py's players. GET /_stats returns the calls served so far, per
+endpoint and status.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote
+
+# Endpoint name (as used by riot_client.py for per-method rate limits) -> path prefix after /<region>
+ENDPOINTS = {
+    'account-by-riot-id': '/riot/account/v1/accounts/by-riot-id/',
+    'active-shard-by-puuid': '/riot/account/v1/active-shards/by-game/val/by-puuid/',
+    'val-ranked-by-puuid': '/val/ranked/v1/by-puuid/',
+    'val-mmr-by-puuid': '/val/mmr/v1/by-puuid/',
+    'val-matchlist-by-puuid': '/val/match/v1/matchlists/by-puuid/',
+    'val-match-by-id': '/val/match/v1/matches/',
+    'val-leaderboard-by-act': '/val/ranked/v1/leaderboards/by-act/',
+    'val-content': '/val/content/v1/contents',
+}
+
+# Synthetic match histories: seasonId of the current and previous act, and when the first match started
+ACTS = ('stub-act-current', 'stub-act-previous')
+MATCH_EPOCH_MS = 1_700_000_000_000
+
+TIERS = [
+    'Iron 1', 'Iron 2', 'Iron 3', 'Bronze 1', 'Bronze 2', 'Bronze 3', 'Silver 1', 'Silver 2', 'Silver 3',
+    'Gold 1', 'Gold 2', 'Gold 3', 'Platinum 1', 'Platinum 2', 'Platinum 3', 'Diamond 1', 'Diamond 2', 'Diamond 3',
+    'Ascendant 1', 'Ascendant 2', 'Ascendant 3', 'Immortal 1', 'Immortal 2', 'Immortal 3', 'Radiant',
+]
+
+# Headers worth keeping from recorded responses (the rest are Riot edge/CDN noise)
+RECORDED_HEADERS = (
+    'Content-Type', 'Retry-After', 'X-Rate-Limit-Type',
+    'X-App-Rate-Limit', 'X-App-Rate-Limit-Count', 'X-Method-Rate-Limit', 'X-Method-Rate-Limit-Count',
+)
+
+
+def parse_latency(spec):
+    """Parses "fixed:S", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA" (seconds) into a sampling function."""
+    kind, *params = spec.split(':')
+    try:
+        values = [float(value) for value in params]
+        if kind == 'fixed' and len(values) == 1:
+            return lambda rng: values[0]
+        if kind == 'uniform' and len(values) == 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        if kind == 'lognormal' and len(values) == 2:
+            mu = math.log(values[0])
+            return lambda rng: rng.lognormvariate(mu, values[1])
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid latency '{spec}' (use fixed:S, uniform:LO:HI or lognormal:MEDIAN:SIGMA)")
+
+
+def parse_limits(spec):
+    """Parses a Riot rate-limit spec "20:1,100:120" into [(20, 1), (100, 120)]."""
+    try:
+        return [(int(count), int(seconds)) for count, seconds in (part.split(':') for part in spec.split(','))]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate limit '{spec}' (use COUNT:SECONDS,...)")
+
+
+class RateWindows:
+    """Riot-style fixed-window counters for one limit spec (e.g. app limit of one region)."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._windows = [[0, 0.0] for _ in limits]  # [count, window start] per limit
+
+    def hit(self, now):
+        """Counts one call; returns (counts header, retry_after or None if allowed)."""
+        retry_after = None
+        for (count, seconds), window in zip(self.limits, self._windows):
+            if now - window[1] >= seconds:
+                window[0], window[1] = 0, now
+            if window[0] >= count:
+                retry_after = max(retry_after or 1, math.ceil(window[1] + seconds - now))
+        if retry_after is None:
+            for window in self._windows:
+                window[0] += 1
+        return self.header(self._windows), retry_after
+
+    def header(self, windows=None):
+        return ','.join(f'{window[0]}:{seconds}' for (_, seconds), window in zip(self.limits, windows or self._windows))
+
+
+class StubState:
+    """Configuration, rate-limit windows, recorded responses and call statistics shared by all handler threads."""
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = {'': parse_latency('fixed:0')}
+        for spec in args.latency:
+            endpoint, _, dist = spec.rpartition('=')
+            if endpoint and endpoint not in ENDPOINTS:
+                raise SystemExit(f"unknown endpoint '{endpoint}' in --latency (choose from {', '.join(ENDPOINTS)})")
+            self.latency[endpoint] = parse_latency(dist)
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.windows = {}  # (region, endpoint or None for the app limit) -> RateWindows
+        self.stats = Counter()  # "endpoint status" -> calls
+        self.replay = {}  # request path -> deque of recorded responses (cycled)
+        if args.replay:
+            self._load_replay(args.replay)
+        self.record_file = open(args.record, 'a', encoding='utf-8') if args.record else None
+        self.upstream = None
+        if args.record:
+            import requests  # Only needed to talk to the real API
+            api_key = os.environ.get('RIOT_API_KEY', '')
+            if not api_key.startswith('RGAPI-'):
+                raise SystemExit('--record needs a real RIOT_API_KEY in the environment')
+            self.upstream = requests.Session()
+            self.upstream.headers.update({'X-Riot-Token': api_key, 'Accept': 'application/json'})
+
+    def _load_replay(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.replay.setdefault(entry['path'], deque()).append(entry)
+        print(f'riot_stub: loaded {sum(map(len, self.replay.values()))} recorded responses for {len(self.replay)} paths', file=sys.stderr)
+
+    def sample_latency(self, endpoint):
+        sample = self.latency.get(endpoint, self.latency[''])
+        with self.lock:
+            return max(0.0, sample(self.rng))
+
+    def roll(self, rate):
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def rate_limit(self, region, endpoint):
+        """Counts the call against the app and method windows; returns (headers, 429 headers or None)."""
+        now = time.monotonic()
+        with self.lock:
+            app = self._windows(region, None, self.args.app_limit)
+            method = self._windows(region, endpoint, self.args.method_limit)
+            app_counts, app_retry = app.hit(now)
+            method_counts, method_retry = (method.header(), None) if app_retry else method.hit(now)
+        headers = {
+            'X-App-Rate-Limit': ','.join(f'{c}:{s}' for c, s in self.args.app_limit),
+            'X-App-Rate-Limit-Count': app_counts,
+            'X-Method-Rate-Limit': ','.join(f'{c}:{s}' for c, s in self.args.method_limit),
+            'X-Method-Rate-Limit-Count': method_counts,
+        }
+        if app_retry or method_retry:
+            limit_type = 'application' if app_retry else 'method'
+            return headers, {'Retry-After': str(app_retry or method_retry), 'X-Rate-Limit-Type': limit_type}
+        return headers, None
+
+    def _windows(self, region, endpoint, limits):
+        key = (region, endpoint)
+        windows = self.windows.get(key)
+        if windows is None:
+            windows = self.windows[key] = RateWindows(limits)
+        return windows
+
+    def next_replay(self, path):
+        with self.lock:
+            entries = self.replay.get(path)
+            if not entries:
+                return None
+            entries.rotate(-1) # Cycle through every capture of this path
+            return entries[-1]
+
+    def record(self, entry):
+        with self.lock:
+            self.record_file.write(json.dumps(entry) + '\n')
+            self.record_file.flush()
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.stats[f'{endpoint} {status}'] += 1
+
+
+def synthetic_response(state, endpoint, args, params=None):
+    """Deterministic fake payload for a request: (status, body)."""
+    key = '/'.join(args).lower()
+    digest = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16)
+    if endpoint == 'account-by-riot-id':
+        name, tag = args[0], args[1]
+        return 200, {'puuid': f'stub-{hashlib.sha1(key.encode()).hexdigest()}', 'gameName': name, 'tagLine': tag}
+    if endpoint == 'active-shard-by-puuid':
+        return 200, {'puuid': args[0], 'game': 'val', 'activeShard': state.args.shard}
+    if endpoint == 'val-ranked-by-puuid':
+        return 200, {'players': []}
+    if endpoint == 'val-matchlist-by-puuid':
+        history = [
+            {'matchId': f'{args[0]}.{i}', 'gameStartTimeMillis': MATCH_EPOCH_MS + i * 1_800_000, 'queueId': 'competitive'}
+            for i in range(5 + digest % 40)
+        ]
+        return 200, {'puuid': args[0], 'history': history[::-1]}
+    if endpoint == 'val-content':
+        return 200, {'acts': [
+            {'id': act, 'name': f'ACT {len(ACTS) - i}', 'type': 'act', 'isActive': i == 0} for i, act in enumerate(ACTS)
+        ]}
+    if endpoint == 'val-leaderboard-by-act':
+        if args[0] != ACTS[0]:
+            return 404, {'status': {'status_code': 404, 'message': 'Data not found - no leaderboard for act'}}
+        total = state.args.leaderboard_players
+        size = min(200, int((params or {}).get('size', ['200'])[0]))
+        start = int((params or {}).get('startIndex', ['0'])[0])
+        players = []
+        for i in range(start, min(total, start + size)):
+            name, tag = f'Bench{i}', f'B{i % 97}' # Same players, and so PUUIDs, as bench_load.py
+            puuid = f"stub-{hashlib.sha1(f'{name}/{tag}'.lower().encode()).hexdigest()}"
+            players.append({
+                'puuid': puuid, 'gameName': name, 'tagLine': tag, 'leaderboardRank': i + 1,
+                'rankedRating': max(0, 1200 - i), 'numberOfWins': 40 + (total - i) % 120, 'competitiveTier': 27 if i < 500 else 26,
+            })
+        return 200, {'actId': args[0], 'shard': state.args.shard, 'totalPlayers': total, 'players': players}
+    if endpoint == 'val-match-by-id':
+        puuid, _, index = args[0].rpartition('.')
+        count = 5 + int(hashlib.sha1(puuid.lower().encode()).hexdigest()[:8], 16) % 40
+        won = digest % 2 == 0
+        return 200, {
+            'matchInfo': {'matchId': args[0], 'queueId': 'competitive', 'isRanked': True,
+                          'seasonId': ACTS[int(index) < count // 4]},
+            'players': [{'puuid': puuid, 'teamId': 'Red'}],
+            'teams': [{'teamId': 'Red', 'won': won}, {'teamId': 'Blue', 'won': not won}],
+        }
+    if state.roll(state.args.no_content_rate):
+        return 204, None
+    tier = digest % len(TIERS)
+    return 200, {'data': {
+        'currenttier': tier + 3,
+        'currenttierpatched': TIERS[tier],
+        'ranking_in_tier': digest % 100,
+        'wins': digest % 200,
+    }}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+    server_version = 'riot-stub'
+    state = None  # StubState, set in main()
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self._send(200, dict(sorted(self.state.stats.items())), {})
+        region, _, rest = self.path.lstrip('/').partition('/')
+        rest, _, query = ('/' + rest).partition('?')
+        endpoint = next((name for name, prefix in ENDPOINTS.items() if rest.startswith(prefix)), None)
+        if endpoint is None:
+            return self._send(404, {'status': {'status_code': 404, 'message': 'Data not found - unknown path'}}, {})
+        args = [unquote(part) for part in rest[len(ENDPOINTS[endpoint]):].split('/')]
+        state, options = self.state, self.state.args
+
+        if state.upstream is not None:
+            return self._proxy(endpoint, region, f'{rest}?{query}' if query else rest)
+
+        headers, throttled = state.rate_limit(region, endpoint)
+        recorded = state.next_replay(f'{rest}?{query}' if query else rest) if state.replay else None
+        delay = recorded['latency'] if recorded and options.replay_latency else state.sample_latency(endpoint)
+        time.sleep(delay)
+        if throttled:
+            return self._send(429, {'status': {'status_code': 429, 'message': 'Rate limit exceeded'}}, {**headers, **throttled}, endpoint)
+        if state.roll(options.throttle_rate): # Service-level 429 (Riot's own capacity), not caused by our counts
+            return self._send(429, {'status': {'status_code': 429, 'message': 'Rate limit exceeded'}},
+                              {**headers, 'Retry-After': '1', 'X-Rate-Limit-Type': 'service'}, endpoint)
+        if state.roll(options.server_error_rate):
+            status = state.rng.choice((500, 502, 503, 504))
+            return self._send(status, {'status': {'status_code': status, 'message': 'Internal server error'}}, headers, endpoint)
+        if recorded:
+            return self._send(recorded['status'], recorded['body'], {**recorded.get('headers', {}), **headers}, endpoint)
+        if state.roll(options.not_found_rate):
+            return self._send(404, {'status': {'status_code': 404, 'message': 'Data not found'}}, headers, endpoint)
+        status, body = synthetic_response(state, endpoint, args, parse_qs(query))
+        self._send(status, body, headers, endpoint)
+
+    def _proxy(self, endpoint, region, path):
+        started = time.perf_counter()
+        response = self.state.upstream.get(f'https://{region}.api.riotgames.com{path}', timeout=(3.05, 15))
+        latency = time.perf_counter() - started
+        headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+        body = response.json() if response.content else None
+        self.state.record({'path': path, 'status': response.status_code, 'headers': headers, 'body': body, 'latency': round(latency, 4)})
+        self._send(response.status_code, body, headers, endpoint)
+
+    def _send(self, status, body, headers, endpoint=None):
+        payload = b'' if body is None or status == 204 else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            if name.lower() not in ('content-type', 'content-length'):
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        if endpoint:
+            self.state.count(endpoint, status)
+
+    def log_message(self, format, *args):
+        pass # One line per call would dominate the stub's own CPU time
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--latency', action='append', default=[], metavar='[ENDPOINT=]DIST',
+                        help='response latency, e.g. lognormal:0.08:0.5 or val-mmr-by-puuid=uniform:0.1:0.4 (repeatable)')
+    parser.add_argument('--not-found-rate', type=float, default=0.0, help='share of calls answered 404')
+    parser.add_argument('--no-content-rate', type=float, default=0.0, help='share of MMR calls answered 204')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of calls answered 429 (service limit)')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='share of calls answered 5xx')
+    parser.add_argument('--app-limit', type=parse_limits, default=parse_limits('500:10,30000:600'),
+                        help='app rate limit per region, advertised and enforced (default: production key)')
+    parser.add_argument('--method-limit', type=parse_limits, default=parse_limits('2000:10'),
+                        help='method rate limit per region and endpoint')
+    parser.add_argument('--shard', default='na', help='active shard reported for every player')
+    parser.add_argument('--leaderboard-players', type=int, default=1000, help="players on the current act's leaderboard")
+    parser.add_argument('--seed', type=int, default=1, help='random seed for latencies and error rolls')
+    parser.add_argument('--record', metavar='FILE', help='proxy to the real Riot API and append responses to FILE (JSON lines)')
+    parser.add_argument('--replay', metavar='FILE', help='answer recorded paths from FILE; others stay synthetic')
+    parser.add_argument('--replay-latency', action='store_true', help='use the recorded latency instead of --latency')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.record and args.replay:
+        raise SystemExit('--record and --replay are mutually exclusive')
+    StubHandler.state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f'riot_stub: listening on http://{args.host}:{server.server_port}/{{region}}', file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(sorted(StubHandler.state.stats.items()))), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Filename: cache.py
+# --- In-process caches used by the lookup path ---
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by get() when a key is absent or expired (None is a valid cached value)
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """Returns the cached value, or `default` if missing/expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)  # Mark as most recently used
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores a value, evicting the least recently used entry when full."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# Freshness states reported by StaleWhileRevalidateCache.get()
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+class StaleWhileRevalidateCache:
+    """Thread-safe LRU cache with a fresh window and a stale-but-servable window.
+
+    Entries younger than `fresh_ttl` are FRESH. Entries older than that but
+    younger than `fresh_ttl + stale_ttl` are STALE: callers should serve them
+    and trigger a background refresh (see try_begin_refresh()).
+    """
+
+    def __init__(self, maxsize, fresh_ttl, stale_ttl):
+        self.maxsize = max(1, int(maxsize))
+        self.fresh_ttl = float(fresh_ttl)
+        self.stale_ttl = float(stale_ttl)
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (value, state); value is MISSING when state is MISS."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING, MISS
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+            if age >= self.fresh_ttl + self.stale_ttl:
+                del self._data[key]
+                return MISSING, MISS
+            self._data.move_to_end(key)
+            return value, (FRESH if age < self.fresh_ttl else STALE)
+
+    def set(self, key, value, age=0.0):
+        """Stores `value`; `age` (seconds) back-dates it, e.g. for entries restored from disk."""
+        with self._lock:
+            self._data[key] = (time.monotonic() - age, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def age(self, key):
+        """Seconds since `key` was stored, or None if absent; does not count as a use for LRU."""
+        with self._lock:
+            entry = self._data.get(key)
+            return None if entry is None else time.monotonic() - entry[0]
+
+    def try_begin_refresh(self, key):
+        """Claims the background refresh for `key`; False if one is already running."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,164 @@
+# Filename: compression.py
+# --- WSGI response compression (gzip, and brotli when the module is installed) ---
+import gzip
+import os
+import zlib
+
+try:
+    import brotli  # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# --- Configuration ---
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 512))  # Bytes; smaller bodies aren't worth it
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))  # Per-request (dynamic) responses
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml",
+)
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks 'br', 'gzip' or None from an Accept-Encoding header, honouring q=0."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    wildcard = accepted.get("*", 0.0)
+    if brotli and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("x-gzip", wildcard)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding, static=False):
+    """One-shot compression; `static` bodies are compressed once, so spend maximum effort."""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if static else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compresses compressible responses according to the client's Accept-Encoding.
+
+    - Responses with a Content-Length are buffered and compressed whole, or served
+      from the precompressed variants registered with precompress().
+    - Streamed responses (no Content-Length, e.g. the early-flush results page and
+      NDJSON batches) are compressed chunk by chunk with a sync flush after each
+      chunk, so early flushes still reach the client immediately.
+    """
+
+    def __init__(self, app, min_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+        self._static_variants = {}  # body bytes -> {encoding: compressed bytes}
+
+    def precompress(self, body):
+        """Compresses a fully static body once for every supported encoding; returns `body` unchanged."""
+        encodings = ["gzip"] + (["br"] if brotli else [])
+        self._static_variants[body] = {encoding: compress(body, encoding, static=True) for encoding in encodings}
+        return body
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get("HTTP_ACCEPT_ENCODING"))
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured["status"], captured["headers"], captured["exc_info"] = status, headers, exc_info
+            return lambda data: None  # Legacy write() callable; unused by Flask
+
+        app_iter = self.app(environ, capture_start_response)
+        status, headers = captured["status"], captured["headers"]
+        header_map = {name.lower(): value for name, value in headers}
+
+        if not self._should_compress(environ, status, header_map):
+            start_response(status, headers, captured["exc_info"])
+            return app_iter
+        headers = self._add_vary(headers, header_map)
+        if encoding is None:
+            start_response(status, headers, captured["exc_info"])
+            return app_iter
+
+        if "content-length" not in header_map:
+            start_response(status, self._encoded_headers(headers, encoding, None), captured["exc_info"])
+            return self._stream(app_iter, encoding)
+
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        if len(body) < self.min_size:
+            start_response(status, headers, captured["exc_info"])
+            return [body]
+        variants = self._static_variants.get(body)
+        compressed = variants[encoding] if variants else compress(body, encoding)
+        start_response(status, self._encoded_headers(headers, encoding, len(compressed)), captured["exc_info"])
+        return [compressed]
+
+    # --- Helpers ---
+
+    @staticmethod
+    def _should_compress(environ, status, header_map):
+        if environ.get("REQUEST_METHOD") == "HEAD" or status[:3] in ("204", "304"):
+            return False
+        if "content-encoding" in header_map or "no-transform" in header_map.get("cache-control", ""):
+            return False
+        return header_map.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def _add_vary(headers, header_map):
+        vary = header_map.get("vary")
+        if vary and "accept-encoding" in vary.lower():
+            return headers
+        headers = [(name, value) for name, value in headers if name.lower() != "vary"]
+        headers.append(("Vary", f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"))
+        return headers
+
+    @staticmethod
+    def _encoded_headers(headers, encoding, content_length):
+        result = []
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == "content-length":
+                continue
+            if lowered == "etag" and not value.startswith("W/"):
+                value = "W/" + value  # Compressed bytes differ from the identity representation
+            result.append((name, value))
+        result.append(("Content-Encoding", encoding))
+        if content_length is not None:
+            result.append(("Content-Length", str(content_length)))
+        return result
+
+    @staticmethod
+    def _stream(app_iter, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            process, sync_flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31: gzip container
+            process, finish = compressor.compress, compressor.flush
+            sync_flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    data = process(chunk) + sync_flush()
+                    if data:
+                        yield data
+            yield finish()
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
@@ -0,0 +1,289 @@
+# Filename: content_catalog.py
+# --- Competitive tier catalog: numeric tier id -> name, division, colour and icon ---
+# (plus the active act id, from Riot's content API)
+# Loaded from the snapshot bundled in content/ (or the last refreshed copy on disk). Riot's
+# /val/content/v1/contents has no tier metadata (colours, icons), so the only refresh source
+# is the community competitivetiers feed, whose format the bundled snapshot also uses; it is
+# a third-party service, so refreshing from it is opt-in (CONTENT_TIERS_URL). Icons are
+# served by the app itself (/static/tiers/<id>.png) from content/tier_icons/, or from copies
+# the opt-in refresh downloads, never hotlinked. Lookups are an index into a precomputed
+# tuple, so rendering never waits on a content call.
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+from structured_log import get_logger
+
+log = get_logger("content_catalog")
+
+# --- Configuration ---
+CONTENT_TIERS_SNAPSHOT = os.environ.get(
+    "CONTENT_TIERS_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "content", "competitive_tiers.json")
+)
+# Opt-in refresh source in valorant-api.com format (e.g. https://valorant-api.com/v1/competitivetiers);
+# empty uses only the bundled snapshot and icons
+CONTENT_TIERS_URL = os.environ.get("CONTENT_TIERS_URL", "")
+CONTENT_REFRESH_INTERVAL = float(os.environ.get("CONTENT_REFRESH_INTERVAL", 6 * 3600))  # Seconds between conditional GETs
+# Last refreshed payload and its validators, shared by every worker and reused after restarts
+CONTENT_TIERS_CACHE = os.environ.get("CONTENT_TIERS_CACHE", os.path.join(tempfile.gettempdir(), "ecaly-competitive-tiers.json"))
+# Tier icons as <tier id>.png: bundled ones, then copies downloaded by the opt-in refresh (which take precedence)
+CONTENT_TIER_ICONS = os.environ.get(
+    "CONTENT_TIER_ICONS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "content", "tier_icons")
+)
+CONTENT_TIER_ICONS_CACHE = os.environ.get("CONTENT_TIER_ICONS_CACHE", os.path.join(tempfile.gettempdir(), "ecaly-tier-icons"))
+CONTENT_ACT_INTERVAL = float(os.environ.get("CONTENT_ACT_INTERVAL", 3600))  # Seconds between active-act checks (Riot content API)
+CONTENT_ACT_RETRY = 60.0  # Seconds before retrying a failed active-act check
+
+TIER_ICON_URL = "/static/tiers/{}.png"  # Served by app.py from the icon directories above
+
+Tier = namedtuple("Tier", "id name division color icon_url")
+
+
+def parse_tiers(payload):
+    """competitivetiers payload -> tuple indexed by tier id (None for gaps), from the newest tier table.
+
+    `icon_url` is the payload's (remote) icon URL; TierCatalog replaces it with the local one.
+    """
+    tables = payload.get("data") or []
+    if not tables or not tables[-1].get("tiers"):
+        raise ValueError("no competitive tier table in payload")
+    entries = {}
+    for entry in tables[-1]["tiers"]: # Tables are listed oldest first; ranks use the current one
+        division = (entry.get("divisionName") or "").title()
+        if division in ("", "Unused"):
+            continue
+        color = (entry.get("color") or "888888")[:6]
+        entries[int(entry["tier"])] = Tier(
+            int(entry["tier"]), entry["tierName"].title(), division, f"#{color}", entry.get("largeIcon") or entry.get("smallIcon")
+        )
+    return tuple(entries.get(tier_id) for tier_id in range(max(entries) + 1))
+
+
+def active_acts(payload):
+    """Active act ids (type "act", not episodes) from a /val/content/v1/contents payload."""
+    return [
+        act["id"] for act in payload.get("acts") or ()
+        if act.get("isActive") and (act.get("type") or "act").lower() == "act"
+    ]
+
+
+class TierCatalog:
+    """Competitive tiers as a tuple indexed by `currenttier`, swapped atomically on refresh.
+
+    `version` changes whenever the tiers do, so memoized renders can key on it.
+    A tier's `icon_url` is its local TIER_ICON_URL when an icon file exists
+    (see icon_path()), else None. With a refresh `url`, the refresh thread
+    starts on first use in each process (after a gunicorn fork).
+    """
+
+    def __init__(self, snapshot_path=CONTENT_TIERS_SNAPSHOT, url=CONTENT_TIERS_URL,
+                 refresh_interval=CONTENT_REFRESH_INTERVAL, cache_path=CONTENT_TIERS_CACHE,
+                 icons_dir=CONTENT_TIER_ICONS, icons_cache_dir=CONTENT_TIER_ICONS_CACHE):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.cache_path = cache_path
+        self.icons_dir = icons_dir
+        self.icons_cache_dir = icons_cache_dir
+        self.version = 0
+        self._tiers = ()
+        self._by_name = {}
+        self._validators = {}  # ETag / Last-Modified of the loaded payload
+        self._thread_pid = None
+        self._cache_seen = time.time()  # Cache file writes after this are adopted by refresh()
+        self._lock = threading.Lock()
+        for path in (cache_path if url else None, snapshot_path): # A refreshed copy only while refreshing is opted into
+            if path and self._load_file(path):
+                break
+
+    def tier(self, tier_id):
+        """The Tier for a numeric `currenttier`, or None if unknown."""
+        self._ensure_refresher()
+        tiers = self._tiers
+        return tiers[tier_id] if isinstance(tier_id, int) and 0 <= tier_id < len(tiers) else None
+
+    def by_name(self, name):
+        """The Tier for a display name such as "Immortal 1" (case-insensitive), or None."""
+        self._ensure_refresher()
+        return self._by_name.get(name.lower()) if name else None
+
+    def resolve(self, tier_id, name):
+        """The Tier for a rank: by id when it matches `name` (Riot has renumbered tiers before), else by name."""
+        tier = self.tier(tier_id)
+        if tier is not None and (not name or tier.name.lower() == name.lower()):
+            return tier
+        return self.by_name(name) or tier
+
+    def icon_path(self, tier_id):
+        """The local icon file for a tier id (downloaded copy first, then the bundled one), or None."""
+        for directory in (self.icons_cache_dir if self.url else None, self.icons_dir):
+            path = os.path.join(directory, f"{int(tier_id)}.png") if directory else None
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    def _localize(self, tiers):
+        """Swaps each tier's remote icon URL for the local one (None without an icon file)."""
+        return tuple(
+            tier and tier._replace(icon_url=TIER_ICON_URL.format(tier.id) if self.icon_path(tier.id) else None)
+            for tier in tiers
+        )
+
+    def _install(self, tiers, validators):
+        by_name = {tier.name.lower(): tier for tier in tiers if tier is not None}
+        with self._lock:
+            self._tiers, self._by_name, self._validators = tiers, by_name, validators
+            self.version += 1
+
+    def _load_file(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                document = json.load(f)
+            validators = document.pop("_validators", {}) if isinstance(document, dict) else {}
+            self._install(self._localize(parse_tiers(document)), validators)
+            return True
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning("content.load_failed", "Could not load competitive tiers", path=path, error=str(e))
+            return False
+
+    # --- Background refresh ---
+
+    def _ensure_refresher(self):
+        if self._thread_pid != os.getpid() and self.url:
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    threading.Thread(target=self._run, name="content-refresh", daemon=True).start()
+
+    def _run(self):
+        try: # Skip the startup GET when some worker refreshed recently
+            time.sleep(max(0.0, self.refresh_interval - (time.time() - os.path.getmtime(self.cache_path))))
+        except (OSError, TypeError):
+            pass
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("content.refresh_failed", "Competitive tier refresh failed", error=str(e))
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        """One conditional GET; returns True if the tiers changed."""
+        if self._load_newer_cache():
+            return True
+        headers = {}
+        if self._validators.get("etag"):
+            headers["If-None-Match"] = self._validators["etag"]
+        if self._validators.get("last_modified"):
+            headers["If-Modified-Since"] = self._validators["last_modified"]
+        response = requests.get(self.url, headers=headers, timeout=(3.05, 15))
+        if response.status_code == 304:
+            log.debug("content.not_modified", "Competitive tiers unchanged")
+            return False
+        response.raise_for_status()
+        payload = response.json()
+        tiers = parse_tiers(payload)
+        self._download_icons(tiers)
+        tiers = self._localize(tiers)
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        if tiers == self._tiers:
+            self._validators = validators
+            return False
+        self._install(tiers, validators)
+        self._save_cache(payload, validators)
+        log.info("content.refreshed", "Competitive tiers updated", tiers=sum(tier is not None for tier in tiers), version=self.version)
+        return True
+
+    def _load_newer_cache(self):
+        # Another worker may have refreshed already: adopt its copy instead of asking again
+        try:
+            changed = os.path.getmtime(self.cache_path) > self._cache_seen
+        except (OSError, TypeError):
+            return False
+        if not changed:
+            return False
+        self._cache_seen = time.time()
+        before = self._tiers
+        return self._load_file(self.cache_path) and self._tiers != before
+
+    def _download_icons(self, tiers):
+        """Copies the icons of a refreshed payload into icons_cache_dir (missing ones only), to serve locally."""
+        if not self.icons_cache_dir:
+            return
+        for tier in tiers:
+            if tier is None or not tier.icon_url or not tier.icon_url.startswith("https://"):
+                continue
+            path = os.path.join(self.icons_cache_dir, f"{tier.id}.png")
+            if os.path.isfile(path):
+                continue
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                response = requests.get(tier.icon_url, timeout=(3.05, 15))
+                response.raise_for_status()
+                os.makedirs(self.icons_cache_dir, exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(response.content)
+                os.replace(tmp_path, path)
+            except (OSError, requests.exceptions.RequestException) as e:
+                log.warning("content.icon_failed", "Could not download tier icon", tier=tier.id, error=str(e))
+
+    def _save_cache(self, payload, validators):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({**payload, "_validators": validators}, f)
+            os.replace(tmp_path, self.cache_path)
+            self._cache_seen = time.time()
+        except OSError as e:
+            log.warning("content.save_failed", "Could not save competitive tiers", path=self.cache_path, error=str(e))
+
+
+class ActiveAct:
+    """The active competitive act id from Riot's content API, re-checked every `interval` seconds.
+
+    current() never blocks: a due check runs on a short-lived thread, and
+    current() returns None until the first check succeeds.
+    """
+
+    def __init__(self, client, region, interval=CONTENT_ACT_INTERVAL):
+        self.client = client
+        self.region = region
+        self.interval = interval
+        self._act = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        if time.monotonic() >= self._next_check:
+            with self._lock:
+                if time.monotonic() >= self._next_check:
+                    self._next_check = time.monotonic() + self.interval
+                    threading.Thread(target=self.refresh, name="act-refresh", daemon=True).start()
+        return self._act
+
+    def refresh(self):
+        """One content API call; returns the active act id (unchanged on failure)."""
+        try:
+            response = self.client.get_content(self.region)
+            response.raise_for_status()
+            acts = active_acts(response.json())
+        except Exception as e:
+            log.warning("content.act_failed", "Could not fetch the active act", region=self.region, error=str(e))
+            self._next_check = time.monotonic() + min(self.interval, CONTENT_ACT_RETRY)
+            return self._act
+        if acts and acts[0] != self._act:
+            log.info("content.act", "Active act changed", act=acts[0], previous=self._act)
+            self._act = acts[0]
+        return self._act
+
+
+# Process-wide catalog used when rendering ranks
+tier_catalog = TierCatalog()
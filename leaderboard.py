@@ -0,0 +1,343 @@
+# Filename: leaderboard.py
+# --- Local index of the ranked leaderboards (the Immortal and Radiant players) ---
+# Top-tier players are the most looked-up profiles, and every one of them is on Riot's ranked
+# leaderboard. A background job pages through /val/ranked/v1/leaderboards/by-act for each
+# configured shard and act, folding each page into a compact index (and a file on disk) as it
+# arrives, so the full leaderboard is never held as JSON. Lookups for those players are then
+# answered from the index with no per-request upstream call. One worker per host ingests
+# (flock); the others load its files when they change.
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from content_catalog import active_acts
+from popularity import scale_rate_limits
+from rate_limit import SharedRateLimiter, RateLimitExceeded, RIOT_APP_RATE_LIMIT
+from structured_log import get_logger
+
+try:
+    import fcntl  # POSIX only; without it every worker ingests for itself
+except ImportError:
+    fcntl = None
+
+log = get_logger("leaderboard")
+
+# --- Configuration ---
+# VALORANT shards whose leaderboards are ingested, e.g. "na,eu,ap"; empty disables the index
+LEADERBOARD_REGIONS = [r.strip().lower() for r in os.environ.get("LEADERBOARD_REGIONS", "").split(",") if r.strip()]
+# Act IDs to ingest, the one that answers lookups first; empty means the active act from the content API
+LEADERBOARD_ACTS = [a.strip() for a in os.environ.get("LEADERBOARD_ACTS", "").split(",") if a.strip()]
+LEADERBOARD_PAGE_SIZE = int(os.environ.get("LEADERBOARD_PAGE_SIZE", 200))  # Players per page (Riot's maximum)
+LEADERBOARD_INTERVAL = float(os.environ.get("LEADERBOARD_INTERVAL", 1800))  # Seconds between ingestion runs
+LEADERBOARD_MAX_AGE = float(os.environ.get("LEADERBOARD_MAX_AGE", 2 * 3600))  # Older indexes answer no lookups
+LEADERBOARD_POLL = float(os.environ.get("LEADERBOARD_POLL", 30))  # Seconds between checks for another worker's files
+# Throttled (429) attempts per page before the pass is abandoned; the previous index keeps answering lookups
+LEADERBOARD_PAGE_RETRIES = int(os.environ.get("LEADERBOARD_PAGE_RETRIES", 5))
+LEADERBOARD_RETRY_MAX_WAIT = 60.0  # Longest sleep before retrying a throttled page
+# Index files shared by every worker on the host; set to an empty string to keep the index in memory only
+LEADERBOARD_DIR = os.environ.get("LEADERBOARD_DIR", os.path.join(tempfile.gettempdir(), "ecaly-leaderboards"))
+# Fraction of the app rate limit that ingestion may use, host-wide (its own token bucket)
+LEADERBOARD_RATE_SHARE = float(os.environ.get("LEADERBOARD_RATE_SHARE", 0.1))
+LEADERBOARD_RATELIMIT_STATE = os.environ.get(
+    "LEADERBOARD_RATELIMIT_STATE", os.path.join(tempfile.gettempdir(), "ecaly-leaderboard-ratelimit.json")
+)
+
+LeaderboardEntry = namedtuple(
+    "LeaderboardEntry", "region act puuid riot_id leaderboard_rank ranked_rating wins competitive_tier updated_at"
+)
+
+
+class LeaderboardIndex:
+    """One shard's leaderboard for one act: rows in parallel arrays, found by PUUID or Riot ID.
+
+    Anonymous players (no PUUID or name in the payload) are not indexed.
+    """
+
+    def __init__(self, region, act, updated_at=None):
+        self.region = region
+        self.act = act
+        self.updated_at = updated_at or time.time()
+        self._rows = {}  # PUUID -> row
+        self._names = {}  # "gamename#tagline" (lowercase) -> row
+        self._puuids = []
+        self._riot_ids = []  # "GameName#TagLine" as Riot spells it
+        self._ranks = array("i")
+        self._ratings = array("i")
+        self._wins = array("i")
+        self._tiers = array("b")
+
+    def __len__(self):
+        return len(self._puuids)
+
+    def add(self, puuid, riot_id, leaderboard_rank, ranked_rating, wins, competitive_tier):
+        if not puuid or puuid in self._rows:
+            return
+        row = len(self._puuids)
+        self._rows[puuid] = row
+        if riot_id:
+            self._names.setdefault(riot_id.lower(), row)
+        self._puuids.append(puuid)
+        self._riot_ids.append(riot_id)
+        self._ranks.append(leaderboard_rank)
+        self._ratings.append(ranked_rating)
+        self._wins.append(wins)
+        self._tiers.append(competitive_tier)
+
+    def by_puuid(self, puuid):
+        row = self._rows.get(puuid)
+        return None if row is None else self._entry(row)
+
+    def by_riot_id(self, riot_id):
+        row = self._names.get(riot_id.lower())
+        return None if row is None else self._entry(row)
+
+    def _entry(self, row):
+        return LeaderboardEntry(
+            self.region, self.act, self._puuids[row], self._riot_ids[row], self._ranks[row],
+            self._ratings[row], self._wins[row], self._tiers[row], self.updated_at,
+        )
+
+
+def parse_player(player):
+    """LeaderboardPlayer payload -> index row (puuid, riot_id, leaderboard_rank, ranked_rating, wins, competitive_tier)."""
+    name, tag = player.get("gameName") or "", player.get("tagLine") or ""
+    return (
+        player.get("puuid") or "", f"{name}#{tag}" if name and tag else "",
+        int(player.get("leaderboardRank") or 0), int(player.get("rankedRating") or 0),
+        int(player.get("numberOfWins") or 0), int(player.get("competitiveTier") or 0),
+    )
+
+
+class Leaderboards:
+    """Leaderboard indexes for the configured shards and acts, kept current by a background thread.
+
+    lookup_puuid() / lookup_riot_id() never block on I/O. The thread starts on
+    first use in each process (after a gunicorn fork); each pass, the worker
+    that wins the ingest lock re-pages any leaderboard older than `interval`,
+    and every worker loads index files written since it last looked.
+    """
+
+    def __init__(self, client, regions=LEADERBOARD_REGIONS, acts=LEADERBOARD_ACTS, page_size=LEADERBOARD_PAGE_SIZE,
+                 interval=LEADERBOARD_INTERVAL, max_age=LEADERBOARD_MAX_AGE, poll=LEADERBOARD_POLL,
+                 directory=LEADERBOARD_DIR, rate_share=LEADERBOARD_RATE_SHARE):
+        self.client = client
+        self.regions = list(regions)
+        self.configured_acts = list(acts)
+        self.page_size = max(1, min(200, page_size))
+        self.interval = interval
+        self.max_age = max_age
+        self.poll = poll
+        self.directory = directory or None
+        self.enabled = bool(self.regions) and rate_share > 0
+        self.budget = SharedRateLimiter(
+            state_path=LEADERBOARD_RATELIMIT_STATE, app_limits=scale_rate_limits(RIOT_APP_RATE_LIMIT, rate_share),
+            max_wait=max(poll, 60.0),
+        )
+        self.acts = list(acts)  # Ingested acts, lookup order; filled from the content API when not configured
+        self._indexes = {}  # (region, act) -> LeaderboardIndex, replaced whole on each ingest
+        self._loaded = {}  # index file path -> mtime it was loaded at
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    # --- Lookups ---
+
+    def lookup_puuid(self, region, puuid):
+        """The player's leaderboard entry in `region`, or None."""
+        return self._find((region,), lambda index: index.by_puuid(puuid))
+
+    def lookup_riot_id(self, regions, username, tag):
+        """The leaderboard entry for a Riot ID in any of `regions` (shards), or None."""
+        riot_id = f"{username.strip()}#{tag.strip()}"
+        return self._find(regions, lambda index: index.by_riot_id(riot_id))
+
+    def _find(self, regions, find):
+        if not self.enabled:
+            return None
+        self._ensure_thread()
+        oldest = time.time() - self.max_age
+        indexes = self._indexes
+        for act in self.acts:
+            for region in regions:
+                index = indexes.get((region, act))
+                if index is not None and index.updated_at >= oldest:
+                    entry = find(index)
+                    if entry is not None:
+                        return entry
+        return None
+
+    # --- Background ingestion ---
+
+    def _ensure_thread(self):
+        if self._thread_pid != os.getpid():
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    threading.Thread(target=self._run, name="leaderboard-ingest", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception("leaderboard.pass_failed", "Leaderboard pass failed", e)
+            time.sleep(self.poll)
+
+    def run_once(self):
+        """Loads newer index files, then ingests stale leaderboards if this worker holds the ingest lock."""
+        self._load_files()
+        lock_fd = self._try_lock()
+        if lock_fd is False:
+            return # Another worker is ingesting
+        try:
+            self._load_files() # It may have finished just before we got the lock
+            if not self.configured_acts and self._stale(self.acts):
+                self._refresh_acts()
+            for act in self.acts:
+                for region in self.regions:
+                    index = self._indexes.get((region, act))
+                    if index is None or time.time() - index.updated_at >= self.interval:
+                        self.ingest(region, act)
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd) # Also releases the flock
+
+    def _stale(self, acts):
+        return not acts or any(
+            time.time() - index.updated_at >= self.interval for index in self._indexes.values() if index.act in acts
+        )
+
+    def _refresh_acts(self):
+        response = self.client.get_content(self.regions[0])
+        response.raise_for_status()
+        acts = active_acts(response.json())
+        if acts and acts != self.acts:
+            log.info("leaderboard.acts", "Active act changed", acts=acts)
+            self.acts = acts
+            self._write_acts(acts)
+
+    def ingest(self, region, act):
+        """Pages through one leaderboard, indexing (and writing) each page as it arrives."""
+        started = time.monotonic()
+        index = LeaderboardIndex(region, act)
+        path = self._path(region, act)
+        out = open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") if path else None
+        try:
+            start = 0
+            while True:
+                page = self._fetch_page(region, act, start)
+                if page is None:
+                    break # No leaderboard for this act on this shard
+                players = page.get("players") or ()
+                for player in players:
+                    row = parse_player(player)
+                    index.add(*row)
+                    if out:
+                        out.write("\t".join(map(str, row)) + "\n")
+                start += len(players)
+                if not players or start >= int(page.get("totalPlayers") or 0):
+                    break
+            if out:
+                out.close()
+                os.replace(out.name, path) # Atomic: other workers never load a partial file
+                self._loaded[path] = os.path.getmtime(path)
+        except BaseException:
+            if out:
+                out.close()
+                _remove(out.name)
+            raise
+        self._indexes = {**self._indexes, (region, act): index}
+        log.info("leaderboard.ingested", "Leaderboard indexed", region=region, act=act, players=len(index),
+                 pages=-(-start // self.page_size), seconds=round(time.monotonic() - started, 1))
+
+    def _fetch_page(self, region, act, start):
+        """One page of players, None if the shard has no leaderboard for `act`; raises once retries run out."""
+        for attempt in range(LEADERBOARD_PAGE_RETRIES + 1):
+            if attempt:
+                time.sleep(min(retry_after, LEADERBOARD_RETRY_MAX_WAIT))
+            self.budget.acquire(region, "leaderboard")
+            try:
+                response = self.client.get_leaderboard(region, act, self.page_size, start)
+            except RateLimitExceeded as e:
+                retry_after = e.retry_after
+                continue
+            if response.status_code == 429:
+                retry_after = float(response.headers.get("Retry-After") or 1)
+                continue
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        # Still throttled: give up this pass (and the ingest lock) rather than retry forever
+        raise RateLimitExceeded(region, "leaderboard", retry_after)
+
+    # --- Index files ---
+
+    def _path(self, region, act):
+        return os.path.join(self.directory, f"{region}-{act}.tsv") if self.directory else None
+
+    def _try_lock(self):
+        """An fd holding the host-wide ingest lock, None when there is nothing to lock, or False if it is taken."""
+        if not self.directory:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.directory, "ingest.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return False
+
+    def _write_acts(self, acts):
+        if not self.directory:
+            return
+        tmp_path = os.path.join(self.directory, f"acts.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(acts, f)
+        os.replace(tmp_path, os.path.join(self.directory, "acts.json"))
+
+    def _load_files(self):
+        if not self.directory:
+            return
+        if not self.configured_acts:
+            try:
+                with open(os.path.join(self.directory, "acts.json"), "r", encoding="utf-8") as f:
+                    self.acts = json.load(f)
+            except (OSError, ValueError):
+                pass
+        for act in self.acts:
+            for region in self.regions:
+                path = self._path(region, act)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if self._loaded.get(path) != mtime:
+                    self._load_file(path, region, act, mtime)
+
+    def _load_file(self, path, region, act, mtime):
+        index = LeaderboardIndex(region, act, updated_at=mtime)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    puuid, riot_id, *counts = line.rstrip("\n").split("\t")
+                    index.add(puuid, riot_id, *map(int, counts))
+        except (OSError, ValueError) as e:
+            log.warning("leaderboard.load_failed", "Could not load leaderboard index", path=path, error=str(e))
+            return
+        self._loaded[path] = mtime
+        self._indexes = {**self._indexes, (region, act): index}
+        log.debug("leaderboard.loaded", "Loaded leaderboard index", region=region, act=act, players=len(index))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,236 @@
+# Filename: match_history.py
+# --- Per-player competitive win/loss tally for the current act, built from match history ---
+# The MMR endpoint has no wins/losses, so they are counted from Match-v1 instead. Each refresh
+# costs one matchlist call plus only the matches not counted yet: the tally remembers the
+# newest counted match (extended forward, oldest first) and the oldest one (backfilled
+# towards the start of the act, newest first), so the counted matches are always one
+# contiguous run and a refresh cut short by the fetch limit or an error resumes next time.
+# Until backfill is complete the counts cover only part of the act, so they are not shown.
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache, MISSING
+from popularity import scale_rate_limits
+from rate_limit import SharedRateLimiter, RateLimitExceeded, RIOT_APP_RATE_LIMIT
+from structured_log import get_logger
+
+log = get_logger("match_history")
+
+# --- Configuration ---
+MATCH_TALLY_ENABLED = os.environ.get("MATCH_TALLY_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+MATCH_FETCH_LIMIT = int(os.environ.get("MATCH_FETCH_LIMIT", 20))  # Matches fetched per refresh; the rest wait for the next one
+MATCH_FETCH_CONCURRENCY = int(os.environ.get("MATCH_FETCH_CONCURRENCY", 4))  # Match fetches in flight per process
+MATCH_REFRESH_THREADS = int(os.environ.get("MATCH_REFRESH_THREADS", 2))  # Tally refreshes running at once per process
+MATCH_REFRESH_BACKLOG = int(os.environ.get("MATCH_REFRESH_BACKLOG", 64))  # Refreshes queued or running; more are skipped
+MATCH_TALLY_CACHE_SIZE = int(os.environ.get("MATCH_TALLY_CACHE_SIZE", 20000))
+MATCH_TALLY_CACHE_TTL = float(os.environ.get("MATCH_TALLY_CACHE_TTL", 3600))  # Seconds before re-reading the store
+# Fraction of the app rate limit that matchlist/match calls may use, host-wide (its own token bucket),
+# so backfilling a long history never starves the rank calls lookups wait on
+MATCH_RATE_SHARE = float(os.environ.get("MATCH_RATE_SHARE", 0.2))
+MATCH_RATELIMIT_STATE = os.environ.get(
+    "MATCH_RATELIMIT_STATE", os.path.join(tempfile.gettempdir(), "ecaly-match-ratelimit.json")
+)
+# Match-v1 needs a production API key; after a 401/403 stop asking for this long
+MATCH_FORBIDDEN_BACKOFF = float(os.environ.get("MATCH_FORBIDDEN_BACKOFF", 3600))
+
+COMPETITIVE_QUEUE = "competitive"
+
+
+def empty_tally():
+    # complete: backfill reached the start of the act (or the oldest match the matchlist has); backfill_before is 0 then
+    return {"act": None, "wins": 0, "losses": 0, "last_match_id": None, "last_match_start": 0, "backfill_before": 0,
+            "complete": False}
+
+
+def match_outcome(match, puuid):
+    """(act id, True/False for a win/loss or None for a draw or absent player) from a MatchDto."""
+    info = match.get("matchInfo") or {}
+    team_id = next((player.get("teamId") for player in match.get("players") or () if player.get("puuid") == puuid), None)
+    won = next((team.get("won") for team in match.get("teams") or () if team_id is not None and team.get("teamId") == team_id), None)
+    if won is False and not any(team.get("won") for team in match.get("teams") or ()):
+        won = None # Nobody won: a draw counts as neither
+    return info.get("seasonId"), won
+
+
+class MatchTally:
+    """Keeps each player's current-act wins/losses up to date from their match history.
+
+    refresh() returns the tally dict (see empty_tally()) after folding in the
+    matches it could fetch, and persists it when it changed. Every call first
+    takes a token from a dedicated bucket sized at `rate_share` of the app rate
+    limit (never waiting: an empty bucket ends the refresh early), and match
+    fetches run on a small pool shared by every refresh in the process, so a
+    first lookup's backfill can't crowd out the rank calls. submit() runs
+    refreshes on their own threads too, so a backfill that outlives the caller's
+    wait never holds up a thread other lookups need.
+
+    `active_act` (a callable returning the active act id, or None while
+    unknown) decides whether a tally's counts are current: a player with no
+    games yet this act still has last act's tally. A tally still backfilling
+    is never current: its counts are only part of the act.
+    """
+
+    def __init__(self, client, store, fetch_limit=MATCH_FETCH_LIMIT, concurrency=MATCH_FETCH_CONCURRENCY,
+                 cache_size=MATCH_TALLY_CACHE_SIZE, cache_ttl=MATCH_TALLY_CACHE_TTL, enabled=MATCH_TALLY_ENABLED, rate_share=MATCH_RATE_SHARE,
+                 active_act=None, refresh_threads=MATCH_REFRESH_THREADS, refresh_backlog=MATCH_REFRESH_BACKLOG):
+        self.client = client
+        self.store = store
+        self.active_act = active_act
+        self.fetch_limit = fetch_limit
+        self.concurrency = max(1, concurrency)
+        self.enabled = enabled and rate_share > 0
+        self.budget = SharedRateLimiter(
+            state_path=MATCH_RATELIMIT_STATE, app_limits=scale_rate_limits(RIOT_APP_RATE_LIMIT, rate_share), max_wait=0
+        )
+        # Key: (valorant_region, puuid); Value: tally dict. Also covers the store's write-behind delay
+        self._tallies = TTLCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="match-fetch")
+        self._refresh_executor = ThreadPoolExecutor(max_workers=max(1, refresh_threads), thread_name_prefix="match-refresh")
+        self._backlog = threading.BoundedSemaphore(max(1, refresh_backlog))
+        self._forbidden_until = 0.0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) (a refresh) on the tally's own threads; returns its future, or None when the backlog is full."""
+        if not self._backlog.acquire(blocking=False):
+            return None
+        try:
+            future = self._refresh_executor.submit(fn, *args)
+        except BaseException:
+            self._backlog.release()
+            raise
+        future.add_done_callback(lambda _: self._backlog.release())
+        return future
+
+    def is_current(self, tally, act=None):
+        """True if `tally` has counted all of `act`: by default the active act (assumed when not known yet)."""
+        if not tally or tally["act"] is None or not tally["complete"]:
+            return False
+        if act is None:
+            act = self.active_act() if self.active_act else None
+        return act is None or tally["act"] == act
+
+    def cached(self, valorant_region, puuid):
+        """The last known tally without any upstream call, or None."""
+        key = (valorant_region, puuid)
+        tally = self._tallies.get(key)
+        if tally is MISSING:
+            tally = self.store.match_tally(valorant_region, puuid)
+            if tally is not None:
+                self._tallies.set(key, tally)
+        return tally
+
+    def refresh(self, valorant_region, puuid):
+        """Fetches the matchlist and the uncounted matches; returns the updated tally (None if none is known yet)."""
+        if not self.enabled or time.monotonic() < self._forbidden_until or not self._spend(valorant_region, 1):
+            return self.cached(valorant_region, puuid)
+        response = self.client.get_matchlist_by_puuid(valorant_region, puuid)
+        if response.status_code in (401, 403):
+            self._forbid(response.status_code)
+            return self.cached(valorant_region, puuid)
+        if response.status_code == 404:
+            return self.cached(valorant_region, puuid) # No match history
+        response.raise_for_status()
+        history = [
+            (entry["gameStartTimeMillis"], entry["matchId"]) for entry in response.json().get("history") or ()
+            if entry.get("queueId") == COMPETITIVE_QUEUE
+        ]
+
+        before = self.cached(valorant_region, puuid) or empty_tally()
+        tally = dict(before)
+        pending = self._uncounted(tally, history)[:self.fetch_limit]
+        fetched = 0
+        for offset in range(0, len(pending), self.concurrency): # One round of concurrent fetches at a time
+            chunk = pending[offset:offset + self.concurrency]
+            chunk = chunk[:self._spend(valorant_region, len(chunk))]
+            if not chunk:
+                break # Budget share used up for now; the next refresh continues
+            matches = list(self._executor.map(lambda entry: self._fetch_match(valorant_region, entry[1]), chunk))
+            fetched += len(chunk)
+            if not self._fold_all(tally, puuid, chunk, matches):
+                break
+        if tally["last_match_id"] is not None and not tally["complete"] \
+                and not any(started < tally["backfill_before"] for started, _ in history):
+            tally.update(backfill_before=0, complete=True) # Counted back to the oldest match the matchlist has
+        if tally != before:
+            self._tallies.set((valorant_region, puuid), tally)
+            self.store.record_match_tally(valorant_region, puuid, tally)
+            log.debug("match.tally_updated", "Updated match tally", puuid=puuid, region=valorant_region,
+                      wins=tally["wins"], losses=tally["losses"], complete=tally["complete"], fetched=fetched)
+        return tally
+
+    @staticmethod
+    def _uncounted(tally, history):
+        """Matches to fetch, in fold order: newer ones oldest first, then older ones newest first."""
+        if tally["last_match_id"] is None:
+            return sorted(history, reverse=True)
+        newer = sorted(entry for entry in history if entry[0] > tally["last_match_start"])
+        older = sorted((entry for entry in history if entry[0] < tally["backfill_before"]), reverse=True)
+        return newer + older
+
+    @classmethod
+    def _fold_all(cls, tally, puuid, entries, matches):
+        for (started, match_id), match in zip(entries, matches):
+            if match is None:
+                return False # Keep the counted run contiguous: retry this match (and everything after it) next refresh
+            if not cls._fold(tally, puuid, started, match_id, match):
+                return False # Reached the previous act: backfill is complete
+        return True
+
+    @staticmethod
+    def _fold(tally, puuid, started, match_id, match):
+        """Counts one match into `tally`; returns False once backfill reaches an earlier act."""
+        act, won = match_outcome(match, puuid)
+        newer = tally["last_match_id"] is not None and started > tally["last_match_start"]
+        if act is None: # Match Riot no longer has: just step past it
+            act = tally["act"]
+        if tally["act"] is None:
+            tally["act"] = act
+        elif act != tally["act"]:
+            if not newer:
+                tally.update(backfill_before=0, complete=True)
+                return False
+            # A new act started; acts don't overlap, so nothing before this match belongs to it
+            tally.update(empty_tally(), act=act, last_match_id=match_id, last_match_start=started, complete=True)
+            newer = True
+        if won is not None:
+            tally["wins" if won else "losses"] += 1
+        if newer or tally["last_match_id"] is None:
+            tally["last_match_id"], tally["last_match_start"] = match_id, started
+        if not newer:
+            tally["backfill_before"] = started
+        return True
+
+    def _spend(self, valorant_region, calls):
+        """Takes up to `calls` tokens from the match budget; returns how many it got."""
+        for taken in range(calls):
+            try:
+                self.budget.acquire(valorant_region, "match")
+            except RateLimitExceeded:
+                return taken
+        return calls
+
+    def _fetch_match(self, valorant_region, match_id):
+        """The MatchDto, {} for a match Riot no longer has, or None if it could not be fetched."""
+        try:
+            response = self.client.get_match(valorant_region, match_id)
+            if response.status_code == 404:
+                return {}
+            if response.status_code in (401, 403):
+                self._forbid(response.status_code)
+                return None
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            log.warning("match.fetch_failed", "Could not fetch match", match_id=match_id, region=valorant_region, error=str(e))
+            return None
+
+    def _forbid(self, status_code):
+        with self._lock:
+            if time.monotonic() >= self._forbidden_until:
+                log.warning("match.forbidden", "Match-v1 refused for this API key, pausing match tallies",
+                            status=status_code, seconds=MATCH_FORBIDDEN_BACKOFF)
+            self._forbidden_until = time.monotonic() + MATCH_FORBIDDEN_BACKOFF
@@ -0,0 +1,299 @@
+# Filename: metrics.py
+# --- Minimal Prometheus metrics, aggregated across gunicorn workers ---
+# Each process keeps its samples in memory and a background thread writes them to
+# METRICS_DIR/metrics-<pid>.json about once a second. GET /metrics merges every
+# process's file: counters and histograms are summed over all processes (including
+# exited workers, whose totals are folded into an archive file so counters never go
+# backwards), gauges only over processes that are still alive.
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from structured_log import get_logger
+
+try:
+    import fcntl  # POSIX only; without it exited workers' files are left in place
+except ImportError:
+    fcntl = None
+
+# --- Configuration ---
+# Shared directory for per-process metric files; set to an empty string to report this process only
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "ecaly-metrics"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1.0))  # Seconds between file writes
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+RENDER_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+_ARCHIVE_FILE = "metrics-archive.json"
+
+log = get_logger("metrics")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.registry.add(self.name, label_values, amount)
+
+
+class Gauge(_Metric):
+    """Summed across live processes (e.g. in-flight requests)."""
+    kind = "gauge"
+
+    def inc(self, *label_values, amount=1):
+        self.registry.add(self.name, label_values, amount)
+
+    def dec(self, *label_values, amount=1):
+        self.registry.add(self.name, label_values, -amount)
+
+    @contextmanager
+    def track(self, *label_values):
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, help_text, labelnames)
+
+    def observe(self, value, *label_values):
+        self.registry.observe(self.name, label_values, bisect.bisect_left(self.buckets, value), value, len(self.buckets))
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+
+class MetricsRegistry:
+    """Holds metric definitions and this process's samples; renders the merged exposition text."""
+
+    def __init__(self, shared_dir=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.shared_dir = shared_dir or None
+        self.flush_interval = flush_interval
+        self._metrics = {}  # name -> metric, in registration order
+        self._values = {}  # (name, label values) -> number, or [bucket counts..., +Inf count, sum] for histograms
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if self.shared_dir:
+            try:
+                os.makedirs(self.shared_dir, exist_ok=True)
+            except OSError as e:
+                log.warning("metrics.per_process", "Metrics are per-process, could not create the shared directory", path=self.shared_dir, error=str(e))
+                self.shared_dir = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+
+    # --- Recording (request path: one dict update under a lock) ---
+
+    def add(self, name, label_values, amount):
+        self._ensure_flusher()
+        key = (name, label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, label_values, bucket_index, value, bucket_count):
+        self._ensure_flusher()
+        key = (name, label_values)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (bucket_count + 1) + [0.0]
+            entry[bucket_index] += 1 # Non-cumulative here; made cumulative when rendering
+            entry[-1] += value
+
+    # --- Cross-process files ---
+
+    def _ensure_flusher(self):
+        if self.shared_dir and self._flusher_pid != os.getpid():
+            with self._lock:
+                if self._flusher_pid != os.getpid():
+                    if self._flusher_pid is not None:
+                        self._values = {} # Forked child: the parent's samples are reported by the parent
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._run_flusher, name="metrics-flush", daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Writes this process's samples to its file in the shared directory (atomic replace)."""
+        if not self.shared_dir:
+            return
+        with self._lock:
+            samples = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+        path = os.path.join(self.shared_dir, f"metrics-{os.getpid()}.json")
+        try:
+            _write_json(path, {"pid": os.getpid(), "samples": samples})
+        except OSError as e:
+            log.warning("metrics.write_failed", "Could not write metrics file", path=path, error=str(e))
+
+    def _merged_values(self):
+        if not self.shared_dir:
+            with self._lock:
+                return dict(self._values)
+        self.flush()
+        merged = {}
+        for live, samples in self._read_process_files():
+            for name, labels, value in samples:
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not live):
+                    continue
+                _merge_sample(merged, (name, tuple(labels)), value)
+        return merged
+
+    def _read_process_files(self):
+        """Returns [(live, samples)] for every process file plus the archive of exited workers."""
+        lock_fd = os.open(os.path.join(self.shared_dir, "metrics.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl:
+                # Exclusive while folding exited workers into the archive, shared while reading,
+                # so a scrape never sees a worker's totals both in its own file and in the archive
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                self._archive_dead()
+                fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            files = []
+            for name in self._file_names():
+                data = _read_json(os.path.join(self.shared_dir, name))
+                if data is not None:
+                    pid = data.get("pid")
+                    files.append((pid is not None and _pid_alive(pid), data.get("samples", [])))
+            return files
+        finally:
+            os.close(lock_fd) # Also releases the flock
+
+    def _file_names(self):
+        try:
+            return [name for name in os.listdir(self.shared_dir) if name.startswith("metrics-") and name.endswith(".json")]
+        except OSError:
+            return []
+
+    def _archive_dead(self):
+        """Folds exited workers' counters/histograms into the archive file and removes their files (lock held)."""
+        dead = []
+        for name in self._file_names():
+            pid = name[len("metrics-"):-len(".json")]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(name)
+        if not dead:
+            return
+        archive_path = os.path.join(self.shared_dir, _ARCHIVE_FILE)
+        archive = {}
+        for name, labels, value in (_read_json(archive_path) or {}).get("samples", []):
+            archive[(name, tuple(labels))] = value
+        for file_name in dead:
+            for name, labels, value in (_read_json(os.path.join(self.shared_dir, file_name)) or {}).get("samples", []):
+                metric = self._metrics.get(name)
+                if metric is not None and metric.kind != "gauge":
+                    _merge_sample(archive, (name, tuple(labels)), value)
+        try:
+            _write_json(archive_path, {"pid": None, "samples": [[name, list(labels), value] for (name, labels), value in archive.items()]})
+            for file_name in dead: # Only after the archive holds their totals
+                os.unlink(os.path.join(self.shared_dir, file_name))
+        except OSError as e:
+            log.warning("metrics.archive_failed", "Could not archive metrics of exited workers", error=str(e))
+
+    # --- Exposition ---
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4) for all processes."""
+        merged = self._merged_values()
+        by_name = {}
+        for (name, labels), value in merged.items():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_name.get(name, ()), key=lambda item: item[0]):
+                label_pairs = list(zip(metric.labelnames, labels))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(label_pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(label_pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_pairs)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(label_pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge_sample(merged, key, value):
+    existing = merged.get(key)
+    if existing is None:
+        merged[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        merged[key] = [a + b for a, b in zip(existing, value)]
+    else:
+        merged[key] = existing + value
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path) # Atomic: readers never see a partial file
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True # Exists but owned by someone else
+    return True
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry used by every module
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,96 @@
+# Filename: page_templates.py
+# --- Tiny precompiled template layer for the hand-written HTML pages ---
+# Templates are split into static segments once at import time; rendering a page is a
+# single "".join() over those segments and the per-request values, instead of
+# re-interpolating multi-kilobyte f-strings on every request.
+import datetime
+import threading
+import time
+from string import Formatter
+
+
+class Template:
+    """Template text with {name} slots, compiled once into static segments.
+
+    Keyword arguments given to the constructor are substituted immediately
+    (e.g. asset URLs known at import), so only the remaining slots are filled per
+    render. The segments are compiled into a single f-string expression, so a
+    render is one string build with no per-request parsing or concatenation.
+    Values are inserted as-is: callers escape user input themselves.
+    """
+
+    def __init__(self, text, **static_values):
+        segments = []
+        slots = []  # Slot name after each segment but the last
+        literal = ""
+        for text_before, field, _, _ in Formatter().parse(text):
+            literal += text_before
+            if field is None:
+                continue
+            if field in static_values:
+                literal += str(static_values[field])
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"Invalid template slot name: {field!r}")
+            segments.append(literal)
+            slots.append(field)
+            literal = ""
+        segments.append(literal)
+        self.segments = tuple(segments)
+        self.slot_names = frozenset(slots)
+        # render(**slot_values) -> str; bound per instance so calls go straight to the compiled function
+        self.render = _compile(segments, slots)
+
+
+def _compile(segments, slots):
+    """Builds `render(*, slot...)` returning f"{_s0}{slot}{_s1}..." with segments bound as closure cells."""
+    names = sorted(set(slots))
+    expression = "".join(f"{{_s{i}}}{{{slot}}}" for i, slot in enumerate(slots)) + f"{{_s{len(slots)}}}"
+    params = f"*, {', '.join(names)}" if names else ""
+    source = (
+        f"def _make({', '.join(f'_s{i}' for i in range(len(segments)))}):\n"
+        f"    def render({params}):\n"
+        f"        return f'{expression}'\n"
+        f"    return render\n"
+    )
+    namespace = {}
+    exec(compile(source, "<page_templates>", "exec"), namespace)
+    return namespace["_make"](*segments)
+
+
+# --- Footer year (cached until the next New Year instead of calling datetime.now() per page) ---
+_year_lock = threading.Lock()
+_year_cache = (0, 0.0)  # (year, epoch seconds when it ends)
+
+def current_year():
+    global _year_cache
+    year, expires_at = _year_cache
+    if time.time() < expires_at:
+        return year
+    with _year_lock:
+        now = datetime.datetime.now()
+        next_new_year = datetime.datetime(now.year + 1, 1, 1)
+        _year_cache = (now.year, next_new_year.timestamp())
+        return now.year
+
+
+class PageCache:
+    """Caches fully rendered static pages; entries are rebuilt when the footer year changes."""
+
+    def __init__(self):
+        self._pages = {}  # key -> (year, html)
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        year = current_year()
+        entry = self._pages.get(key)
+        if entry is not None and entry[0] == year:
+            return entry[1]
+        page = render()
+        with self._lock:
+            self._pages[key] = (year, page)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
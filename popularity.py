@@ -0,0 +1,167 @@
+# Filename: popularity.py
+# --- Heavy-hitter tracking and background pre-warming of popular players ---
+# Lookup traffic is heavily skewed toward a few players. A space-saving sketch tracks the
+# most looked-up rank cache keys in bounded memory, and a background thread refreshes the
+# top entries shortly before they go stale, drawing from its own slice of the Riot rate budget.
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+from rate_limit import SharedRateLimiter, RateLimitExceeded, RIOT_APP_RATE_LIMIT
+from structured_log import get_logger
+
+# --- Configuration ---
+PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+PREWARM_TRACKED = int(os.environ.get("PREWARM_TRACKED", 1000))  # Keys held by the sketch (memory bound)
+PREWARM_TOP_K = int(os.environ.get("PREWARM_TOP_K", 100))  # Most popular keys kept warm
+PREWARM_MIN_HITS = int(os.environ.get("PREWARM_MIN_HITS", 3))  # Ignore keys looked up fewer times than this
+PREWARM_INTERVAL = float(os.environ.get("PREWARM_INTERVAL", 10))  # Seconds between refresh passes
+PREWARM_LEAD = float(os.environ.get("PREWARM_LEAD", 30))  # Refresh entries this many seconds before they go stale
+PREWARM_DECAY_INTERVAL = float(os.environ.get("PREWARM_DECAY_INTERVAL", 300))  # Counts are halved this often
+# Fraction of the app rate limit that pre-warming may use, host-wide (its own token bucket)
+PREWARM_RATE_SHARE = float(os.environ.get("PREWARM_RATE_SHARE", 0.2))
+PREWARM_RATELIMIT_STATE = os.environ.get(
+    "PREWARM_RATELIMIT_STATE", os.path.join(tempfile.gettempdir(), "ecaly-prewarm-ratelimit.json")
+)
+
+log = get_logger("popularity")
+
+
+class SpaceSaving:
+    """Space-saving top-K sketch: approximate counts for the most frequent keys in O(capacity) memory.
+
+    A new key arriving when the sketch is full replaces the key with the
+    smallest count and inherits that count (so counts may over-estimate by at
+    most the inherited amount). A lazily maintained min-heap finds that key
+    without scanning every entry.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self._counts = {}  # key -> count
+        self._heap = []  # (count when pushed, seq, key); exactly one entry per key, count is a lower bound
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def offer(self, key, weight=1):
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts[key] = count + weight # Heap entry is refreshed lazily on eviction
+                return
+            floor = 0
+            if len(self._counts) >= self.capacity:
+                floor = self._evict_min()
+            self._counts[key] = floor + weight
+            heapq.heappush(self._heap, (floor + weight, next(self._seq), key))
+
+    def _evict_min(self):
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            current = self._counts[key]
+            if current == count:
+                del self._counts[key]
+                return count
+            heapq.heappush(self._heap, (current, next(self._seq), key)) # Stale lower bound: re-file it
+
+    def top(self, k):
+        """The k most frequent keys as [(key, count)], most frequent first."""
+        with self._lock:
+            return heapq.nlargest(k, self._counts.items(), key=lambda item: item[1])
+
+    def decay(self):
+        """Halves every count so popularity follows recent traffic; drops keys that reach zero."""
+        with self._lock:
+            self._counts = {key: count // 2 for key, count in self._counts.items() if count // 2}
+            self._heap = [(count, next(self._seq), key) for key, count in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._counts)
+
+
+def scale_rate_limits(spec, share):
+    """Scales a Riot rate-limit spec: ("20:1,100:120", 0.2) -> "4:1,20:120" (at least 1 per window)."""
+    parts = []
+    for part in spec.split(","):
+        count, _, seconds = part.strip().partition(":")
+        try:
+            parts.append(f"{max(1, int(int(count) * share))}:{seconds}")
+        except ValueError:
+            continue
+    return ",".join(parts)
+
+
+class Prewarmer:
+    """Keeps the most popular keys warm by refreshing them before their cache entries go stale.
+
+    Keys are rank cache keys, (valorant_region, puuid). `needs_refresh(key)`
+    says whether a key's entry is missing or about to go stale, and
+    `refresh(key)` fetches it (blocking). Each refresh first takes all of its
+    `calls_per_refresh` tokens at once from a dedicated host-wide bucket sized at
+    `rate_share` of the app rate limit; a pass stops as soon as the bucket is empty.
+    The thread starts on the first record() in each process (i.e. after a gunicorn fork).
+    """
+
+    def __init__(self, needs_refresh, refresh, calls_per_refresh, enabled=PREWARM_ENABLED,
+                 tracked=PREWARM_TRACKED, top_k=PREWARM_TOP_K, min_hits=PREWARM_MIN_HITS,
+                 interval=PREWARM_INTERVAL, decay_interval=PREWARM_DECAY_INTERVAL, rate_share=PREWARM_RATE_SHARE):
+        self.enabled = enabled and rate_share > 0
+        self.tracker = SpaceSaving(tracked)
+        self.needs_refresh = needs_refresh
+        self.refresh = refresh
+        self.calls_per_refresh = calls_per_refresh
+        self.top_k = top_k
+        self.min_hits = min_hits
+        self.interval = interval
+        self.decay_interval = decay_interval
+        self.budget = SharedRateLimiter(
+            state_path=PREWARM_RATELIMIT_STATE, app_limits=scale_rate_limits(RIOT_APP_RATE_LIMIT, rate_share), max_wait=0
+        )
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def record(self, key):
+        """Counts one lookup of `key` (cheap; called on the request path)."""
+        if not self.enabled:
+            return
+        self.tracker.offer(key)
+        if self._thread_pid != os.getpid():
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    threading.Thread(target=self._run, name="rank-prewarm", daemon=True).start()
+
+    def _run(self):
+        decay_at = time.monotonic() + self.decay_interval
+        while True:
+            time.sleep(self.interval)
+            try:
+                refreshed = self.run_once()
+                if refreshed:
+                    log.info("prewarm.pass", "Pre-warmed popular rank entries", refreshed=refreshed)
+            except Exception as e:
+                log.exception("prewarm.failed", "Pre-warm pass failed", e)
+            if time.monotonic() >= decay_at:
+                self.tracker.decay()
+                decay_at = time.monotonic() + self.decay_interval
+
+    def run_once(self):
+        """One refresh pass over the current top-K; returns how many keys were refreshed."""
+        refreshed = 0
+        for key, hits in self.tracker.top(self.top_k):
+            if hits < self.min_hits:
+                break # Sorted by hits: the rest are even less popular
+            if not self.needs_refresh(key):
+                continue
+            try: # All of a refresh's calls or none, so a dry bucket never strands tokens on a skipped key
+                self.budget.acquire(key[0], "prewarm", tokens=self.calls_per_refresh)
+            except RateLimitExceeded:
+                break # Budget share used up for now; the next pass continues
+            self.refresh(key)
+            refreshed += 1
+        return refreshed
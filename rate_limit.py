@@ -0,0 +1,193 @@
+# Filename: rate_limit.py
+# --- Host-wide outbound rate limiter for the Riot API ---
+# Riot enforces an application limit per region and a method limit per region+endpoint,
+# advertised in X-App-Rate-Limit / X-Method-Rate-Limit (e.g. "20:1,100:120" = 20 per 1s and 100 per 120s).
+# Bucket state lives in one small JSON file guarded by flock(), so every gunicorn worker
+# on the host draws from the same budget instead of each assuming it owns the whole key.
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl  # POSIX only; without it the limiter is per-process
+except ImportError:
+    fcntl = None
+
+# --- Configuration ---
+RIOT_RATELIMIT_STATE = os.environ.get(
+    "RIOT_RATELIMIT_STATE", os.path.join(tempfile.gettempdir(), "ecaly-riot-ratelimit.json")
+)
+# Assumed app limit until Riot tells us otherwise (development key defaults)
+RIOT_APP_RATE_LIMIT = os.environ.get("RIOT_APP_RATE_LIMIT", "20:1,100:120")
+# Longest a request may queue for a token before failing fast with RateLimitExceeded
+RIOT_RATELIMIT_MAX_WAIT = float(os.environ.get("RIOT_RATELIMIT_MAX_WAIT", 2.0))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no token becomes available within the allowed wait."""
+
+    def __init__(self, region, method, retry_after):
+        super().__init__(f"Riot API rate limit reached for {region}/{method}; retry in {retry_after:.1f}s")
+        self.region = region
+        self.method = method
+        self.retry_after = retry_after
+
+
+def parse_rate_limit_header(value):
+    """Parses "20:1,100:120" into [[20, 1.0], [100, 120.0]]; returns [] for missing/invalid headers."""
+    limits = []
+    for part in (value or "").split(","):
+        count, _, seconds = part.strip().partition(":")
+        try:
+            limits.append([int(count), float(seconds)])
+        except ValueError:
+            continue
+    return [limit for limit in limits if limit[0] > 0 and limit[1] > 0]
+
+
+class SharedRateLimiter:
+    """Token buckets per (region, app) and (region, method), shared across processes via a locked file."""
+
+    def __init__(self, state_path=RIOT_RATELIMIT_STATE, app_limits=RIOT_APP_RATE_LIMIT,
+                 max_wait=RIOT_RATELIMIT_MAX_WAIT):
+        self.state_path = state_path
+        self.default_app_limits = parse_rate_limit_header(app_limits)
+        self.max_wait = max_wait
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+
+    # --- Public API ---
+
+    def acquire(self, region, method, max_wait=None, tokens=1):
+        """Takes `tokens` tokens (all or none) from the app and method buckets, waiting up to max_wait seconds (default: self.max_wait)."""
+        deadline = time.time() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            wait = self._locked_update(lambda state, now: self._try_take(state, now, region, method, tokens))
+            if wait <= 0:
+                return
+            if time.time() + wait > deadline:
+                raise RateLimitExceeded(region, method, wait)
+            time.sleep(wait)
+
+    def update_from_response(self, region, method, response):
+        """Learns limits, current counts and Retry-After from a Riot API response."""
+        headers = response.headers
+        app_limits = parse_rate_limit_header(headers.get("X-App-Rate-Limit"))
+        method_limits = parse_rate_limit_header(headers.get("X-Method-Rate-Limit"))
+        app_counts = parse_rate_limit_header(headers.get("X-App-Rate-Limit-Count"))
+        method_counts = parse_rate_limit_header(headers.get("X-Method-Rate-Limit-Count"))
+        retry_after = None
+        if response.status_code == 429:
+            try:
+                retry_after = float(headers.get("Retry-After", 1))
+            except ValueError:
+                retry_after = 1.0
+        if not (app_limits or method_limits or retry_after):
+            return
+
+        limit_type = (headers.get("X-Rate-Limit-Type") or "").lower()
+
+        def apply(state, now):
+            app_bucket = self._bucket(state, f"{region}:app", now, self.default_app_limits)
+            method_bucket = self._bucket(state, f"{region}:{method}", now, [])
+            self._sync(app_bucket, app_limits, app_counts, now)
+            self._sync(method_bucket, method_limits, method_counts, now)
+            if retry_after:
+                # "application" limits block the whole region; method/service 429s block just this endpoint
+                blocked = app_bucket if limit_type == "application" else method_bucket
+                blocked["blocked_until"] = max(blocked.get("blocked_until", 0), now + retry_after)
+            return 0
+
+        self._locked_update(apply)
+
+    # --- Bucket maths (called with the state lock held) ---
+
+    def _try_take(self, state, now, region, method, taken=1):
+        buckets = [
+            self._bucket(state, f"{region}:app", now, self.default_app_limits),
+            self._bucket(state, f"{region}:{method}", now, []),
+        ]
+        wait = 0.0
+        for bucket in buckets:
+            wait = max(wait, bucket.get("blocked_until", 0) - now)
+            for (count, seconds), tokens in zip(bucket["limits"], bucket["tokens"]):
+                needed = min(taken, count) # A window smaller than the batch only has to be full; the rest is owed
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) * seconds / count)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket["tokens"] = [tokens - taken for tokens in bucket["tokens"]]
+        return 0
+
+    @staticmethod
+    def _bucket(state, key, now, default_limits):
+        """Returns the bucket for `key` with tokens refilled up to `now`."""
+        bucket = state.get(key)
+        if bucket is None:
+            bucket = state[key] = {
+                "limits": [list(limit) for limit in default_limits],
+                "tokens": [float(count) for count, _ in default_limits],
+                "updated": now,
+            }
+        elapsed = max(0.0, now - bucket["updated"])
+        bucket["tokens"] = [
+            min(float(count), tokens + elapsed * count / seconds)
+            for (count, seconds), tokens in zip(bucket["limits"], bucket["tokens"])
+        ]
+        bucket["updated"] = now
+        return bucket
+
+    @staticmethod
+    def _sync(bucket, limits, counts, now):
+        """Adopts advertised limits and clamps tokens to what Riot says is left in each window."""
+        if limits and limits != bucket["limits"]:
+            old = {seconds: tokens for (_, seconds), tokens in zip(bucket["limits"], bucket["tokens"])}
+            bucket["limits"] = limits
+            bucket["tokens"] = [min(float(count), old.get(seconds, float(count))) for count, seconds in limits]
+        used = {seconds: count for count, seconds in counts}
+        bucket["tokens"] = [
+            min(tokens, float(count - used[seconds])) if seconds in used else tokens
+            for (count, seconds), tokens in zip(bucket["limits"], bucket["tokens"])
+        ]
+
+    # --- Shared state file ---
+
+    def _locked_update(self, fn):
+        """Runs fn(state, now) under the thread + file lock and persists the mutated state."""
+        with self._thread_lock:
+            fd = self._state_fd()
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                raw = b""
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    raw += chunk
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}  # Corrupt/partial file: start over rather than block all lookups
+                result = fn(state, time.time())
+                data = json.dumps(state, separators=(",", ":")).encode()
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data)
+                return result
+            finally:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _state_fd(self):
+        # flock() locks belong to the open file description, which a forked child shares with its
+        # parent, so each process must open the file itself to actually exclude the others
+        if self._fd is None or self._fd_pid != os.getpid():
+            self._fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._fd_pid = os.getpid()
+        return self._fd
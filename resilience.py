@@ -0,0 +1,156 @@
+# Filename: resilience.py
+# --- Circuit breaking and hedging helpers for the Riot API client ---
+# A degraded regional host otherwise makes every lookup wait out the full read timeout,
+# tying up worker threads. The breaker fails fast while a host is unhealthy and lets a
+# few trial requests through to detect recovery; the latency tracker supplies the p95
+# used to decide when to hedge a slow GET with a duplicate request.
+import os
+import threading
+import time
+from collections import deque
+
+# --- Configuration ---
+RIOT_BREAKER_ENABLED = os.environ.get("RIOT_BREAKER_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+RIOT_BREAKER_WINDOW = float(os.environ.get("RIOT_BREAKER_WINDOW", 30))  # Seconds of calls considered
+RIOT_BREAKER_MIN_CALLS = int(os.environ.get("RIOT_BREAKER_MIN_CALLS", 10))  # Calls in the window before it can open
+RIOT_BREAKER_FAILURE_RATIO = float(os.environ.get("RIOT_BREAKER_FAILURE_RATIO", 0.5))  # Failed share that opens it
+RIOT_BREAKER_SLOW_CALL = float(os.environ.get("RIOT_BREAKER_SLOW_CALL", 5.0))  # Slower calls count as failures
+RIOT_BREAKER_OPEN_SECONDS = float(os.environ.get("RIOT_BREAKER_OPEN_SECONDS", 15))  # Fail fast this long before probing
+RIOT_BREAKER_TRIAL_CALLS = int(os.environ.get("RIOT_BREAKER_TRIAL_CALLS", 2))  # Half-open successes needed to close
+# Hedged GETs: off unless enabled, since every hedge spends an extra rate-limit token
+RIOT_HEDGE_ENABLED = os.environ.get("RIOT_HEDGE_ENABLED", "0").lower() in ("1", "true", "yes", "on")
+RIOT_HEDGE_QUANTILE = float(os.environ.get("RIOT_HEDGE_QUANTILE", 0.95))  # Hedge once a call is slower than this
+RIOT_HEDGE_MIN_SAMPLES = int(os.environ.get("RIOT_HEDGE_MIN_SAMPLES", 20))  # Latencies needed before hedging
+RIOT_HEDGE_MIN_DELAY = float(os.environ.get("RIOT_HEDGE_MIN_DELAY", 0.05))  # Never hedge earlier than this (seconds)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit is open."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit open for Riot API host '{host}'; retry in {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Per-host breaker: CLOSED -> OPEN on too many failed/slow calls -> HALF_OPEN trials -> CLOSED.
+
+    Call allow() before a request (raises CircuitOpenError when failing fast)
+    and record(failed, generation) after it, passing the generation allow()
+    returned: a call that finishes after the breaker changed state (a slow call
+    admitted while CLOSED, say) is ignored rather than counted as a trial.
+    record(None, generation) releases a call that was never sent (e.g. refused
+    by the rate limiter) without counting it either way. State is per process,
+    so each worker detects an outage from its own calls.
+    """
+
+    def __init__(self, host, window=RIOT_BREAKER_WINDOW, min_calls=RIOT_BREAKER_MIN_CALLS,
+                 failure_ratio=RIOT_BREAKER_FAILURE_RATIO, open_seconds=RIOT_BREAKER_OPEN_SECONDS,
+                 trial_calls=RIOT_BREAKER_TRIAL_CALLS, on_state_change=None):
+        self.host = host
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self.trial_calls = max(1, trial_calls)
+        self.on_state_change = on_state_change  # Optional callback(host, old_state, new_state)
+        self.state = CLOSED
+        self._calls = deque()  # (monotonic time, failed) within the window
+        self._failures = 0
+        self._open_until = 0.0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+        self._generation = 0  # Bumped on every state change; stamps the calls allow() admits
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Admits a call; returns the generation to pass to record()."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.host, remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trials_in_flight >= self.trial_calls:
+                    raise CircuitOpenError(self.host, 0.0) # Enough probes already in flight
+                self._trials_in_flight += 1
+            return self._generation
+
+    def record(self, failed, generation):
+        with self._lock:
+            if generation != self._generation:
+                return # Admitted before the last state change: not a trial, and outside the current window
+            if self.state == HALF_OPEN:
+                self._trials_in_flight = max(0, self._trials_in_flight - 1)
+                if failed:
+                    self._open()
+                elif failed is not None:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.trial_calls:
+                        self._transition(CLOSED)
+                return
+            if failed is None or self.state != CLOSED:
+                return
+            now = time.monotonic()
+            self._calls.append((now, failed))
+            self._failures += failed
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._failures -= self._calls.popleft()[1]
+            if len(self._calls) >= self.min_calls and self._failures >= self.failure_ratio * len(self._calls):
+                self._open()
+
+    def _open(self):
+        self._open_until = time.monotonic() + self.open_seconds
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        old_state, self.state = self.state, state
+        self._calls.clear()
+        self._failures = 0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+        self._generation += 1
+        if self.on_state_change and old_state != state:
+            self.on_state_change(self.host, old_state, state)
+
+
+class LatencyTracker:
+    """Recent latencies per key with a cached quantile (recomputed every few samples)."""
+
+    def __init__(self, quantile=RIOT_HEDGE_QUANTILE, min_samples=RIOT_HEDGE_MIN_SAMPLES, max_samples=200):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self._samples = {}  # key -> deque of seconds
+        self._observed = {}  # key -> total samples ever observed
+        self._cached = {}  # key -> (observed count when computed, quantile value)
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            self._observed[key] = self._observed.get(key, 0) + 1
+
+    def threshold(self, key):
+        """The configured quantile of recent latencies for `key`, or None until enough samples exist."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            observed = self._observed[key]
+            cached = self._cached.get(key)
+            if cached is not None and observed - cached[0] < 10:
+                return cached[1]
+            ordered = sorted(samples)
+            value = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+            self._cached[key] = (observed, value)
+            return value
@@ -0,0 +1,252 @@
+# Filename: riot_client.py
+# --- Pooled, keep-alive client for the regional Riot API hosts ---
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from rate_limit import RateLimitExceeded
+from resilience import (
+    CircuitBreaker, CircuitOpenError, LatencyTracker, CLOSED, OPEN,
+    RIOT_BREAKER_ENABLED, RIOT_BREAKER_SLOW_CALL, RIOT_HEDGE_ENABLED, RIOT_HEDGE_MIN_DELAY,
+)
+from structured_log import get_logger
+
+log = get_logger("riot_client")
+
+# --- Configuration ---
+# Regional host URL template; point it at bench/riot_stub.py (e.g. "http://127.0.0.1:8700/{region}") to benchmark offline
+RIOT_API_BASE_URL = os.environ.get("RIOT_API_BASE_URL", "https://{region}.api.riotgames.com")
+# Connect timeout is kept short: a healthy regional host completes the TCP handshake in well under a second
+RIOT_CONNECT_TIMEOUT = float(os.environ.get("RIOT_CONNECT_TIMEOUT", 3.05))
+RIOT_ACCOUNT_READ_TIMEOUT = float(os.environ.get("RIOT_ACCOUNT_READ_TIMEOUT", 10))
+RIOT_VAL_READ_TIMEOUT = float(os.environ.get("RIOT_VAL_READ_TIMEOUT", 15))
+# Threads in a worker that may call Riot at once; the lookup pipeline passes its own count (see riot_lookup.py)
+RIOT_CALLER_THREADS = int(os.environ.get("GUNICORN_THREADS", 10))
+# Keep-alive connections per regional host; 0 sizes the pool for every caller thread (two each when hedging), so
+# urllib3 never discards a connection with "Connection pool is full"
+RIOT_POOL_MAXSIZE = int(os.environ.get("RIOT_POOL_MAXSIZE", 0))
+# Number of regional hosts to keep pools for (americas/asia/europe/esports + na/eu/ap/kr/latam/br)
+RIOT_POOL_HOSTS = int(os.environ.get("RIOT_POOL_HOSTS", 16))
+# Threads that run hedged GETs (the original and its duplicate) for each worker process; 0 means two per caller thread
+RIOT_HEDGE_THREADS = int(os.environ.get("RIOT_HEDGE_THREADS", 0))
+
+# --- Metrics (labelled by endpoint method name and regional host) ---
+UPSTREAM_LATENCY = Histogram(REGISTRY, "ecaly_riot_request_duration_seconds", "Riot API request latency.", ("endpoint", "region"))
+UPSTREAM_RESPONSES = Counter(
+    REGISTRY, "ecaly_riot_responses_total", "Riot API responses by HTTP status (or timeout/error).", ("endpoint", "region", "status")
+)
+UPSTREAM_THROTTLED = Counter(
+    REGISTRY, "ecaly_riot_throttled_total", "Riot API calls not sent because the shared rate limit was spent.", ("endpoint", "region")
+)
+UPSTREAM_IN_FLIGHT = Gauge(REGISTRY, "ecaly_riot_requests_in_flight", "Riot API requests currently in progress.", ("endpoint",))
+UPSTREAM_SHORT_CIRCUITED = Counter(
+    REGISTRY, "ecaly_riot_short_circuited_total", "Riot API calls failed fast because the host's circuit was open.", ("endpoint", "region")
+)
+UPSTREAM_CIRCUITS_OPEN = Gauge(
+    REGISTRY, "ecaly_riot_circuits_open", "Regional hosts whose circuit breaker is open or half-open.", ("region",)
+)
+UPSTREAM_HEDGES = Counter(
+    REGISTRY, "ecaly_riot_hedged_total", "Duplicate Riot API GETs sent because the first was slower than p95, by winner.",
+    ("endpoint", "region", "winner")
+)
+
+
+class RiotClient:
+    """Thin wrapper around one shared requests.Session with per-host keep-alive pools.
+
+    Methods return the raw requests.Response so callers keep full control of
+    status handling (404/204 are meaningful for the lookup flow). Create one
+    instance per worker process and share it between threads.
+
+    Each regional host has a circuit breaker (see resilience.py): 5xx responses,
+    network errors and calls slower than RIOT_BREAKER_SLOW_CALL count as failures,
+    and while the circuit is open calls raise CircuitOpenError without being sent.
+    With RIOT_HEDGE_ENABLED, a GET still running after its endpoint's p95 latency
+    is duplicated and the first response to arrive is returned.
+    """
+
+    def __init__(self, api_key, connect_timeout=RIOT_CONNECT_TIMEOUT, pool_maxsize=RIOT_POOL_MAXSIZE,
+                 pool_hosts=RIOT_POOL_HOSTS, rate_limiter=None, breaker_enabled=RIOT_BREAKER_ENABLED,
+                 hedge_enabled=RIOT_HEDGE_ENABLED, base_url=RIOT_API_BASE_URL, caller_threads=RIOT_CALLER_THREADS):
+        self.connect_timeout = connect_timeout
+        self.hedge_threads = RIOT_HEDGE_THREADS or 2 * caller_threads
+        pool_maxsize = pool_maxsize or caller_threads * (2 if hedge_enabled else 1)
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter  # Optional rate_limit.SharedRateLimiter
+        self.breaker_enabled = breaker_enabled
+        self.hedge_enabled = hedge_enabled
+        self.latencies = LatencyTracker()  # Key: (method, region)
+        self._breakers = {}  # region -> CircuitBreaker
+        self._breakers_lock = threading.Lock()
+        self._hedge_executor = None
+        self._hedge_executor_pid = None
+        self.session = requests.Session()
+        self.session.headers.update({"X-Riot-Token": api_key, "Accept": "application/json"})
+        # urllib3 keeps one connection pool per host; pool_maxsize bounds sockets per host
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter) # Only used with a local RIOT_API_BASE_URL
+
+    def get(self, region, path, method, read_timeout=RIOT_VAL_READ_TIMEOUT, params=None):
+        """GETs `path` from the regional host (https://{region}.api.riotgames.com) over a pooled connection.
+
+        `method` names the endpoint for per-method rate limiting. Raises
+        rate_limit.RateLimitExceeded instead of sending when the shared budget is spent,
+        and resilience.CircuitOpenError while the regional host's circuit is open.
+        """
+        breaker = self.breaker(region) if self.breaker_enabled else None
+        if breaker:
+            try:
+                generation = breaker.allow()
+            except CircuitOpenError:
+                UPSTREAM_SHORT_CIRCUITED.inc(method, region)
+                raise
+        failed = None # Unknown until sent: rate-limited calls don't count for the breaker
+        started = time.perf_counter()
+        try:
+            self._acquire(region, method)
+            url = self.base_url.format(region=region) + path
+            log.info("riot.request", "Calling Riot API", endpoint=method, region=region, path=path)
+            send = lambda: self._send(region, url, method, read_timeout, params)
+            response = self._send_hedged(region, method, send) if self.hedge_enabled else send()
+            failed = response.status_code >= 500 or time.perf_counter() - started > RIOT_BREAKER_SLOW_CALL
+            return response
+        except requests.exceptions.RequestException:
+            failed = True
+            raise
+        finally:
+            if breaker:
+                breaker.record(failed, generation)
+
+    def breaker(self, region):
+        """The circuit breaker for a regional host (created on first use)."""
+        breaker = self._breakers.get(region)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self._breakers.get(region)
+                if breaker is None:
+                    breaker = self._breakers[region] = CircuitBreaker(region, on_state_change=_circuit_state_changed)
+        return breaker
+
+    def _acquire(self, region, method, max_wait=None):
+        if not self.rate_limiter:
+            return
+        try:
+            self.rate_limiter.acquire(region, method, max_wait=max_wait)
+        except RateLimitExceeded:
+            UPSTREAM_THROTTLED.inc(method, region)
+            raise
+
+    def _send(self, region, url, method, read_timeout, params):
+        """One HTTP attempt, with metrics and rate-limit bookkeeping."""
+        started = time.perf_counter()
+        try:
+            with UPSTREAM_IN_FLIGHT.track(method):
+                response = self.session.get(url, params=params, timeout=(self.connect_timeout, read_timeout))
+        except requests.exceptions.Timeout:
+            UPSTREAM_RESPONSES.inc(method, region, "timeout")
+            raise
+        except requests.exceptions.RequestException:
+            UPSTREAM_RESPONSES.inc(method, region, "error")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_LATENCY.observe(elapsed, method, region)
+        self.latencies.observe((method, region), elapsed)
+        UPSTREAM_RESPONSES.inc(method, region, str(response.status_code))
+        if self.rate_limiter:
+            self.rate_limiter.update_from_response(region, method, response)
+        return response
+
+    def _send_hedged(self, region, method, send):
+        """Runs `send`; if it outlasts the endpoint's p95, sends a duplicate and returns whichever answers first.
+
+        Only used for GETs, which are idempotent. The duplicate needs a rate-limit
+        token available right away, otherwise the original is simply awaited.
+        The slower attempt is left to finish in the background.
+        """
+        threshold = self.latencies.threshold((method, region))
+        if threshold is None:
+            return send() # Not enough samples yet to know what "slow" is
+        executor = self._executor()
+        primary = executor.submit(send)
+        try:
+            return primary.result(timeout=max(RIOT_HEDGE_MIN_DELAY, threshold))
+        except FutureTimeout:
+            pass
+        try:
+            self._acquire(region, method, max_wait=0)
+        except RateLimitExceeded:
+            return primary.result()
+        hedge = executor.submit(send)
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e # Lose only if the other attempt fails too
+                    continue
+                UPSTREAM_HEDGES.inc(method, region, "hedge" if future is hedge else "original")
+                return response
+        UPSTREAM_HEDGES.inc(method, region, "neither")
+        raise error
+
+    def _executor(self):
+        # Created per process: executor threads do not survive a gunicorn fork
+        if self._hedge_executor_pid != os.getpid():
+            with self._breakers_lock:
+                if self._hedge_executor_pid != os.getpid():
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self.hedge_threads, thread_name_prefix="riot-hedge")
+                    self._hedge_executor_pid = os.getpid()
+        return self._hedge_executor
+
+    # --- Endpoints used by the lookup flow ---
+
+    def get_account_by_riot_id(self, account_region, username, tag):
+        path = f"/riot/account/v1/accounts/by-riot-id/{quote(username, safe='')}/{quote(tag, safe='')}"
+        return self.get(account_region, path, "account-by-riot-id", read_timeout=RIOT_ACCOUNT_READ_TIMEOUT)
+
+    def get_active_shard(self, account_region, puuid):
+        path = f"/riot/account/v1/active-shards/by-game/val/by-puuid/{puuid}"
+        return self.get(account_region, path, "active-shard-by-puuid", read_timeout=RIOT_ACCOUNT_READ_TIMEOUT)
+
+    def get_ranked_by_puuid(self, valorant_region, puuid):
+        return self.get(valorant_region, f"/val/ranked/v1/by-puuid/{puuid}", "val-ranked-by-puuid")
+
+    def get_mmr_by_puuid(self, valorant_region, puuid):
+        return self.get(valorant_region, f"/val/mmr/v1/by-puuid/{puuid}", "val-mmr-by-puuid")
+
+    def get_matchlist_by_puuid(self, valorant_region, puuid):
+        return self.get(valorant_region, f"/val/match/v1/matchlists/by-puuid/{puuid}", "val-matchlist-by-puuid")
+
+    def get_match(self, valorant_region, match_id):
+        return self.get(valorant_region, f"/val/match/v1/matches/{quote(match_id, safe='')}", "val-match-by-id")
+
+    def get_leaderboard(self, valorant_region, act_id, size, start_index):
+        path = f"/val/ranked/v1/leaderboards/by-act/{quote(act_id, safe='')}"
+        return self.get(valorant_region, path, "val-leaderboard-by-act", params={"size": size, "startIndex": start_index})
+
+    def get_content(self, valorant_region):
+        return self.get(valorant_region, "/val/content/v1/contents", "val-content")
+
+    def close(self):
+        self.session.close()
+
+
+def _circuit_state_changed(region, old_state, new_state):
+    if old_state == CLOSED:
+        UPSTREAM_CIRCUITS_OPEN.inc(region)
+    elif new_state == CLOSED:
+        UPSTREAM_CIRCUITS_OPEN.dec(region)
+    if new_state == OPEN:
+        log.warning("riot.circuit_open", "Riot API host failing, short-circuiting calls", region=region, previous=old_state)
+    else:
+        log.info("riot.circuit_state", "Riot API host circuit state changed", region=region, state=new_state, previous=old_state)
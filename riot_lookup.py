@@ -0,0 +1,714 @@
+# Filename: riot_lookup.py
+# --- Cached, coalesced Riot ID -> rank lookup pipeline (shared by the Flask views and asgi.py) ---
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from cache import MISSING, FRESH, STALE, MISS  # Cache sentinels and freshness states
+import shared_cache  # Host-wide lookup caches in shared memory (per-process fallback)
+from rate_limit import SharedRateLimiter, RateLimitExceeded  # Host-wide outbound rate limiting
+from riot_client import RiotClient  # Pooled keep-alive Riot API client
+from resilience import CircuitOpenError  # Raised while a regional Riot host is failing fast
+from singleflight import SingleFlight  # Coalesces identical concurrent upstream calls
+from snapshot_store import SnapshotStore  # SQLite persistence for cache warm-up and rank history
+from popularity import Prewarmer, PREWARM_LEAD  # Keeps the most looked-up players' rank entries warm
+from match_history import MatchTally, MATCH_FETCH_CONCURRENCY, MATCH_REFRESH_THREADS  # Current-act wins/losses from match history
+from leaderboard import Leaderboards  # Local index of the ranked leaderboards (top-tier players)
+from content_catalog import tier_catalog, ActiveAct  # Tier names for leaderboard entries; the active act
+from typeahead import RiotIdIndex, TYPEAHEAD_MAX_IDS  # Prefix index of resolved Riot IDs (suggestions)
+from metrics import REGISTRY, Counter  # Prometheus metrics (see /metrics)
+from structured_log import get_logger  # Queue-backed, sampled structured logging
+
+log = get_logger("riot_lookup")
+
+# --- Configuration ---
+RIOT_API_KEY = os.environ.get("RIOT_API_KEY", "")
+
+# Riot ID -> PUUID cache (PUUIDs never change for a Riot ID over short periods)
+PUUID_CACHE_SIZE = int(os.environ.get("PUUID_CACHE_SIZE", 20000))
+PUUID_CACHE_TTL = float(os.environ.get("PUUID_CACHE_TTL", 6 * 3600))  # Seconds
+PUUID_NEGATIVE_TTL = float(os.environ.get("PUUID_NEGATIVE_TTL", 300))  # Seconds to remember "not found" (typos)
+# PUUID -> active VALORANT shard (players rarely change shards); rank requests go to that shard's host
+RIOT_SHARD_ROUTING = os.environ.get("RIOT_SHARD_ROUTING", "1").lower() in ("1", "true", "yes", "on")
+SHARD_CACHE_SIZE = int(os.environ.get("SHARD_CACHE_SIZE", 20000))
+SHARD_CACHE_TTL = float(os.environ.get("SHARD_CACHE_TTL", 24 * 3600))  # Seconds
+SHARD_NEGATIVE_TTL = float(os.environ.get("SHARD_NEGATIVE_TTL", 600))  # Seconds to use the default shard for PUUIDs without one
+# (valorant_region, PUUID) -> rank_data cache (rank only changes after a match ends)
+RANK_CACHE_SIZE = int(os.environ.get("RANK_CACHE_SIZE", 20000))
+RANK_CACHE_FRESH_TTL = float(os.environ.get("RANK_CACHE_FRESH_TTL", 120))  # Seconds served directly
+RANK_CACHE_STALE_TTL = float(os.environ.get("RANK_CACHE_STALE_TTL", 1800))  # Further seconds served while refreshing
+# Bytes per shared-cache slot (header, key and encoded value); larger entries are simply not cached
+PUUID_CACHE_SLOT = int(os.environ.get("PUUID_CACHE_SLOT", 192))
+SHARD_CACHE_SLOT = int(os.environ.get("SHARD_CACHE_SLOT", 160))
+RANK_CACHE_SLOT = int(os.environ.get("RANK_CACHE_SLOT", 256))
+# Threads that perform blocking upstream calls on behalf of concurrent stages and async lookups
+RIOT_UPSTREAM_THREADS = int(os.environ.get("RIOT_UPSTREAM_THREADS", 16))
+# Batch lookups: players resolved concurrently per batch, and threads shared by all batches in a worker
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+BATCH_THREADS = int(os.environ.get("BATCH_THREADS", 32))
+# Threads per worker that may call Riot at once (sizes the client's keep-alive pools): request threads,
+# both executors above, match fetches and tally refreshes, plus the pre-warm and leaderboard threads
+RIOT_CALLER_THREADS = (
+    int(os.environ.get("GUNICORN_THREADS", 10)) + RIOT_UPSTREAM_THREADS + BATCH_THREADS
+    + MATCH_FETCH_CONCURRENCY + MATCH_REFRESH_THREADS + 2
+)
+# Longest a rank fetch waits for the match tally before using the last persisted one; a tally
+# that finishes later patches the cached rank entry instead
+MATCH_TALLY_WAIT = float(os.environ.get("MATCH_TALLY_WAIT", 0.3))
+# Most recent Riot IDs / rank entries loaded from the snapshot store into each cache at startup
+SNAPSHOT_WARM_LIMIT = int(os.environ.get("SNAPSHOT_WARM_LIMIT", 5000))
+
+# Use environment variables for regions, default to common ones
+# With shard routing on, the VALORANT region is only the fallback for players whose active shard is unknown
+DEFAULT_ACCOUNT_REGION = os.environ.get("RIOT_ACCOUNT_REGION", "americas") # e.g., americas, asia, europe, sea
+DEFAULT_VALORANT_REGION = os.environ.get("RIOT_VALORANT_REGION", "na")     # e.g., na, eu, ap, kr, latam, br
+
+# VALORANT shard -> Account API cluster used for Riot ID lookups in that shard (e.g. for /player/<region>/... URLs)
+VALORANT_ACCOUNT_REGIONS = {
+    "na": "americas", "latam": "americas", "br": "americas",
+    "eu": "europe",
+    "ap": "asia", "kr": "asia",
+}
+
+# --- Riot API Client (one pooled, keep-alive session per worker process, rate limit shared per host) ---
+riot_client = RiotClient(RIOT_API_KEY, rate_limiter=SharedRateLimiter(), caller_threads=RIOT_CALLER_THREADS)
+UPSTREAM_EXECUTOR = ThreadPoolExecutor(max_workers=RIOT_UPSTREAM_THREADS, thread_name_prefix="riot-upstream")
+# Separate pool: batch tasks block on UPSTREAM_EXECUTOR futures, so sharing one pool could deadlock
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_THREADS, thread_name_prefix="riot-batch")
+
+# --- Caches ---
+# Shared by every worker on the host when created before the fork (gunicorn --preload), see shared_cache.py
+# Key: (account_region, username, tag) normalized; Value: PUUID string, or None for a cached 404
+puuid_cache = shared_cache.ttl_cache("puuid", PUUID_CACHE_SIZE, PUUID_CACHE_TTL, slot_size=PUUID_CACHE_SLOT)
+# Key: PUUID; Value: VALORANT shard ("na", "eu", ...), or None when the default shard should be used
+shard_cache = shared_cache.ttl_cache("shard", SHARD_CACHE_SIZE, SHARD_CACHE_TTL, slot_size=SHARD_CACHE_SLOT)
+# Key: (valorant_region, puuid); Value: parsed rank_data dict (treat as read-only)
+rank_cache = shared_cache.stale_while_revalidate_cache(
+    "rank", RANK_CACHE_SIZE, RANK_CACHE_FRESH_TTL, RANK_CACHE_STALE_TTL, slot_size=RANK_CACHE_SLOT
+)
+# Persistent copy of resolved PUUIDs and rank snapshots (survives restarts, feeds rank history)
+snapshot_store = SnapshotStore()
+# Active act id (acts are global, so any shard's content API will do)
+active_act = ActiveAct(riot_client, DEFAULT_VALORANT_REGION)
+# Running current-act wins/losses per player, persisted in the snapshot store
+match_tally = MatchTally(riot_client, snapshot_store, active_act=active_act.current)
+# Top-tier players answered from the locally indexed ranked leaderboards (see leaderboard.py)
+leaderboards = Leaderboards(riot_client)
+
+# --- Request Coalescing (one in-flight upstream call per key, per stage) ---
+account_flight = SingleFlight("account")  # Key: normalized (account_region, username, tag)
+shard_flight = SingleFlight("shard")      # Key: puuid
+ranked_flight = SingleFlight("ranked")    # Key: (valorant_region, puuid)
+mmr_flight = SingleFlight("mmr")          # Key: (valorant_region, puuid)
+tally_flight = SingleFlight("tally")      # Key: (valorant_region, puuid)
+
+# --- Metrics ---
+CACHE_LOOKUPS = Counter(REGISTRY, "ecaly_cache_lookups_total", "Lookup cache reads by cache and result.", ("cache", "result"))
+
+
+def default_regions():
+    """Returns (account_region, valorant_region) as configured in the environment."""
+    return DEFAULT_ACCOUNT_REGION, DEFAULT_VALORANT_REGION
+
+def regions_for(valorant_region):
+    """Returns (account_region, valorant_region) for a VALORANT shard name, or None if it is unknown."""
+    valorant_region = valorant_region.strip().lower()
+    account_region = VALORANT_ACCOUNT_REGIONS.get(valorant_region)
+    return (account_region, valorant_region) if account_region else None
+
+def shards_for(account_region):
+    """VALORANT shards whose Riot IDs an Account API cluster resolves (the inverse of VALORANT_ACCOUNT_REGIONS)."""
+    account_region = account_region.strip().lower()
+    return tuple(shard for shard, cluster in VALORANT_ACCOUNT_REGIONS.items() if cluster == account_region)
+
+def parse_riot_id(entry):
+    """Accepts "Name#TAG" or {"username": ..., "tag": ...}; returns (username, tag) or None if invalid."""
+    if isinstance(entry, str):
+        username, sep, tag = entry.rpartition('#')
+        if not sep:
+            return None
+    elif isinstance(entry, dict):
+        username, tag = entry.get('username'), entry.get('tag')
+        if not isinstance(username, str) or not isinstance(tag, str):
+            return None
+    else:
+        return None
+    username, tag = username.strip(), tag.strip()
+    return (username, tag) if username and tag else None
+
+# --- Full Lookup Chain ---
+
+def lookup_rank(username, tag, account_region, valorant_region, force_refresh=False):
+    """Resolves a Riot ID and its rank: returns (puuid, rank_data, cache_status). Raises on failure.
+
+    `valorant_region` is used only if the player's active shard cannot be determined.
+    """
+    log.info("lookup.start", "Looking up player", riot_id=f"{username}#{tag}")
+    entry = leaderboards.lookup_riot_id(shards_for(account_region), username, tag)
+    if entry is not None: # Top-tier player: PUUID and shard come from the leaderboard index
+        puuid, valorant_region = entry.puuid, entry.region
+    else:
+        # --- 1. Get PUUID using Account API (cached) ---
+        puuid = resolve_puuid(username, tag, account_region)
+        # --- 1b. Route to the player's active shard (cached) ---
+        valorant_region = resolve_shard(puuid, account_region, valorant_region)
+        prewarmer.record(rank_cache_key(valorant_region, puuid))
+    record_riot_id(account_region, username, tag, entry) # A valid Riot ID: suggest it from now on
+    # --- 2. Get Rank using Valorant Ranked/MMR APIs (cached, stale-while-revalidate) ---
+    rank_data, cache_status = get_rank_data(puuid, valorant_region, force_refresh=force_refresh)
+    return puuid, rank_data, cache_status
+
+async def lookup_rank_async(username, tag, account_region, valorant_region, force_refresh=False):
+    """Asyncio version of lookup_rank() for ASGI servers / async views.
+
+    Nothing blocking runs on the event loop. Cache reads (shared memory, with
+    SQLite behind some of them) take one hop to the loop's default executor,
+    so a cache hit never queues behind upstream calls. Upstream stages run on
+    the bounded UPSTREAM_EXECUTOR (shared by every in-flight lookup rather than
+    one thread per request), and the PUUID-dependent Ranked and MMR stages are
+    awaited concurrently.
+    """
+    loop = asyncio.get_running_loop()
+    log.info("lookup.start", "Looking up player (async)", riot_id=f"{username}#{tag}")
+    puuid, resolved_region, cached = await loop.run_in_executor(
+        None, _lookup_cached, username, tag, account_region, valorant_region, force_refresh
+    )
+    if cached is not None:
+        return (puuid, *cached)
+    if resolved_region is not None:
+        valorant_region = resolved_region
+    else:
+        if puuid is None:
+            puuid = await loop.run_in_executor(UPSTREAM_EXECUTOR, resolve_puuid, username, tag, account_region)
+        valorant_region = await loop.run_in_executor(UPSTREAM_EXECUTOR, resolve_shard, puuid, account_region, valorant_region)
+        prewarmer.record(rank_cache_key(valorant_region, puuid))
+        record_riot_id(account_region, username, tag)
+        if not force_refresh:
+            cached, state = await loop.run_in_executor(None, _cached_rank_data, puuid, valorant_region)
+            if state != MISS:
+                return puuid, cached, state
+
+    stage_key = rank_cache_key(valorant_region, puuid)
+    ranked_future = UPSTREAM_EXECUTOR.submit(_ranked_stage, stage_key, puuid, valorant_region)
+    tally_future = asyncio.wrap_future(_start_tally(ranked_future, stage_key, puuid, valorant_region))
+    has_ranked_data, mmr_result = await asyncio.gather(
+        asyncio.wrap_future(ranked_future),
+        loop.run_in_executor(UPSTREAM_EXECUTOR, _mmr_stage, stage_key, puuid, valorant_region),
+        return_exceptions=True,
+    )
+    try:
+        tally = await asyncio.wait_for(asyncio.shield(tally_future), MATCH_TALLY_WAIT)
+    except Exception as e:
+        tally = await loop.run_in_executor(None, _tally_fallback, stage_key, e)
+    try:
+        rank_data = _merge_rank_stages(has_ranked_data, mmr_result, tally)
+    except CircuitOpenError as e:
+        return (puuid, *await loop.run_in_executor(None, _rank_data_without_upstream, stage_key, e))
+    await loop.run_in_executor(None, store_rank_data, stage_key, rank_data)
+    return puuid, rank_data, MISS
+
+def _lookup_cached(username, tag, account_region, valorant_region, force_refresh):
+    """The part of lookup_rank() answered from caches, for lookup_rank_async() to run off the event loop.
+
+    Returns (puuid, valorant_region, (rank_data, state)); the first stage that
+    needs an upstream call, and everything after it, are None. A cached 404
+    raises like resolve_puuid().
+    """
+    entry = leaderboards.lookup_riot_id(shards_for(account_region), username, tag)
+    if entry is not None: # Top-tier player: PUUID and shard come from the leaderboard index
+        puuid, valorant_region = entry.puuid, entry.region
+    else:
+        if puuid_cache.get(riot_id_cache_key(account_region, username, tag)) is MISSING:
+            return None, None, None
+        puuid = resolve_puuid(username, tag, account_region) # Cached (or cached 404): no upstream call
+        if RIOT_SHARD_ROUTING and shard_cache.get(puuid) is MISSING:
+            return puuid, None, None
+        valorant_region = resolve_shard(puuid, account_region, valorant_region) # Cached: no upstream call
+        prewarmer.record(rank_cache_key(valorant_region, puuid))
+    record_riot_id(account_region, username, tag, entry)
+    if force_refresh:
+        return puuid, valorant_region, None
+    cached, state = _cached_rank_data(puuid, valorant_region)
+    return puuid, valorant_region, (None if state == MISS else (cached, state))
+
+def lookup_rank_many(players, account_region, valorant_region, concurrency=BATCH_CONCURRENCY):
+    """Resolves many (username, tag) pairs with at most `concurrency` lookups in flight.
+
+    Yields (index, outcome) in completion order, where outcome is the
+    lookup_rank() tuple or the exception it raised. Each lookup goes through
+    the same caches, single-flight and rate limiter as a single /lookup.
+    """
+    pending = {}
+    remaining = iter(enumerate(players))
+
+    def submit_next():
+        for index, (username, tag) in remaining:
+            pending[BATCH_EXECUTOR.submit(lookup_rank, username, tag, account_region, valorant_region)] = index
+            return True
+        return False
+
+    for _ in range(max(1, concurrency)):
+        if not submit_next():
+            break
+    # If the consumer stops early (client disconnect), in-flight lookups finish but nothing new is submitted
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = e
+            yield index, outcome
+            submit_next()
+
+# --- Lookup Stages ---
+
+def riot_id_cache_key(account_region, username, tag):
+    """Normalizes a Riot ID for cache lookups (Riot IDs are case-insensitive)."""
+    return (account_region.strip().lower(), username.strip().lower(), tag.strip().lower())
+
+def resolve_puuid(username, tag, account_region):
+    """Returns the PUUID for a Riot ID, using the identity cache before the Account API."""
+    cache_key = riot_id_cache_key(account_region, username, tag)
+    cached = puuid_cache.get(cache_key)
+    CACHE_LOOKUPS.inc("puuid", "miss" if cached is MISSING else "hit")
+    if cached is MISSING:
+        # Concurrent lookups for the same Riot ID share one Account API call
+        try:
+            cached = account_flight.do(cache_key, lambda: _fetch_puuid(account_region, username, tag))
+        except CircuitOpenError:
+            # Account host is failing fast: a PUUID resolved before (even long ago) is still valid
+            cached = snapshot_store.lookup_puuid(cache_key)
+            if cached is None:
+                raise
+            log.info("account.fallback", "Account API circuit open, using the persisted PUUID", puuid=cached)
+            return cached
+        if cached is None:
+            puuid_cache.set(cache_key, None, ttl=PUUID_NEGATIVE_TTL)
+        else:
+            puuid_cache.set(cache_key, cached)
+            snapshot_store.record_puuid(cache_key, cached)
+    else:
+        log.info("cache.hit", "PUUID cache hit", cache="puuid", riot_id=f"{username}#{tag}", puuid=cached)
+
+    if cached is None: # Account API 404 (possibly cached): no such Riot ID
+        raise ValueError(f"Riot ID '{username}#{tag}' not found in the '{account_region}' region. Check spelling, tag, and selected region.")
+    return cached
+
+def _fetch_puuid(account_region, username, tag):
+    """Account API stage: returns the PUUID, or None if the Riot ID does not exist."""
+    account_response = riot_client.get_account_by_riot_id(account_region, username, tag)
+
+    # Specific handling for 404 on account lookup
+    if account_response.status_code == 404:
+        return None
+    account_response.raise_for_status() # Raise exceptions for other errors (4xx, 5xx)
+
+    account_data = account_response.json()
+    puuid = account_data.get('puuid')
+
+    if not puuid:
+        raise ValueError("Could not extract PUUID from API response.")
+    log.info("account.resolved", "Found PUUID", puuid=puuid)
+    if account_data.get('gameName') and account_data.get('tagLine'): # Suggest the ID the way Riot spells it
+        riot_id_index.set_display(
+            riot_id_cache_key(account_region, username, tag), f"{account_data['gameName']}#{account_data['tagLine']}"
+        )
+    return puuid
+
+def resolve_shard(puuid, account_region, default_shard):
+    """Returns the player's active VALORANT shard, or `default_shard` if it cannot be determined."""
+    if not RIOT_SHARD_ROUTING:
+        return default_shard
+    cached = shard_cache.get(puuid)
+    CACHE_LOOKUPS.inc("shard", "miss" if cached is MISSING else "hit")
+    if cached is not MISSING:
+        return cached or default_shard
+    try:
+        shard = shard_flight.do(puuid, lambda: _fetch_active_shard(account_region, puuid))
+    except Exception as e: # Routing is an optimization: never fail the lookup over it
+        log.warning("shard.error", "Could not resolve active shard, using the default", puuid=puuid, default_shard=default_shard, error=str(e))
+        return default_shard
+    if shard is None:
+        shard_cache.set(puuid, None, ttl=SHARD_NEGATIVE_TTL)
+        return default_shard
+    shard_cache.set(puuid, shard)
+    return shard
+
+def _fetch_active_shard(account_region, puuid):
+    """Account API active-shards stage: returns the shard name, or None if Riot has none for this PUUID."""
+    shard_response = riot_client.get_active_shard(account_region, puuid)
+    if shard_response.status_code == 404:
+        return None
+    shard_response.raise_for_status()
+    shard = (shard_response.json().get('activeShard') or '').lower()
+    if shard not in VALORANT_ACCOUNT_REGIONS:
+        log.warning("shard.unknown", "Unknown active shard, using the default", puuid=puuid, shard=shard)
+        return None
+    log.info("shard.resolved", "Active shard found", puuid=puuid, shard=shard)
+    return shard
+
+def fetch_rank_data(puuid, valorant_region):
+    """Calls the VAL Ranked/MMR/Match APIs for a PUUID and returns the parsed rank_data dict.
+
+    The Ranked stage runs on UPSTREAM_EXECUTOR while the MMR stage runs on the
+    calling thread; once the Ranked stage finds ranked data, the match tally
+    starts on match_history's own threads (see _start_tally()).
+    """
+    stage_key = rank_cache_key(valorant_region, puuid)
+    ranked_future = UPSTREAM_EXECUTOR.submit(_ranked_stage, stage_key, puuid, valorant_region)
+    tally_future = _start_tally(ranked_future, stage_key, puuid, valorant_region)
+    try:
+        mmr_result = _mmr_stage(stage_key, puuid, valorant_region)
+    except Exception as e:
+        mmr_result = e # Only matters if the Ranked stage says the player has ranked data
+    try:
+        has_ranked_data = ranked_future.result()
+    except Exception as e:
+        has_ranked_data = e
+    try:
+        tally = tally_future.result(timeout=MATCH_TALLY_WAIT)
+    except Exception as e:
+        tally = _tally_fallback(stage_key, e)
+    return _merge_rank_stages(has_ranked_data, mmr_result, tally)
+
+# Each stage is coalesced separately so concurrent lookups share in-flight upstream calls
+def _ranked_stage(stage_key, puuid, valorant_region):
+    return ranked_flight.do(stage_key, lambda: _fetch_has_ranked_data(puuid, valorant_region))
+
+def _mmr_stage(stage_key, puuid, valorant_region):
+    return mmr_flight.do(stage_key, lambda: _fetch_mmr_rank_data(puuid, valorant_region))
+
+def _tally_stage(stage_key, puuid, valorant_region):
+    return tally_flight.do(stage_key, lambda: _refresh_tally(stage_key, puuid, valorant_region))
+
+def _start_tally(ranked_future, stage_key, puuid, valorant_region):
+    """Future for the match tally stage, started when the Ranked stage finds ranked data.
+
+    It resolves to None for unranked players (nothing to count) and to the last
+    persisted tally when match_history's refresh backlog is full. The refresh
+    keeps running after callers stop waiting for it, on match_history's
+    threads rather than UPSTREAM_EXECUTOR.
+    """
+    tally_future = Future()
+
+    def forward(refresh):
+        error = refresh.exception()
+        if error is not None:
+            tally_future.set_exception(error)
+        else:
+            tally_future.set_result(refresh.result())
+
+    def start(ranked):
+        try:
+            if ranked.exception() is not None or not ranked.result():
+                tally_future.set_result(None)
+                return
+            refresh = match_tally.submit(_tally_stage, stage_key, puuid, valorant_region)
+            if refresh is None:
+                tally_future.set_result(match_tally.cached(*stage_key))
+                return
+            refresh.add_done_callback(forward)
+        except Exception as e:
+            tally_future.set_exception(e)
+
+    ranked_future.add_done_callback(start)
+    return tally_future
+
+def _refresh_tally(stage_key, puuid, valorant_region):
+    tally = match_tally.refresh(valorant_region, puuid)
+    cached, _ = rank_cache.get(stage_key)
+    if match_tally.is_current(tally) and cached is not MISSING and cached.get('tier', 'Unranked') != 'Unranked' \
+            and (cached.get('wins'), cached.get('losses')) != (tally['wins'], tally['losses']):
+        # Finished after the rank fetch stopped waiting: fill in the entry it stored
+        rank_cache.set(stage_key, {**cached, 'wins': tally['wins'], 'losses': tally['losses']}, age=rank_cache.age(stage_key) or 0.0)
+    return tally
+
+def _tally_fallback(stage_key, error):
+    """The last persisted tally when the match tally stage failed or is still running."""
+    if not isinstance(error, TimeoutError):
+        log.warning("match.tally_failed", "Match tally refresh failed", key=stage_key, error=str(error))
+    return match_tally.cached(*stage_key)
+
+def _merge_rank_stages(has_ranked_data, mmr_result, tally=None):
+    """Combines the Ranked, MMR and match tally stage outcomes (values or exceptions) into rank_data."""
+    if isinstance(has_ranked_data, Exception):
+        raise has_ranked_data
+    if not has_ranked_data:
+        rank_data = {'tier': 'Unranked', 'currenttier': 0, 'lp': 0, 'wins': 0, 'losses': 0} # Provide default unranked structure
+    elif isinstance(mmr_result, Exception):
+        raise mmr_result
+    else:
+        rank_data = mmr_result
+    if has_ranked_data: # Wins/losses this act, both from a fully counted match tally (MMR has no losses) or neither
+        counted = match_tally.is_current(tally)
+        rank_data = {**rank_data, 'wins': tally['wins'] if counted else '--', 'losses': tally['losses'] if counted else '--'}
+    rank_data = {**rank_data, 'fetched_at': int(time.time())} # When Riot was asked (drives HTTP caching headers)
+
+    log.info("rank.parsed", "Parsed rank data", rank=rank_data)
+    return rank_data
+
+def _fetch_has_ranked_data(puuid, valorant_region):
+    """Ranked API stage: False if the player has no data in the current competitive season."""
+    # NOTE: The v1 endpoint provides data for the *current* competitive season.
+    # It might return very little data if the player hasn't played ranked recently.
+    # Alternative (Content API - often more info but needs different parsing): /val/content/v1/contents (Less relevant for rank directly)
+    # Alternative (Match API - gives match history): /val/match/v1/matchlists/by-puuid/{puuid} (Needs more processing)
+    rank_response = riot_client.get_ranked_by_puuid(valorant_region, puuid)
+
+    # Handle 404 for Rank API - means player exists but has no data in this specific ranked queue/season
+    if rank_response.status_code == 404:
+        log.info("rank.unranked", "No VAL ranked data (404), treating as Unranked", puuid=puuid, region=valorant_region, endpoint="ranked")
+        return False
+    rank_response.raise_for_status() # Raise for other errors
+    api_result = rank_response.json()
+    log.info("riot.payload", "Received rank data", endpoint="ranked", payload=api_result) # Raw response (sampled, truncated)
+    return True
+
+def _fetch_mmr_rank_data(puuid, valorant_region):
+    """MMR API stage: returns the parsed rank_data dict."""
+    # --- Parse the Ranked v1 Response ---
+    # Structure might be under 'data' or directly at root depending on exact endpoint/version
+    # The 'by-puuid' endpoint (v1) seems to return data in `images` and tier info.
+    # Let's refine parsing based on typical Valorant API structures.
+    # Often MMR data comes from a different endpoint (`/mmr/v1/players/{puuid}`)
+    # The `/ranked/v1/by-puuid/` endpoint is *less* common for detailed rank like tier/RR.
+    # Let's *assume* we are getting data similar to what MMR endpoint might provide,
+    # or fallback gracefully. A common structure has 'data.currentData' or similar.
+
+    # --- IMPORTANT RE-EVALUATION ---
+    # The `/val/ranked/v1/by-puuid/{puuid}` endpoint IS NOT the correct one for detailed Tier/RR.
+    # It seems related to leaderboards.
+    # The correct endpoint is likely `/val/mmr/v1/by-puuid/{puuid}`.
+    # Let's switch to that, assuming it's available for your API key type.
+    mmr_response = riot_client.get_mmr_by_puuid(valorant_region, puuid)
+
+    if mmr_response.status_code == 404:
+        log.info("rank.unranked", "No VAL MMR data (404), treating as Unranked", puuid=puuid, region=valorant_region, endpoint="mmr")
+        return {'tier': 'Unranked', 'currenttier': 0, 'lp': 0, 'wins': 0, 'losses': 0}
+    if mmr_response.status_code == 204: # No content - player likely unranked or no data
+        log.info("rank.unranked", "No VAL MMR content (204), treating as Unranked", puuid=puuid, region=valorant_region, endpoint="mmr")
+        return {'tier': 'Unranked', 'currenttier': 0, 'lp': 0, 'wins': 0, 'losses': 0}
+
+    mmr_response.raise_for_status()
+    mmr_api_result = mmr_response.json()
+    log.info("riot.payload", "Received MMR data", endpoint="mmr", payload=mmr_api_result) # Raw response (sampled, truncated)
+
+    # Parse MMR Data (structure example: {'data': {'currenttier': 21, 'currenttierpatched': 'Immortal 1', 'ranking_in_tier': 55, ...}})
+    if 'data' in mmr_api_result and mmr_api_result['data']:
+        mmr_data = mmr_api_result['data']
+        tier_name = mmr_data.get('currenttierpatched', 'Unranked')
+        tier_lp = mmr_data.get('ranking_in_tier', 0) # Usually called RR or LP
+
+        # Wins/Losses might not be directly in this response, depends on API version/tier
+        # Often requires processing match history separately (see match_history.py), which replaces these when it can
+        wins_count = mmr_data.get('wins', '--') # Placeholder if API doesn't provide directly
+
+        return {
+            'tier': tier_name if tier_name else 'Unranked',
+            'currenttier': mmr_data.get('currenttier'), # Numeric tier id, indexes content_catalog.tier_catalog
+            'lp': tier_lp,
+            'wins': wins_count, # Keep as '--' if not available
+            'losses': '--',     # Keep as '--' if not available
+            'rank_icon_url': None # No icon URL from this API, handle in template
+        }
+    # No 'data' object found, treat as unranked
+    log.warning("rank.unexpected", "MMR API response missing 'data', treating as Unranked", puuid=puuid)
+    return {'tier': 'Unranked', 'currenttier': 0, 'lp': 0, 'wins': 0, 'losses': 0}
+
+def rank_cache_key(valorant_region, puuid):
+    return (valorant_region.strip().lower(), puuid)
+
+def get_rank_data(puuid, valorant_region, force_refresh=False):
+    """Returns (rank_data, cache_status), serving cached results stale-while-revalidate."""
+    if not force_refresh:
+        cached, state = _cached_rank_data(puuid, valorant_region)
+        if state != MISS:
+            return cached, state
+
+    try:
+        rank_data = fetch_rank_data(puuid, valorant_region)
+    except CircuitOpenError as e:
+        return _rank_data_without_upstream(rank_cache_key(valorant_region, puuid), e)
+    store_rank_data(rank_cache_key(valorant_region, puuid), rank_data)
+    return rank_data, MISS
+
+def _rank_data_without_upstream(cache_key, error):
+    """Fallback while the shard's circuit is open: any cached or persisted rank_data, reported as STALE.
+
+    Re-raises `error` when the player has never been looked up.
+    """
+    cached, state = rank_cache.get(cache_key)
+    if state == MISS:
+        persisted = snapshot_store.latest_rank(*cache_key)
+        if persisted is None:
+            raise error
+        cached = persisted[0]
+    log.info("rank.fallback", "Riot API circuit open, serving the last known rank", region=cache_key[0], puuid=cache_key[1])
+    return cached, STALE
+
+def store_rank_data(cache_key, rank_data):
+    """Caches freshly fetched rank_data and queues it for the snapshot store."""
+    rank_cache.set(cache_key, rank_data)
+    snapshot_store.record_rank(cache_key[0], cache_key[1], rank_data)
+
+def _cached_rank_data(puuid, valorant_region):
+    """Non-blocking cache read: (rank_data, state); stale hits schedule a background refresh.
+
+    A leaderboard index entry newer than the cached rank_data (or standing in
+    for a miss) is served instead, FRESH or STALE by its own age.
+    """
+    cache_key = rank_cache_key(valorant_region, puuid)
+    cached, state = rank_cache.get(cache_key)
+    CACHE_LOOKUPS.inc("rank", {FRESH: "hit", STALE: "stale", MISS: "miss"}[state])
+    source = "rank"
+    if state != FRESH and leaderboards.enabled:
+        entry = leaderboards.lookup_puuid(cache_key[0], puuid)
+        newer = entry is not None and (state == MISS or entry.updated_at > cached.get('fetched_at', 0))
+        CACHE_LOOKUPS.inc("leaderboard", "hit" if newer else "miss")
+        if newer: # Answered from the leaderboard index: no upstream call unless it is stale too
+            cached, source = leaderboard_rank_data(entry), "leaderboard"
+            state = FRESH if time.time() - entry.updated_at < RANK_CACHE_FRESH_TTL else STALE
+    if state == FRESH:
+        log.info("cache.hit", "Rank cache hit (fresh)", cache=source, puuid=puuid)
+    elif state == STALE:
+        log.info("cache.stale", "Rank cache hit (stale), refreshing in background", cache=source, puuid=puuid)
+        if rank_cache.try_begin_refresh(cache_key):
+            threading.Thread(
+                target=_refresh_rank_data, args=(cache_key, puuid, valorant_region), daemon=True
+            ).start()
+    return cached, state
+
+def leaderboard_rank_data(entry):
+    """rank_data for a leaderboard entry; losses come from the match tally once it has counted all of the same act."""
+    tier = tier_catalog.tier(entry.competitive_tier)
+    tally = match_tally.cached(entry.region, entry.puuid)
+    return {
+        'tier': tier.name if tier else 'Unranked',
+        'currenttier': entry.competitive_tier,
+        'lp': entry.ranked_rating,
+        'wins': entry.wins,
+        'losses': tally['losses'] if match_tally.is_current(tally, act=entry.act) else '--',
+        'leaderboard_rank': entry.leaderboard_rank,
+        'rank_icon_url': tier.icon_url if tier else None,
+        'fetched_at': int(entry.updated_at), # When the leaderboard was ingested
+    }
+
+def _refresh_rank_data(cache_key, puuid, valorant_region):
+    """Background worker for stale rank cache entries; keeps the stale value on failure."""
+    try:
+        store_rank_data(cache_key, fetch_rank_data(puuid, valorant_region))
+    except Exception as e:
+        log.warning("rank.refresh_failed", "Background rank refresh failed", puuid=puuid, error=str(e))
+    finally:
+        rank_cache.end_refresh(cache_key)
+
+# --- Pre-warming (popular players are refreshed before their rank entries go stale) ---
+
+def _needs_prewarm(cache_key):
+    entry = leaderboards.lookup_puuid(*cache_key)
+    if entry is not None and time.time() - entry.updated_at < RANK_CACHE_FRESH_TTL - PREWARM_LEAD:
+        return False # Answered fresh from the leaderboard index
+    age = rank_cache.age(cache_key)
+    return age is None or age >= RANK_CACHE_FRESH_TTL - PREWARM_LEAD
+
+def _prewarm_rank_data(cache_key):
+    if rank_cache.try_begin_refresh(cache_key): # Skip keys a stale hit is already refreshing
+        _refresh_rank_data(cache_key, cache_key[1], cache_key[0])
+
+# A refresh costs two upstream calls (Ranked + MMR), plus the matchlist and any new matches
+prewarmer = Prewarmer(_needs_prewarm, _prewarm_rank_data, calls_per_refresh=3 if match_tally.enabled else 2)
+
+# --- Typeahead (suggestions from every Riot ID resolved so far) ---
+
+# Rebuilt from the snapshot store by warm_caches() and reloaded periodically (IDs other workers resolved); grows as lookups succeed
+riot_id_index = RiotIdIndex(snapshot_store)
+
+def record_riot_id(account_region, username, tag, leaderboard_entry=None):
+    """Counts a successful lookup towards suggestions; a new ID is spelled as typed until Riot's spelling is known."""
+    riot_id = leaderboard_entry.riot_id if leaderboard_entry is not None and leaderboard_entry.riot_id else f"{username}#{tag}"
+    riot_id_index.record(riot_id_cache_key(account_region, username, tag), riot_id)
+
+def suggest_riot_ids(prefix, limit):
+    """Resolved Riot IDs ("GameName#TagLine") starting with `prefix` (any case), most looked-up first; no upstream calls."""
+    return riot_id_index.suggest(prefix, limit)
+
+# --- Snapshot Store (persistence across restarts) ---
+
+def rank_history(puuid, limit):
+    """Recorded rank changes for a player, newest first; read locally, no upstream calls."""
+    return snapshot_store.rank_history(puuid, limit)
+
+def warm_caches():
+    """Restores recently resolved PUUIDs and rank data from the snapshot store into the in-memory caches."""
+    if not snapshot_store.enabled:
+        return
+    puuids = snapshot_store.recent_puuids(PUUID_CACHE_TTL, SNAPSHOT_WARM_LIMIT)
+    for cache_key, puuid, age in puuids:
+        puuid_cache.set(cache_key, puuid, ttl=PUUID_CACHE_TTL - age)
+    ranks = snapshot_store.recent_ranks(RANK_CACHE_FRESH_TTL + RANK_CACHE_STALE_TTL, SNAPSHOT_WARM_LIMIT)
+    for valorant_region, puuid, rank_data, age in ranks:
+        rank_cache.set(rank_cache_key(valorant_region, puuid), rank_data, age=age) # Keeps its real freshness
+        shard_cache.set(puuid, valorant_region, ttl=SHARD_CACHE_TTL - age) # Snapshots are stored under the routed shard
+    riot_id_index.rebuild(snapshot_store.popular_riot_ids(TYPEAHEAD_MAX_IDS))
+    log.info("cache.warmed", "Warmed caches from snapshot store", riot_ids=len(puuids), rank_entries=len(ranks))
+
+# --- Error Reporting ---
+
+def describe_lookup_error(e, valorant_region):
+    """Logs a lookup failure and returns the user-facing error message for it."""
+    if isinstance(e, RateLimitExceeded):
+        log.warning("lookup.error", "Outbound rate limit reached, not calling Riot API", kind="ratelimited", error=str(e))
+        return "Rate limit exceeded. Too many requests are being made. Please wait a moment before trying again."
+    if isinstance(e, CircuitOpenError):
+        log.warning("lookup.error", "Riot API host circuit open, not calling it", kind="circuit_open", error=str(e))
+        return "Riot API is having problems right now, so requests are paused briefly. Please try again in a few seconds."
+    if isinstance(e, requests.exceptions.Timeout):
+        log.warning("lookup.error", "Request to Riot API timed out", kind="timeout")
+        return "Request to Riot API timed out. The service might be busy. Please try again later."
+    if isinstance(e, requests.exceptions.HTTPError):
+        status_code = e.response.status_code
+        response_text = e.response.text
+        log.error("lookup.error", "Riot API HTTP error", kind="http", status=status_code, response=response_text)
+        # More specific user messages
+        if status_code == 400: return "Invalid request sent to Riot API. Please check the input format."
+        elif status_code == 401: return "Unauthorized: Invalid Riot API Key. Please contact the site administrator."
+        elif status_code == 403: return "Forbidden: The Riot API Key may be expired, invalid, or lack permissions for the requested data (e.g., MMR API)."
+        elif status_code == 404: # Should be caught earlier for account, but catch here for MMR API
+             return f"Player data not found in region '{valorant_region}'. They might be unranked or the Riot ID is incorrect."
+        elif status_code == 429: return "Rate limit exceeded. Too many requests are being made. Please wait a moment before trying again."
+        elif status_code >= 500: return f"Riot API is temporarily unavailable (Server Error {status_code}). Please try again later."
+        else: return f"An error occurred while contacting Riot API (Code: {status_code})."
+    if isinstance(e, requests.exceptions.RequestException):
+        log.error("lookup.error", "Network error", kind="network", error=str(e))
+        return "Network error: Could not connect to Riot API. Please check your internet connection and Riot API status."
+    if isinstance(e, ValueError): # Custom errors raised by the lookup stages
+        log.info("lookup.error", "Data processing error", kind="data", error=str(e))
+        return str(e) # Display the specific ValueError message
+    log.exception("lookup.error", "Unexpected error", e, kind="unexpected")
+    return "An unexpected server error occurred. Please try again later or contact support."
+
+def lookup_error_status(e):
+    """Maps a lookup failure to the HTTP status used by the programmatic (JSON) endpoints."""
+    if isinstance(e, RateLimitExceeded):
+        return 429
+    if isinstance(e, CircuitOpenError):
+        return 503
+    if isinstance(e, requests.exceptions.HTTPError):
+        return 429 if e.response.status_code == 429 else 502
+    if isinstance(e, requests.exceptions.Timeout):
+        return 504
+    if isinstance(e, requests.exceptions.RequestException):
+        return 502
+    if isinstance(e, ValueError):
+        return 404
+    return 500
+
+
+# Runs once per process at import (in the gunicorn master with --preload, inherited by every worker)
+warm_caches()
@@ -0,0 +1,372 @@
+# Filename: shared_cache.py
+# --- Host-wide lookup caches in shared memory (one copy for every gunicorn worker) ---
+# An in-process cache is duplicated per worker: each one pays its own misses and holds its
+# own copy. These caches keep fixed-size binary entries in an anonymous shared mmap created
+# at import; with gunicorn --preload the master creates it and every forked worker maps the
+# same pages. The table is split into segments (lock stripes), each an open-addressing hash
+# table with bounded linear probing, guarded by a process-shared lock.
+import hashlib
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+from cache import TTLCache, StaleWhileRevalidateCache, MISSING, FRESH, STALE, MISS
+from structured_log import get_logger
+
+log = get_logger("shared_cache")
+
+# --- Configuration ---
+# Needs fork() so workers inherit the mapping; elsewhere the in-process caches are used
+SHARED_CACHE_ENABLED = os.environ.get("SHARED_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on") and hasattr(os, "fork")
+SHARED_CACHE_STRIPES = int(os.environ.get("SHARED_CACHE_STRIPES", 64))  # Segments, each with its own lock
+SHARED_CACHE_LOAD_FACTOR = float(os.environ.get("SHARED_CACHE_LOAD_FACTOR", 0.8))  # Entries per slot at maxsize
+# A worker killed while holding a segment lock would block that segment; give up (miss / skip) after this long
+SHARED_CACHE_LOCK_TIMEOUT = float(os.environ.get("SHARED_CACHE_LOCK_TIMEOUT", 0.25))
+REFRESH_CLAIM_TTL = 60.0  # Seconds a background refresh claim is honoured (outlives a crashed refresher briefly)
+
+PROBE_LIMIT = 16  # Slots examined per operation; when all are live, the oldest is evicted
+
+# Slot: state, key hash, stored_at, expires_at (time.monotonic(), which is host-wide), key length, value length
+_SLOT = struct.Struct("<BQddHH")
+_EMPTY, _USED, _DELETED = 0, 1, 2
+
+# --- Entry encoding ---
+# Keys: strings or tuples of strings. Values: None, str, rank_data dicts (packed) or any JSON value.
+_NONE, _STR, _RANK, _JSON = 0, 1, 2, 3
+_RANK_HEAD = struct.Struct("<iiiiq")  # currenttier, lp, wins, losses, fetched_at
+_INT_DASH = -2**31  # '--' (not provided by Riot)
+_INT_ABSENT = -2**31 + 1  # Not packed: absent, or kept in the JSON tail
+_ICON_NONE, _ICON_ABSENT = 0xFFFF, 0xFFFE  # Icon length markers
+_RANK_PACKED = ("tier", "currenttier", "lp", "wins", "losses", "fetched_at", "rank_icon_url")
+
+
+def encode_key(key):
+    if isinstance(key, tuple):
+        return "\x1f".join(key).encode("utf-8")
+    return key.encode("utf-8")
+
+
+def encode_value(value):
+    if value is None:
+        return bytes((_NONE,))
+    if isinstance(value, str):
+        return bytes((_STR,)) + value.encode("utf-8")
+    if isinstance(value, dict) and isinstance(value.get("tier"), str):
+        return _encode_rank(value)
+    return bytes((_JSON,)) + json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def decode_value(data):
+    kind = data[0]
+    if kind == _NONE:
+        return None
+    if kind == _STR:
+        return data[1:].decode("utf-8")
+    if kind == _RANK:
+        return _decode_rank(data)
+    return json.loads(data[1:])
+
+
+def _pack_int(value, extra, name):
+    if value == "--":
+        return _INT_DASH
+    if isinstance(value, int) and not isinstance(value, bool) and _INT_ABSENT < value < 2**31:
+        return value
+    if value is not MISSING:
+        extra[name] = value # Unusual value: kept exactly, in the JSON tail
+    return _INT_ABSENT
+
+
+def _encode_rank(rank_data):
+    """rank_data -> tier, four int32 fields, fetched_at and icon URL packed; anything else as a JSON tail."""
+    extra = {name: value for name, value in rank_data.items() if name not in _RANK_PACKED}
+    counters = [_pack_int(rank_data.get(name, MISSING), extra, name) for name in ("currenttier", "lp", "wins", "losses")]
+    fetched_at = rank_data.get("fetched_at", MISSING)
+    if not (isinstance(fetched_at, int) and not isinstance(fetched_at, bool)):
+        if fetched_at is not MISSING:
+            extra["fetched_at"] = fetched_at
+        fetched_at = -1
+    tier = rank_data["tier"].encode("utf-8")
+    icon = rank_data.get("rank_icon_url", MISSING)
+    if isinstance(icon, str):
+        icon, icon_length = icon.encode("utf-8"), len(icon.encode("utf-8"))
+    else:
+        if icon not in (None, MISSING):
+            extra["rank_icon_url"] = icon
+        icon, icon_length = b"", _ICON_NONE if icon is None else _ICON_ABSENT
+    if len(tier) > 255 or len(icon) >= _ICON_ABSENT:
+        return bytes((_JSON,)) + json.dumps(rank_data, separators=(",", ":")).encode("utf-8")
+    tail = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+    return b"".join((
+        bytes((_RANK, len(tier))), tier, _RANK_HEAD.pack(*counters, fetched_at),
+        struct.pack("<H", icon_length), icon, tail,
+    ))
+
+
+def _decode_rank(data):
+    tier_end = 2 + data[1]
+    rank_data = {"tier": data[2:tier_end].decode("utf-8")}
+    currenttier, lp, wins, losses, fetched_at = _RANK_HEAD.unpack_from(data, tier_end)
+    for name, value in (("currenttier", currenttier), ("lp", lp), ("wins", wins), ("losses", losses)):
+        if value != _INT_ABSENT:
+            rank_data[name] = "--" if value == _INT_DASH else value
+    offset = tier_end + _RANK_HEAD.size
+    (icon_length,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    if icon_length == _ICON_NONE:
+        rank_data["rank_icon_url"] = None
+    elif icon_length != _ICON_ABSENT:
+        rank_data["rank_icon_url"] = data[offset:offset + icon_length].decode("utf-8")
+        offset += icon_length
+    if fetched_at >= 0:
+        rank_data["fetched_at"] = fetched_at
+    if len(data) > offset:
+        rank_data.update(json.loads(data[offset:]))
+    return rank_data
+
+
+def _key_hash(key_bytes):
+    # Stable across processes (unlike hash(), which is seeded per interpreter)
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+
+class SharedHashTable:
+    """Fixed-size hash table of byte keys/values in an anonymous shared mmap.
+
+    `capacity` slots of `slot_size` bytes are split into `stripes` segments. A
+    key lives in the segment chosen by its hash and is found by linear probing
+    within at most PROBE_LIMIT slots; when all of those hold live entries, the
+    one stored longest ago is overwritten, so memory never grows. Each segment
+    has a multiprocessing lock, shared with forked children. Entries larger
+    than the slot are not stored (put() returns False).
+    """
+
+    def __init__(self, name, capacity, slot_size, stripes=SHARED_CACHE_STRIPES, lock_timeout=SHARED_CACHE_LOCK_TIMEOUT):
+        self.name = name
+        self.stripes = max(1, stripes)
+        self.segment_slots = max(PROBE_LIMIT, math.ceil(capacity / self.stripes))
+        self.slot_size = max(slot_size, _SLOT.size + 16)
+        self.max_payload = self.slot_size - _SLOT.size
+        self.lock_timeout = lock_timeout
+        self.probe_limit = min(PROBE_LIMIT, self.segment_slots)
+        self._map = mmap.mmap(-1, self.stripes * self.segment_slots * self.slot_size) # MAP_SHARED: survives fork()
+        self._locks = [multiprocessing.Lock() for _ in range(self.stripes)]
+
+    @property
+    def size_bytes(self):
+        return len(self._map)
+
+    def _segment(self, key_hash):
+        segment = key_hash % self.stripes
+        return segment, (key_hash // self.stripes) % self.segment_slots
+
+    def _offsets(self, segment, start):
+        base = segment * self.segment_slots
+        for i in range(self.probe_limit):
+            yield (base + (start + i) % self.segment_slots) * self.slot_size
+
+    def _acquire(self, segment):
+        if self._locks[segment].acquire(timeout=self.lock_timeout):
+            return True
+        log.warning("shared_cache.lock_timeout", "Shared cache segment lock timed out", cache=self.name, segment=segment)
+        return False
+
+    def _find(self, key_bytes, key_hash, segment, start):
+        """Offset of the slot holding `key_bytes` (any expiry), or None; lock held."""
+        for offset in self._offsets(segment, start):
+            state, slot_hash, _, _, key_length, _ = _SLOT.unpack_from(self._map, offset)
+            if state == _EMPTY:
+                return None
+            if state == _USED and slot_hash == key_hash and self._slot_key(offset, key_length) == key_bytes:
+                return offset
+        return None
+
+    def _slot_key(self, offset, key_length):
+        start = offset + _SLOT.size
+        return self._map[start:start + key_length]
+
+    def get(self, key_bytes, now):
+        """(stored_at, expires_at, value bytes) for an unexpired entry, else None."""
+        key_hash = _key_hash(key_bytes)
+        segment, start = self._segment(key_hash)
+        if not self._acquire(segment):
+            return None
+        try:
+            offset = self._find(key_bytes, key_hash, segment, start)
+            if offset is None:
+                return None
+            _, _, stored_at, expires_at, key_length, value_length = _SLOT.unpack_from(self._map, offset)
+            if expires_at <= now:
+                return None
+            value_start = offset + _SLOT.size + key_length
+            return stored_at, expires_at, self._map[value_start:value_start + value_length]
+        finally:
+            self._locks[segment].release()
+
+    def put(self, key_bytes, value_bytes, stored_at, expires_at, only_if_absent=False):
+        """Stores an entry; False if it does not fit a slot, the lock timed out, or (only_if_absent) a live entry exists."""
+        if len(key_bytes) + len(value_bytes) > self.max_payload:
+            return False
+        key_hash = _key_hash(key_bytes)
+        segment, start = self._segment(key_hash)
+        if not self._acquire(segment):
+            return False
+        try:
+            now = time.monotonic()
+            target = reusable = oldest = None
+            oldest_stored_at = math.inf
+            for offset in self._offsets(segment, start):
+                state, slot_hash, slot_stored_at, slot_expires_at, key_length, _ = _SLOT.unpack_from(self._map, offset)
+                if state == _EMPTY:
+                    target = reusable if reusable is not None else offset
+                    break
+                if state == _USED and slot_hash == key_hash and self._slot_key(offset, key_length) == key_bytes:
+                    if only_if_absent and slot_expires_at > now:
+                        return False
+                    target = offset
+                    break
+                if state == _DELETED or slot_expires_at <= now:
+                    if reusable is None:
+                        reusable = offset # Keep probing: the key may still be further along
+                elif slot_stored_at < oldest_stored_at:
+                    oldest, oldest_stored_at = offset, slot_stored_at
+            if target is None:
+                target = reusable if reusable is not None else oldest # Evicts the oldest live entry in the window
+            _SLOT.pack_into(self._map, target, _USED, key_hash, stored_at, expires_at, len(key_bytes), len(value_bytes))
+            payload_start = target + _SLOT.size
+            self._map[payload_start:payload_start + len(key_bytes) + len(value_bytes)] = key_bytes + value_bytes
+            return True
+        finally:
+            self._locks[segment].release()
+
+    def delete(self, key_bytes):
+        key_hash = _key_hash(key_bytes)
+        segment, start = self._segment(key_hash)
+        if not self._acquire(segment):
+            return
+        try:
+            offset = self._find(key_bytes, key_hash, segment, start)
+            if offset is not None:
+                self._map[offset] = _DELETED # Not _EMPTY: that would cut probe chains passing through this slot
+        finally:
+            self._locks[segment].release()
+
+    def clear(self):
+        segment_bytes = self.segment_slots * self.slot_size
+        for segment, lock in enumerate(self._locks):
+            with lock:
+                self._map[segment * segment_bytes:(segment + 1) * segment_bytes] = bytes(segment_bytes)
+
+    def count(self, now):
+        """Live entries (scans the whole table; for diagnostics)."""
+        live = 0
+        for offset in range(0, len(self._map), self.slot_size):
+            state, _, _, expires_at, _, _ = _SLOT.unpack_from(self._map, offset)
+            live += state == _USED and expires_at > now
+        return live
+
+
+class SharedTTLCache:
+    """TTLCache interface backed by a SharedHashTable (host-wide; oldest-stored eviction instead of LRU)."""
+
+    def __init__(self, name, maxsize, ttl, slot_size):
+        self.ttl = float(ttl)
+        self.table = SharedHashTable(name, math.ceil(max(1, int(maxsize)) / SHARED_CACHE_LOAD_FACTOR), slot_size)
+
+    def get(self, key, default=MISSING):
+        entry = self.table.get(encode_key(key), time.monotonic())
+        return default if entry is None else decode_value(entry[2])
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        self.table.put(encode_key(key), encode_value(value), now, now + (self.ttl if ttl is None else float(ttl)))
+
+    def delete(self, key):
+        self.table.delete(encode_key(key))
+
+    def clear(self):
+        self.table.clear()
+
+    def __len__(self):
+        return self.table.count(time.monotonic())
+
+
+class SharedStaleWhileRevalidateCache:
+    """StaleWhileRevalidateCache interface backed by a SharedHashTable.
+
+    Refresh claims are entries in the same table, so one worker on the host
+    refreshes a stale key while the others keep serving it.
+    """
+
+    def __init__(self, name, maxsize, fresh_ttl, stale_ttl, slot_size):
+        self.fresh_ttl = float(fresh_ttl)
+        self.stale_ttl = float(stale_ttl)
+        self.table = SharedHashTable(name, math.ceil(max(1, int(maxsize)) / SHARED_CACHE_LOAD_FACTOR), slot_size)
+
+    def get(self, key):
+        now = time.monotonic()
+        entry = self.table.get(encode_key(key), now)
+        if entry is None:
+            return MISSING, MISS
+        stored_at, _, data = entry
+        return decode_value(data), (FRESH if now - stored_at < self.fresh_ttl else STALE)
+
+    def set(self, key, value, age=0.0):
+        stored_at = time.monotonic() - age
+        self.table.put(encode_key(key), encode_value(value), stored_at, stored_at + self.fresh_ttl + self.stale_ttl)
+
+    def age(self, key):
+        now = time.monotonic()
+        entry = self.table.get(encode_key(key), now)
+        return None if entry is None else now - entry[0]
+
+    def try_begin_refresh(self, key):
+        now = time.monotonic()
+        return self.table.put(b"\x00refresh\x00" + encode_key(key), b"", now, now + REFRESH_CLAIM_TTL, only_if_absent=True)
+
+    def end_refresh(self, key):
+        self.table.delete(b"\x00refresh\x00" + encode_key(key))
+
+    def delete(self, key):
+        self.table.delete(encode_key(key))
+
+    def clear(self):
+        self.table.clear()
+
+    def __len__(self):
+        return self.table.count(time.monotonic())
+
+
+_fallback_logged = threading.Event()
+
+
+def _shared_or_none(factory, name):
+    if not SHARED_CACHE_ENABLED:
+        return None
+    try:
+        cache = factory()
+    except (OSError, ValueError, ImportError) as e: # e.g. no working sem_open (/dev/shm) for the locks
+        if not _fallback_logged.is_set():
+            _fallback_logged.set()
+            log.warning("shared_cache.disabled", "Shared-memory caches unavailable, using per-process caches", error=str(e))
+        return None
+    log.info("shared_cache.created", "Created shared-memory cache", cache=name, bytes=cache.table.size_bytes,
+             stripes=cache.table.stripes, slot_size=cache.table.slot_size)
+    return cache
+
+
+def ttl_cache(name, maxsize, ttl, slot_size):
+    """A host-wide SharedTTLCache when available, else an in-process TTLCache."""
+    shared = _shared_or_none(lambda: SharedTTLCache(name, maxsize, ttl, slot_size), name)
+    return shared if shared is not None else TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+def stale_while_revalidate_cache(name, maxsize, fresh_ttl, stale_ttl, slot_size):
+    """A host-wide SharedStaleWhileRevalidateCache when available, else an in-process StaleWhileRevalidateCache."""
+    shared = _shared_or_none(lambda: SharedStaleWhileRevalidateCache(name, maxsize, fresh_ttl, stale_ttl, slot_size), name)
+    return shared if shared is not None else StaleWhileRevalidateCache(maxsize=maxsize, fresh_ttl=fresh_ttl, stale_ttl=stale_ttl)
@@ -0,0 +1,139 @@
+# Filename: singleflight.py
+# --- Request coalescing for identical concurrent upstream calls ---
+# When hundreds of /lookup POSTs for the same Riot ID arrive at once, only one of them
+# should call Riot; the rest wait for that call and reuse its result (or error).
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from structured_log import get_logger
+
+try:
+    import fcntl  # POSIX only; without it coalescing is per-process
+except ImportError:
+    fcntl = None
+
+log = get_logger("singleflight")
+
+# --- Configuration ---
+# Directory for cross-worker lock/result files; set to an empty string to coalesce per process only
+SINGLEFLIGHT_DIR = os.environ.get("SINGLEFLIGHT_DIR", os.path.join(tempfile.gettempdir(), "ecaly-singleflight"))
+# How long a result written by another worker may be reused by a worker that was waiting on it
+SINGLEFLIGHT_SHARE_TTL = float(os.environ.get("SINGLEFLIGHT_SHARE_TTL", 2.0))
+
+_NO_RESULT = object()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one fn() per key at a time; concurrent callers share its outcome.
+
+    Within a process, waiting threads receive the leader's return value or
+    exception. Across processes (when `shared_dir` is set), the leader thread of
+    each worker takes a per-key flock(); a worker that had to wait reuses the
+    JSON result the previous holder wrote if it is younger than `share_ttl`.
+    Only successful, JSON-serializable results are shared between workers.
+    """
+
+    def __init__(self, name, shared_dir=SINGLEFLIGHT_DIR, share_ttl=SINGLEFLIGHT_SHARE_TTL):
+        self.name = name
+        self.shared_dir = shared_dir if (shared_dir and fcntl) else None
+        self.share_ttl = share_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._prune_at = 0.0
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    def do(self, key, fn):
+        """Returns fn()'s result, sharing one execution among concurrent callers for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn) if self.shared_dir else fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    # --- Cross-worker coordination ---
+
+    def _run_shared(self, key, fn):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        base = os.path.join(self.shared_dir, f"{self.name}-{digest}")
+        fd = os.open(base + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)  # Blocks while another worker runs fn() for this key
+            result = self._read_result(base + ".json")
+            if result is not _NO_RESULT:
+                return result
+            result = fn()
+            self._write_result(base + ".json", result)
+            return result
+        finally:
+            os.close(fd)  # Also releases the flock
+            self._maybe_prune()
+
+    def _read_result(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.share_ttl:
+                return _NO_RESULT
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["value"]
+        except (OSError, ValueError, KeyError):
+            return _NO_RESULT
+
+    @staticmethod
+    def _write_result(path, value):
+        try:
+            data = json.dumps({"value": value})
+        except (TypeError, ValueError):
+            return  # Not shareable across workers; in-process waiters still get it
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Atomic: readers never see a partial file
+        except OSError as e:
+            log.warning("singleflight.write_failed", "Could not write single-flight result", path=path, error=str(e))
+
+    def _maybe_prune(self):
+        """Removes stale per-key files about once a minute so the directory stays small."""
+        now = time.time()
+        if now < self._prune_at:
+            return
+        self._prune_at = now + 60
+        try:
+            for entry in os.scandir(self.shared_dir):
+                # Lock files are kept for an hour: deleting one that a worker is waiting on
+                # only costs a duplicate upstream call, never a wrong result
+                max_age = 3600 if entry.name.endswith(".lock") else 60
+                if entry.name.startswith(self.name + "-") and now - entry.stat().st_mtime > max_age:
+                    os.unlink(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,319 @@
+# Filename: snapshot_store.py
+# --- Persistent SQLite (WAL) store for resolved Riot IDs and rank snapshots ---
+# Lets a freshly started worker warm its in-memory caches instead of sending every first
+# lookup to Riot, keeps a compact per-player rank history (one row per rank change), and holds
+# each player's running win/loss tally from match history.
+# Writes are queued and committed in batches by a background thread, never on the request thread.
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from structured_log import get_logger
+
+log = get_logger("snapshot_store")
+
+# --- Configuration ---
+# Database file shared by all workers on the host; set to an empty string to disable persistence
+SNAPSHOT_DB = os.environ.get("SNAPSHOT_DB", os.path.join(tempfile.gettempdir(), "ecaly-snapshots.sqlite3"))
+SNAPSHOT_FLUSH_INTERVAL = float(os.environ.get("SNAPSHOT_FLUSH_INTERVAL", 1.0))  # Longest a write waits to be batched
+SNAPSHOT_BATCH_SIZE = int(os.environ.get("SNAPSHOT_BATCH_SIZE", 500))  # Writes per transaction
+SNAPSHOT_QUEUE_SIZE = int(os.environ.get("SNAPSHOT_QUEUE_SIZE", 10000))  # Pending writes; extra ones are dropped
+RANK_HISTORY_KEEP = int(os.environ.get("RANK_HISTORY_KEEP", 50))  # Rank changes kept per player
+
+TALLY_FIELDS = ("act", "wins", "losses", "last_match_id", "last_match_start", "backfill_before")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS riot_ids (
+    account_region TEXT NOT NULL,
+    username TEXT NOT NULL,  -- Normalized (lowercase) like the PUUID cache key
+    tag TEXT NOT NULL,
+    puuid TEXT NOT NULL,
+    resolved_at REAL NOT NULL,
+    PRIMARY KEY (account_region, username, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS riot_ids_resolved_at ON riot_ids (resolved_at);
+
+CREATE TABLE IF NOT EXISTS rank_latest (
+    valorant_region TEXT NOT NULL,
+    puuid TEXT NOT NULL,
+    data TEXT NOT NULL,  -- rank_data as JSON
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (valorant_region, puuid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rank_latest_fetched_at ON rank_latest (fetched_at);
+
+CREATE TABLE IF NOT EXISTS rank_history (
+    puuid TEXT NOT NULL,
+    fetched_at REAL NOT NULL,  -- When this rank was first seen
+    valorant_region TEXT NOT NULL,
+    tier TEXT,
+    lp,  -- Untyped: values are ints or '--' as in rank_data
+    wins,
+    losses,
+    PRIMARY KEY (puuid, fetched_at)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS riot_id_lookups (
+    account_region TEXT NOT NULL,
+    username TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    lookups INTEGER NOT NULL,  -- Successful lookups, ranks typeahead suggestions
+    riot_id TEXT,  -- "GameName#TagLine" as Riot spells it (as typed until the Account API confirms it)
+    PRIMARY KEY (account_region, username, tag)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS match_tally (
+    valorant_region TEXT NOT NULL,
+    puuid TEXT NOT NULL,
+    act_id TEXT,  -- seasonId of the counted matches; the tally restarts when it changes
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    last_match_id TEXT,
+    last_match_start INTEGER NOT NULL,  -- gameStartTimeMillis of last_match_id (newest counted)
+    backfill_before INTEGER NOT NULL,  -- gameStartTimeMillis of the oldest counted match; 0 once the act is fully counted
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (valorant_region, puuid)
+) WITHOUT ROWID;
+"""
+
+
+class SnapshotStore:
+    """SQLite-backed record of Riot ID -> PUUID resolutions and rank_data snapshots.
+
+    record_*() only enqueue; a per-process writer thread (started on first use,
+    so it is created after a gunicorn fork) commits queued writes in batches.
+    Readers use one connection per thread. Failures are logged and never
+    propagate to lookups: the store is an optimization.
+    """
+
+    def __init__(self, path=SNAPSHOT_DB, flush_interval=SNAPSHOT_FLUSH_INTERVAL,
+                 batch_size=SNAPSHOT_BATCH_SIZE, queue_size=SNAPSHOT_QUEUE_SIZE, history_keep=RANK_HISTORY_KEEP):
+        self.path = path or None
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.queue_size = queue_size
+        self.history_keep = history_keep
+        self._queue = None
+        self._queue_pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if self.path:
+            try:
+                with closing(self._connect()) as conn:
+                    conn.execute("PRAGMA journal_mode=WAL") # Persistent: readers never block the writer
+                    conn.executescript(SCHEMA)
+            except sqlite3.Error as e:
+                log.warning("snapshot.disabled", "Snapshot store disabled, could not open database", path=self.path, error=str(e))
+                self.path = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    # --- Writes (queued) ---
+
+    def record_puuid(self, cache_key, puuid):
+        """Queues a Riot ID resolution; `cache_key` is the normalized (account_region, username, tag)."""
+        self._enqueue(("puuid", tuple(cache_key), puuid, time.time()))
+
+    def record_rank(self, valorant_region, puuid, rank_data):
+        """Queues a freshly fetched rank_data snapshot."""
+        self._enqueue(("rank", valorant_region, puuid, rank_data))
+
+    def record_lookups(self, counts):
+        """Queues lookup counts to add, as {normalized (account_region, username, tag): (lookups, display riot_id)}."""
+        self._enqueue(("lookups", [(*cache_key, lookups, riot_id) for cache_key, (lookups, riot_id) in counts.items()]))
+
+    def record_match_tally(self, valorant_region, puuid, tally):
+        """Queues a player's running win/loss tally (see match_history.py)."""
+        self._enqueue(("tally", valorant_region, puuid, dict(tally), time.time()))
+
+    def _enqueue(self, item):
+        if not self.path:
+            return
+        if self._queue_pid != os.getpid():
+            with self._lock:
+                if self._queue_pid != os.getpid(): # Forked child: the parent's writer thread doesn't exist here
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    self._queue_pid = os.getpid()
+                    threading.Thread(target=self._run_writer, args=(self._queue,), name="snapshot-writer", daemon=True).start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            log.warning("snapshot.dropped", "Snapshot write queue full, dropping snapshot")
+
+    def _run_writer(self, pending):
+        conn = self._connect()
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                with conn: # One transaction per batch
+                    for item in batch:
+                        self._write(conn, item)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                log.warning("snapshot.write_failed", "Could not write snapshots", count=len(batch), error=str(e))
+
+    def _write(self, conn, item):
+        if item[0] == "puuid":
+            _, (account_region, username, tag), puuid, resolved_at = item
+            conn.execute(
+                "INSERT OR REPLACE INTO riot_ids VALUES (?, ?, ?, ?, ?)",
+                (account_region, username, tag, puuid, resolved_at),
+            )
+            return
+
+        if item[0] == "lookups":
+            conn.executemany(
+                "INSERT INTO riot_id_lookups VALUES (?, ?, ?, ?, ?) ON CONFLICT (account_region, username, tag) "
+                "DO UPDATE SET lookups = lookups + excluded.lookups, riot_id = excluded.riot_id", item[1]
+            )
+            return
+
+        if item[0] == "tally":
+            _, valorant_region, puuid, tally, updated_at = item
+            conn.execute(
+                "INSERT OR REPLACE INTO match_tally VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (valorant_region, puuid, *(tally[field] for field in TALLY_FIELDS), updated_at),
+            )
+            return
+
+        _, valorant_region, puuid, rank_data = item
+        fetched_at = rank_data.get("fetched_at") or time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO rank_latest VALUES (?, ?, ?, ?)",
+            (valorant_region, puuid, json.dumps(rank_data), fetched_at),
+        )
+        rank = (rank_data.get("tier"), rank_data.get("lp"), rank_data.get("wins"), rank_data.get("losses"))
+        last = conn.execute(
+            "SELECT tier, lp FROM rank_history WHERE puuid = ? ORDER BY fetched_at DESC LIMIT 1", (puuid,)
+        ).fetchone()
+        if last == rank[:2]:
+            return # Compact history: only tier/RR changes are kept (a W/L-only change would look like a duplicate row)
+        conn.execute("INSERT OR REPLACE INTO rank_history VALUES (?, ?, ?, ?, ?, ?, ?)", (puuid, fetched_at, valorant_region, *rank))
+        conn.execute(
+            "DELETE FROM rank_history WHERE puuid = ? AND fetched_at NOT IN "
+            "(SELECT fetched_at FROM rank_history WHERE puuid = ? ORDER BY fetched_at DESC LIMIT ?)",
+            (puuid, puuid, self.history_keep),
+        )
+
+    # --- Reads ---
+
+    def rank_history(self, puuid, limit):
+        """Recorded rank changes for a player, newest first: [{'fetched_at', 'region', 'tier', 'lp', 'wins', 'losses'}]."""
+        if not self.path:
+            return []
+        try:
+            rows = self._reader().execute(
+                "SELECT fetched_at, valorant_region, tier, lp, wins, losses FROM rank_history "
+                "WHERE puuid = ? ORDER BY fetched_at DESC LIMIT ?", (puuid, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            log.warning("snapshot.read_failed", "Could not read rank history", puuid=puuid, error=str(e))
+            return []
+        return [
+            {"fetched_at": fetched_at, "region": region, "tier": tier, "lp": lp, "wins": wins, "losses": losses}
+            for fetched_at, region, tier, lp, wins, losses in rows
+        ]
+
+    def lookup_puuid(self, cache_key):
+        """The last recorded PUUID for a normalized (account_region, username, tag), or None."""
+        row = self._read_one("SELECT puuid FROM riot_ids WHERE account_region = ? AND username = ? AND tag = ?", tuple(cache_key))
+        return row[0] if row else None
+
+    def latest_rank(self, valorant_region, puuid):
+        """The last recorded rank_data for a player as (rank_data, age), or None; any age, unlike recent_ranks()."""
+        row = self._read_one("SELECT data, fetched_at FROM rank_latest WHERE valorant_region = ? AND puuid = ?", (valorant_region, puuid))
+        return (json.loads(row[0]), time.time() - row[1]) if row else None
+
+    def match_tally(self, valorant_region, puuid):
+        """The persisted win/loss tally for a player, or None."""
+        row = self._read_one(
+            "SELECT act_id, wins, losses, last_match_id, last_match_start, backfill_before FROM match_tally "
+            "WHERE valorant_region = ? AND puuid = ?", (valorant_region, puuid)
+        )
+        if not row:
+            return None
+        tally = dict(zip(TALLY_FIELDS, row))
+        tally["complete"] = tally["last_match_id"] is not None and tally["backfill_before"] == 0 # See match_history.empty_tally()
+        return tally
+
+    def _read_one(self, sql, params):
+        if not self.path:
+            return None
+        try:
+            return self._reader().execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            log.warning("snapshot.read_failed", "Could not read snapshot", error=str(e))
+            return None
+
+    def recent_puuids(self, max_age, limit):
+        """Riot IDs resolved within `max_age` seconds, oldest first: [(cache_key, puuid, age)]."""
+        now = time.time()
+        rows = self._read_recent(
+            "SELECT account_region, username, tag, puuid, resolved_at FROM riot_ids "
+            "WHERE resolved_at > ? ORDER BY resolved_at DESC LIMIT ?", (now - max_age, limit)
+        )
+        return [((region, username, tag), puuid, now - resolved_at) for region, username, tag, puuid, resolved_at in reversed(rows)]
+
+    def popular_riot_ids(self, limit):
+        """Resolved Riot IDs, most looked-up first: [(riot_id, lookups)], spelled as Riot does when known.
+
+        Includes IDs only ever looked up (e.g. answered from the leaderboard index, with no riot_ids row).
+        """
+        return self._read_recent(
+            "SELECT riot_id, lookups FROM ("
+            "SELECT COALESCE(l.riot_id, r.username || '#' || r.tag) AS riot_id, COALESCE(l.lookups, 0) AS lookups, "
+            "r.resolved_at AS seen FROM riot_ids AS r LEFT JOIN riot_id_lookups AS l USING (account_region, username, tag) "
+            "UNION ALL SELECT COALESCE(l.riot_id, l.username || '#' || l.tag), l.lookups, 0 FROM riot_id_lookups AS l "
+            "WHERE NOT EXISTS (SELECT 1 FROM riot_ids AS r WHERE r.account_region = l.account_region "
+            "AND r.username = l.username AND r.tag = l.tag)"
+            ") ORDER BY lookups DESC, seen DESC LIMIT ?", (limit,)
+        )
+
+    def recent_ranks(self, max_age, limit):
+        """Latest rank_data per player fetched within `max_age` seconds, oldest first: [(region, puuid, rank_data, age)]."""
+        now = time.time()
+        rows = self._read_recent(
+            "SELECT valorant_region, puuid, data, fetched_at FROM rank_latest "
+            "WHERE fetched_at > ? ORDER BY fetched_at DESC LIMIT ?", (now - max_age, limit)
+        )
+        return [(region, puuid, json.loads(data), now - fetched_at) for region, puuid, data, fetched_at in reversed(rows)]
+
+    def _read_recent(self, sql, params):
+        # Short-lived connection: this runs at import, possibly in a gunicorn master that forks afterwards
+        if not self.path:
+            return []
+        try:
+            with closing(self._connect()) as conn:
+                return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            log.warning("snapshot.read_failed", "Could not read snapshots", path=self.path, error=str(e))
+            return []
+
+    # --- Connections ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; losing the last commits on power loss is fine here
+        return conn
+
+    def _reader(self):
+        # SQLite connections must not cross a fork, so the per-thread connection is tied to the pid
+        conn_pid = getattr(self._local, "conn_pid", None)
+        if conn_pid is None or conn_pid[1] != os.getpid():
+            self._local.conn_pid = conn_pid = (self._connect(), os.getpid())
+        return conn_pid[0]
@@ -0,0 +1,194 @@
+# Filename: structured_log.py
+# --- Non-blocking structured logging ---
+# Request threads only put LogRecords on an in-memory queue; a background QueueListener
+# thread formats them (JSON lines by default) and writes them to stdout. If the queue is
+# full, records are dropped and counted rather than blocking the request. Verbose events
+# (raw upstream payloads, per-call traces, cache hits) are sampled per event name, and
+# long field values are truncated when formatted.
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+# --- Configuration ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()  # "json" (one object per line) or "text"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # Records buffered before new ones are dropped
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", 512))  # Longer field values are truncated
+# Fraction of records kept per event name, e.g. "riot.payload=0.01,riot.request=0.1"; unlisted events are always kept
+LOG_SAMPLE_RATES = os.environ.get(
+    "LOG_SAMPLE_RATES",
+    "riot.request=0.1,riot.payload=0.01,rank.parsed=0.05,lookup.start=0.1,cache.hit=0.02",
+)
+
+
+def parse_sample_rates(spec):
+    """Parses "event=rate,..." into {event: rate} with rates clamped to [0, 1]; ignores malformed entries."""
+    rates = {}
+    for part in (spec or "").split(","):
+        event, _, rate = part.strip().partition("=")
+        try:
+            rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def truncate(value, limit=LOG_MAX_FIELD_CHARS):
+    """Renders a field value for a log line: scalars as-is, everything else as (truncated) text."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if not isinstance(value, str):
+        try:
+            value = json.dumps(value, default=str, separators=(",", ":"))
+        except (TypeError, ValueError):
+            value = repr(value)
+    if len(value) > limit:
+        return f"{value[:limit]}...(+{len(value) - limit} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        for name, value in (getattr(record, "fields", None) or {}).items():
+            text = truncate(value)
+            # Small dicts/lists stay nested JSON; only oversized ones become truncated text
+            entry[name] = value if isinstance(value, (dict, list)) and not text.endswith(" chars)") else text
+        if getattr(record, "sample_rate", 1.0) < 1.0:
+            entry["sample_rate"] = record.sample_rate # Multiply counts by 1/sample_rate when aggregating
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), LOG_MAX_FIELD_CHARS * 8)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{name}={truncate(value)}" for name, value in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full and runs one listener per process.
+
+    Records are queued unformatted; formatting happens on the listener thread.
+    The queue and listener are recreated after a fork, since threads do not
+    survive it (e.g. gunicorn --preload).
+    """
+
+    def __init__(self, target, queue_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        return record # Same process: no need to pre-format or pickle-proof the record
+
+    def enqueue(self, record):
+        if self._listener_pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 # Never block the caller on log I/O
+
+    def _start_listener(self):
+        with self._start_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size) # The parent's queue may hold locks taken by its listener
+            self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+            atexit.register(self._stop_listener, self._listener)
+
+    def _stop_listener(self, listener):
+        if self._listener is listener and self._listener_pid == os.getpid():
+            listener.stop() # Drains what is queued
+        if self.dropped:
+            sys.stderr.write(f"structured_log: dropped {self.dropped} log records (queue full)\n")
+
+
+_configure_lock = threading.Lock()
+_root = None
+
+
+def _configure():
+    global _root
+    with _configure_lock:
+        if _root is not None:
+            return _root
+        target = logging.StreamHandler(sys.stdout)
+        target.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        root = logging.getLogger("ecaly")
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.addHandler(NonBlockingQueueHandler(target))
+        root.propagate = False
+        _root = root
+        return root
+
+
+class EventLogger:
+    """Logger for named events with structured fields: log.info("lookup.start", "Looking up player", riot_id=...).
+
+    Events listed in LOG_SAMPLE_RATES are sampled before any record is built,
+    so skipped records cost one random() call.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def debug(self, event, message="", **fields):
+        self._log(logging.DEBUG, event, message, fields)
+
+    def info(self, event, message="", **fields):
+        self._log(logging.INFO, event, message, fields)
+
+    def warning(self, event, message="", **fields):
+        self._log(logging.WARNING, event, message, fields)
+
+    def error(self, event, message="", **fields):
+        self._log(logging.ERROR, event, message, fields)
+
+    def exception(self, event, message, exc, **fields):
+        """Error with the traceback of `exc` attached."""
+        self._log(logging.ERROR, event, message, fields, exc_info=(type(exc), exc, exc.__traceback__))
+
+    def _log(self, level, event, message, fields, exc_info=None):
+        rate = SAMPLE_RATES.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        self.logger.log(level, message or event, exc_info=exc_info,
+                        extra={"event": event, "fields": fields, "sample_rate": rate})
+
+
+def get_logger(name):
+    """Returns an EventLogger for `name` under the queue-backed "ecaly" logger."""
+    _configure()
+    return EventLogger(logging.getLogger(f"ecaly.{name}"))
@@ -0,0 +1,5 @@
+# Tests import the top-level modules directly (the app is a flat set of modules, not a package)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+# Filename: tests/test_cache.py
+# --- In-process TTLCache (Riot ID -> PUUID) and StaleWhileRevalidateCache (rank data) ---
+import threading
+import time
+
+from cache import TTLCache, StaleWhileRevalidateCache, MISSING, FRESH, STALE, MISS
+
+
+def test_ttl_cache_round_trip_and_negative_entries():
+    cache = TTLCache(10, 60)
+    assert cache.get(("americas", "alice", "na1")) is MISSING
+    cache.set(("americas", "alice", "na1"), "puuid-a")
+    cache.set(("americas", "typo", "na1"), None) # A cached 404
+    assert cache.get(("americas", "alice", "na1")) == "puuid-a"
+    assert cache.get(("americas", "typo", "na1")) is None
+    assert cache.get("other", default="fallback") == "fallback"
+
+
+def test_ttl_cache_entries_expire():
+    cache = TTLCache(10, 60)
+    cache.set("short", 1, ttl=0.02) # Per-entry TTL, e.g. PUUID_NEGATIVE_TTL
+    cache.set("long", 2)
+    time.sleep(0.03)
+    assert cache.get("short") is MISSING
+    assert cache.get("long") == 2
+    assert len(cache) == 1 # Expired entries are dropped when read
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a") # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    cache.delete("a")
+    assert cache.get("a") is MISSING
+
+
+def test_stale_while_revalidate_states():
+    cache = StaleWhileRevalidateCache(10, fresh_ttl=60, stale_ttl=60)
+    assert cache.get("k") == (MISSING, MISS)
+    cache.set("k", {"tier": "Gold 1"})
+    assert cache.get("k") == ({"tier": "Gold 1"}, FRESH)
+    cache.set("k", {"tier": "Gold 1"}, age=90) # e.g. restored from the snapshot store
+    assert cache.get("k") == ({"tier": "Gold 1"}, STALE)
+    assert 89 < cache.age("k") < 91
+    cache.set("k", {"tier": "Gold 1"}, age=121)
+    assert cache.get("k") == (MISSING, MISS)
+    assert cache.age("k") is None
+
+
+def test_stale_while_revalidate_evicts_least_recently_used():
+    cache = StaleWhileRevalidateCache(2, fresh_ttl=60, stale_ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") == (MISSING, MISS)
+    assert len(cache) == 2
+
+
+def test_only_one_background_refresh_per_key():
+    cache = StaleWhileRevalidateCache(10, fresh_ttl=60, stale_ttl=60)
+    claims = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        claims.append(cache.try_begin_refresh("k"))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert claims.count(True) == 1
+    assert cache.try_begin_refresh("other")
+    cache.end_refresh("k")
+    assert cache.try_begin_refresh("k")
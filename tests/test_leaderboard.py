@@ -0,0 +1,114 @@
+# Filename: tests/test_leaderboard.py
+# --- Leaderboards: paging a ranked leaderboard into the local index, index files, throttling ---
+import os
+import time
+
+import pytest
+
+import leaderboard
+from leaderboard import Leaderboards, LeaderboardIndex, parse_player
+from rate_limit import SharedRateLimiter, RateLimitExceeded
+
+
+class FakeResponse:
+    def __init__(self, payload=None, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def player(rank, name="Player", tag=None, tier=27):
+    return {"puuid": f"puuid-{rank}", "gameName": f"{name}{rank}", "tagLine": tag or "NA1", "leaderboardRank": rank,
+            "rankedRating": 900 - rank, "numberOfWins": 100 + rank, "competitiveTier": tier}
+
+
+class FakeClient:
+    def __init__(self, players, status_code=200):
+        self.players = players
+        self.status_code = status_code
+        self.pages = []
+
+    def get_leaderboard(self, region, act, size, start):
+        self.pages.append(start)
+        if self.status_code != 200:
+            return FakeResponse(status_code=self.status_code, headers={"Retry-After": "0"})
+        return FakeResponse({"players": self.players[start:start + size], "totalPlayers": len(self.players)})
+
+
+@pytest.fixture
+def make_boards(tmp_path):
+    def make(client, directory=str(tmp_path / "boards"), **kwargs):
+        os.makedirs(directory, exist_ok=True) # Normally created by run_once() before it ingests
+        boards = Leaderboards(client, regions=["na"], acts=["act-1"], page_size=2, directory=directory, **kwargs)
+        boards.budget = SharedRateLimiter(state_path=str(tmp_path / "lb-ratelimit.json"), app_limits="1000:1", max_wait=0)
+        boards._thread_pid = os.getpid() # No background thread: tests call ingest() / _load_files() themselves
+        return boards
+    return make
+
+
+def test_parse_player():
+    assert parse_player(player(3)) == ("puuid-3", "Player3#NA1", 3, 897, 103, 27)
+    assert parse_player({"leaderboardRank": 9})[:2] == ("", "") # Anonymous: not indexed
+
+
+def test_index_lookups():
+    index = LeaderboardIndex("na", "act-1")
+    index.add(*parse_player(player(1, name="TenZ", tag="0505")))
+    index.add(*parse_player({"leaderboardRank": 2, "rankedRating": 800})) # Anonymous
+    assert len(index) == 1
+    entry = index.by_riot_id("tenz1#0505")
+    assert (entry.puuid, entry.riot_id, entry.leaderboard_rank, entry.act) == ("puuid-1", "TenZ1#0505", 1, "act-1")
+    assert index.by_puuid("puuid-1") == entry
+    assert index.by_puuid("nobody") is None
+
+
+def test_ingest_pages_through_the_leaderboard(make_boards):
+    client = FakeClient([player(rank) for rank in range(1, 6)])
+    boards = make_boards(client)
+    boards.ingest("na", "act-1")
+    assert client.pages == [0, 2, 4]
+    entry = boards.lookup_riot_id(("na",), "player4", "na1")
+    assert (entry.puuid, entry.wins, entry.ranked_rating) == ("puuid-4", 104, 896)
+    assert boards.lookup_puuid("na", "puuid-5").leaderboard_rank == 5
+    assert boards.lookup_puuid("eu", "puuid-5") is None
+
+
+def test_other_workers_load_the_index_file(make_boards):
+    make_boards(FakeClient([player(rank) for rank in range(1, 4)])).ingest("na", "act-1")
+    other = make_boards(FakeClient([]))
+    assert other.lookup_puuid("na", "puuid-2") is None
+    other._load_files()
+    assert other.lookup_puuid("na", "puuid-2").riot_id == "Player2#NA1"
+
+
+def test_shard_without_a_leaderboard(make_boards):
+    boards = make_boards(FakeClient([], status_code=404))
+    boards.ingest("na", "act-1")
+    assert boards.lookup_puuid("na", "puuid-1") is None
+
+
+def test_throttled_pages_give_up_and_keep_the_previous_index(make_boards, monkeypatch):
+    monkeypatch.setattr(leaderboard, "LEADERBOARD_PAGE_RETRIES", 2)
+    client = FakeClient([player(1)])
+    boards = make_boards(client)
+    boards.ingest("na", "act-1")
+    client.status_code, client.pages = 429, []
+    with pytest.raises(RateLimitExceeded):
+        boards.ingest("na", "act-1")
+    assert len(client.pages) == 3 # The first attempt plus two retries
+    assert boards.lookup_puuid("na", "puuid-1") is not None
+    assert not [name for name in os.listdir(boards.directory) if name.endswith(".tmp")]
+
+
+def test_old_indexes_answer_no_lookups(make_boards):
+    boards = make_boards(FakeClient([player(1)]), max_age=60)
+    boards.ingest("na", "act-1")
+    boards._indexes[("na", "act-1")].updated_at = time.time() - 61
+    assert boards.lookup_puuid("na", "puuid-1") is None
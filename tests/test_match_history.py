@@ -0,0 +1,159 @@
+# Filename: tests/test_match_history.py
+# --- MatchTally: folding matches into a current-act tally, backfill and completeness ---
+import pytest
+
+from match_history import MatchTally, empty_tally, match_outcome
+from rate_limit import SharedRateLimiter
+
+PUUID = "p-1"
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeClient:
+    """A matchlist of (start, match id, act, outcome) rows; outcome is True/False/None (draw)."""
+
+    def __init__(self, matches=()):
+        self.matches = list(matches)
+        self.failing = set()  # Match ids whose fetch fails
+        self.fetched = []
+
+    def get_matchlist_by_puuid(self, region, puuid):
+        history = [{"matchId": match_id, "gameStartTimeMillis": started, "queueId": "competitive"}
+                   for started, match_id, _, _ in self.matches]
+        history.append({"matchId": "dm-1", "gameStartTimeMillis": 1, "queueId": "deathmatch"}) # Never counted
+        return FakeResponse({"history": history})
+
+    def get_match(self, region, match_id):
+        self.fetched.append(match_id)
+        if match_id in self.failing:
+            raise RuntimeError("upstream timeout")
+        _, _, act, won = next(row for row in self.matches if row[1] == match_id)
+        return FakeResponse(match_dto(act, won))
+
+
+class FakeStore:
+    def __init__(self):
+        self.recorded = []
+
+    def match_tally(self, valorant_region, puuid):
+        return None
+
+    def record_match_tally(self, valorant_region, puuid, tally):
+        self.recorded.append(dict(tally))
+
+
+def match_dto(act, won):
+    teams = [{"teamId": "Red", "won": bool(won)}, {"teamId": "Blue", "won": won is False}]
+    return {"matchInfo": {"seasonId": act}, "players": [{"puuid": PUUID, "teamId": "Red"}], "teams": teams}
+
+
+def history(act, outcomes, first_start=1000):
+    return [(first_start + i, f"{act}-{i}", act, won) for i, won in enumerate(outcomes)]
+
+
+@pytest.fixture
+def make_tally(tmp_path):
+    def make(client, fetch_limit=20, active_act=None):
+        tally = MatchTally(client, FakeStore(), fetch_limit=fetch_limit, concurrency=2, cache_ttl=60, enabled=True,
+                           rate_share=1.0, active_act=active_act)
+        tally.budget = SharedRateLimiter(state_path=str(tmp_path / "match-ratelimit.json"), app_limits="1000:1", max_wait=0)
+        return tally
+    return make
+
+
+def test_match_outcome():
+    assert match_outcome(match_dto("a1", True), PUUID) == ("a1", True)
+    assert match_outcome(match_dto("a1", False), PUUID) == ("a1", False)
+    assert match_outcome(match_dto("a1", None), PUUID) == ("a1", None) # Draw
+    assert match_outcome(match_dto("a1", True), "someone-else") == ("a1", None)
+
+
+def test_fold_counts_newest_first_backfill():
+    tally = empty_tally()
+    assert MatchTally._fold(tally, PUUID, 300, "m3", match_dto("a1", True))
+    assert MatchTally._fold(tally, PUUID, 200, "m2", match_dto("a1", False))
+    assert MatchTally._fold(tally, PUUID, 100, "m1", match_dto("a1", None))
+    assert (tally["wins"], tally["losses"]) == (1, 1)
+    assert (tally["last_match_id"], tally["backfill_before"]) == ("m3", 100)
+    assert not tally["complete"]
+    assert not MatchTally._fold(tally, PUUID, 50, "m0", match_dto("a0", True)) # Previous act: backfill is done
+    assert (tally["wins"], tally["backfill_before"], tally["complete"]) == (1, 0, True)
+
+
+def test_fold_new_act_restarts_the_tally():
+    tally = dict(empty_tally(), act="a1", wins=5, losses=4, last_match_id="m3", last_match_start=300, complete=True)
+    assert MatchTally._fold(tally, PUUID, 400, "m4", match_dto("a2", False))
+    assert tally == dict(empty_tally(), act="a2", losses=1, last_match_id="m4", last_match_start=400, complete=True)
+
+
+def test_tally_is_partial_until_backfill_completes(make_tally):
+    client = FakeClient(history("a1", [True, False, True, True, False, True])) # 4-2, all in the current act
+    match_tally = make_tally(client, fetch_limit=4)
+    tally = match_tally.refresh("na", PUUID)
+    assert tally["wins"] + tally["losses"] == 4 # The newest four only
+    assert not tally["complete"] and not match_tally.is_current(tally)
+
+    tally = match_tally.refresh("na", PUUID)
+    assert (tally["wins"], tally["losses"]) == (4, 2)
+    assert tally["complete"] and tally["backfill_before"] == 0 # Nothing older in the matchlist
+    assert match_tally.is_current(tally)
+    assert len(client.fetched) == 6 # Each match fetched once
+
+    assert match_tally.refresh("na", PUUID) == tally
+    assert len(client.fetched) == 6 # Complete: no more backfill
+
+
+def test_backfill_stops_at_the_previous_act(make_tally):
+    client = FakeClient(history("a0", [True, True, True], first_start=100) + history("a1", [False, True], first_start=1000))
+    match_tally = make_tally(client)
+    tally = match_tally.refresh("na", PUUID)
+    assert (tally["act"], tally["wins"], tally["losses"], tally["complete"]) == ("a1", 1, 1, True)
+    assert client.fetched[:3] == ["a1-1", "a1-0", "a0-2"]
+    assert "a0-0" not in client.fetched # Stopped with the fetch round that reached the previous act
+
+
+def test_new_matches_extend_a_complete_tally(make_tally):
+    client = FakeClient(history("a1", [True, False]))
+    match_tally = make_tally(client)
+    match_tally.refresh("na", PUUID)
+    client.matches.append((2000, "a1-new", "a1", True))
+    tally = match_tally.refresh("na", PUUID)
+    assert (tally["wins"], tally["losses"], tally["complete"]) == (2, 1, True)
+    assert client.fetched[-1] == "a1-new" and len(client.fetched) == 3
+    assert match_tally.store.recorded[-1] == tally # Persisted when it changed
+
+
+def test_failed_fetch_keeps_the_tally_partial(make_tally):
+    client = FakeClient(history("a1", [True, True, False]))
+    client.failing.add("a1-0") # The oldest match
+    match_tally = make_tally(client)
+    tally = match_tally.refresh("na", PUUID)
+    assert (tally["wins"], tally["losses"], tally["complete"]) == (1, 1, False)
+
+    client.failing.clear()
+    tally = match_tally.refresh("na", PUUID)
+    assert (tally["wins"], tally["losses"], tally["complete"]) == (2, 1, True)
+
+
+def test_is_current_checks_the_act(make_tally):
+    active = {"act": None}
+    match_tally = make_tally(FakeClient(), active_act=lambda: active["act"])
+    complete = dict(empty_tally(), act="a1", wins=3, last_match_id="m", last_match_start=1, complete=True)
+    assert match_tally.is_current(complete) # Active act unknown yet: assumed current
+    active["act"] = "a2"
+    assert not match_tally.is_current(complete) # No games yet this act: last act's record isn't shown
+    assert match_tally.is_current(complete, act="a1") # e.g. a leaderboard entry for that act
+    assert not match_tally.is_current(dict(complete, complete=False), act="a1")
+    assert not match_tally.is_current(None)
@@ -0,0 +1,105 @@
+# Filename: tests/test_popularity.py
+# --- Space-saving heavy-hitter sketch and the background pre-warmer ---
+import pytest
+
+from popularity import SpaceSaving, Prewarmer, scale_rate_limits
+from rate_limit import SharedRateLimiter
+
+
+def test_top_is_most_frequent_first():
+    sketch = SpaceSaving(10)
+    for key, hits in (("a", 1), ("b", 5), ("c", 3)):
+        for _ in range(hits):
+            sketch.offer(key)
+    assert sketch.top(2) == [("b", 5), ("c", 3)]
+    assert len(sketch) == 3
+
+
+def test_new_key_evicts_the_minimum_and_inherits_its_count():
+    sketch = SpaceSaving(2)
+    sketch.offer("a", weight=4)
+    sketch.offer("b", weight=2)
+    sketch.offer("a") # Leaves a stale lower bound for "a" in the heap
+    sketch.offer("c")
+    assert dict(sketch.top(2)) == {"a": 5, "c": 3} # "b" (2) went; "c" over-estimates by at most 2
+
+
+def test_eviction_re_files_stale_heap_entries():
+    sketch = SpaceSaving(2)
+    sketch.offer("a")
+    sketch.offer("b", weight=3)
+    sketch.offer("a", weight=5) # Heap still says "a" has 1
+    sketch.offer("c")
+    assert dict(sketch.top(2)) == {"a": 6, "c": 4}
+
+
+def test_decay_halves_counts_and_drops_zeroes():
+    sketch = SpaceSaving(10)
+    sketch.offer("hot", weight=9)
+    sketch.offer("cold")
+    sketch.decay()
+    assert sketch.top(10) == [("hot", 4)]
+    sketch.offer("new") # Still usable after the heap is rebuilt
+    assert dict(sketch.top(10)) == {"hot": 4, "new": 1}
+
+
+def test_scale_rate_limits():
+    assert scale_rate_limits("20:1,100:120", 0.2) == "4:1,20:120"
+    assert scale_rate_limits("20:1,100:120", 0.01) == "1:1,1:120" # At least 1 per window
+    assert scale_rate_limits("bad, 10:10", 0.5) == "5:10"
+
+
+def prewarmer(tmp_path, app_limits="100:10", stale=(), calls_per_refresh=1, **kwargs):
+    refreshed, stale = [], set(stale)
+
+    def refresh(key):
+        refreshed.append(key)
+        stale.discard(key)
+
+    warmer = Prewarmer(lambda key: key in stale, refresh, calls_per_refresh, enabled=True, **kwargs)
+    warmer.budget = SharedRateLimiter(state_path=str(tmp_path / "prewarm.json"), app_limits=app_limits, max_wait=0)
+    return warmer, refreshed
+
+
+def offer(warmer, key, hits):
+    for _ in range(hits):
+        warmer.tracker.offer(key)
+
+
+def test_run_once_refreshes_popular_keys_that_need_it(tmp_path):
+    hot, warm, rare = ("ap", "hot"), ("ap", "warm"), ("ap", "rare")
+    warmer, refreshed = prewarmer(tmp_path, stale={hot, rare}, min_hits=3)
+    offer(warmer, hot, 5)
+    offer(warmer, warm, 4) # Popular but still fresh
+    offer(warmer, rare, 2) # Stale but below min_hits
+    assert warmer.run_once() == 1
+    assert refreshed == [hot]
+
+
+def test_run_once_stops_when_the_budget_is_used_up(tmp_path):
+    keys = [("ap", f"p{n}") for n in range(4)]
+    warmer, refreshed = prewarmer(tmp_path, app_limits="2:60", stale=set(keys), min_hits=1)
+    for hits, key in enumerate(keys):
+        offer(warmer, key, 10 - hits)
+    assert warmer.run_once() == 2
+    assert refreshed == keys[:2] # Most popular first
+    assert warmer.run_once() == 0 # The rest wait for the bucket to refill
+
+
+def test_a_refresh_takes_all_of_its_tokens_or_none(tmp_path):
+    first, second = ("ap", "first"), ("ap", "second")
+    warmer, refreshed = prewarmer(tmp_path, app_limits="3:60", stale={first, second}, calls_per_refresh=2, min_hits=1)
+    offer(warmer, first, 5)
+    offer(warmer, second, 4)
+    assert warmer.run_once() == 1
+    assert refreshed == [first]
+    warmer.calls_per_refresh = 1 # The token left over was not spent on the skipped key
+    assert warmer.run_once() == 1
+    assert refreshed == [first, second]
+
+
+@pytest.mark.parametrize("rate_share", [0, 0.0])
+def test_disabled_without_a_rate_share(rate_share):
+    warmer = Prewarmer(lambda key: True, lambda key: None, 1, enabled=True, rate_share=rate_share)
+    warmer.record(("ap", "p"))
+    assert warmer.enabled is False and len(warmer.tracker) == 0
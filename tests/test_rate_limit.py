@@ -0,0 +1,127 @@
+# Filename: tests/test_rate_limit.py
+# --- SharedRateLimiter: host-wide token buckets in a flock()ed state file ---
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from rate_limit import SharedRateLimiter, RateLimitExceeded, parse_rate_limit_header
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def limiter(tmp_path, app_limits="5:1,100:120", max_wait=0):
+    return SharedRateLimiter(state_path=str(tmp_path / "ratelimit.json"), app_limits=app_limits, max_wait=max_wait)
+
+
+def tokens(tmp_path, key):
+    with open(tmp_path / "ratelimit.json") as f:
+        return json.load(f)[key]["tokens"]
+
+
+def _child_take(state_path, count, result):
+    child = SharedRateLimiter(state_path=state_path, app_limits="5:1,100:120", max_wait=0)
+    taken = 0
+    for _ in range(count):
+        try:
+            child.acquire("na", "ranked")
+            taken += 1
+        except RateLimitExceeded:
+            break
+    result.put(taken)
+
+
+def test_parse_rate_limit_header():
+    assert parse_rate_limit_header("20:1,100:120") == [[20, 1.0], [100, 120.0]]
+    assert parse_rate_limit_header("bogus, 10:10, 0:5") == [[10, 10.0]]
+    assert parse_rate_limit_header(None) == []
+
+
+def test_acquire_fails_fast_once_the_bucket_is_empty(tmp_path):
+    rl = limiter(tmp_path)
+    for _ in range(5):
+        rl.acquire("na", "ranked")
+    with pytest.raises(RateLimitExceeded) as e:
+        rl.acquire("na", "ranked")
+    assert 0 < e.value.retry_after <= 0.2 + 1e-6 # One token refills in 1s / 5
+    rl.acquire("eu", "ranked") # Buckets are per region
+
+
+def test_acquire_waits_for_a_refill_within_max_wait(tmp_path):
+    rl = limiter(tmp_path, app_limits="2:1", max_wait=1.0)
+    rl.acquire("na", "mmr")
+    rl.acquire("na", "mmr")
+    started = time.monotonic()
+    rl.acquire("na", "mmr")
+    assert 0.3 <= time.monotonic() - started < 1.0
+
+
+def test_buckets_are_shared_between_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    rl = limiter(tmp_path)
+    rl.acquire("na", "ranked")
+    rl.acquire("na", "ranked")
+    result = ctx.Queue()
+    child = ctx.Process(target=_child_take, args=(str(tmp_path / "ratelimit.json"), 10, result))
+    child.start()
+    child.join(10)
+    assert result.get(timeout=1) == 3 # The child only got what the parent left
+    with pytest.raises(RateLimitExceeded):
+        rl.acquire("na", "ranked")
+
+
+def test_multi_token_acquire_is_all_or_nothing(tmp_path):
+    rl = limiter(tmp_path, app_limits="4:1,20:120")
+    rl.acquire("na", "prewarm", tokens=3)
+    with pytest.raises(RateLimitExceeded):
+        rl.acquire("na", "prewarm", tokens=3)
+    assert tokens(tmp_path, "na:app")[0] == pytest.approx(1, abs=0.05) # Nothing taken by the failed call
+
+
+def test_multi_token_acquire_larger_than_a_window_goes_into_debt(tmp_path):
+    rl = limiter(tmp_path, app_limits="2:1")
+    rl.acquire("na", "prewarm", tokens=3)
+    assert tokens(tmp_path, "na:app")[0] == pytest.approx(-1, abs=0.05)
+    with pytest.raises(RateLimitExceeded):
+        rl.acquire("na", "prewarm")
+
+
+def test_response_headers_update_limits_and_counts(tmp_path):
+    rl = limiter(tmp_path)
+    rl.acquire("na", "ranked")
+    rl.update_from_response("na", "ranked", FakeResponse(headers={
+        "X-App-Rate-Limit": "3:1", "X-App-Rate-Limit-Count": "2:1",
+        "X-Method-Rate-Limit": "10:10", "X-Method-Rate-Limit-Count": "10:10",
+    }))
+    assert tokens(tmp_path, "na:app") == [pytest.approx(1, abs=0.05)]
+    with pytest.raises(RateLimitExceeded): # The method bucket is spent according to Riot
+        rl.acquire("na", "ranked")
+    rl.acquire("na", "mmr")
+
+
+def test_application_429_blocks_every_method_in_the_region(tmp_path):
+    rl = limiter(tmp_path)
+    rl.update_from_response("na", "ranked", FakeResponse(429, {"Retry-After": "5", "X-Rate-Limit-Type": "application"}))
+    with pytest.raises(RateLimitExceeded) as e:
+        rl.acquire("na", "mmr")
+    assert e.value.retry_after > 4
+    rl.acquire("eu", "mmr")
+
+
+def test_method_429_blocks_only_that_method(tmp_path):
+    rl = limiter(tmp_path)
+    rl.update_from_response("na", "ranked", FakeResponse(429, {"Retry-After": "5", "X-Rate-Limit-Type": "method"}))
+    with pytest.raises(RateLimitExceeded):
+        rl.acquire("na", "ranked")
+    rl.acquire("na", "mmr")
+
+
+def test_corrupt_state_file_starts_over(tmp_path):
+    (tmp_path / "ratelimit.json").write_bytes(b"{not json")
+    limiter(tmp_path).acquire("na", "ranked")
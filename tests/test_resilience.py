@@ -0,0 +1,198 @@
+# Filename: tests/test_resilience.py
+# --- Circuit breaker, latency tracker and hedged GETs (resilience.py, RiotClient) ---
+import threading
+import time
+
+import pytest
+import requests
+
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, CLOSED, OPEN, HALF_OPEN
+from riot_client import RiotClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+
+
+def breaker(**kwargs):
+    options = dict(window=30, min_calls=4, failure_ratio=0.5, open_seconds=0.05, trial_calls=2)
+    options.update(kwargs)
+    return CircuitBreaker("na", **options)
+
+
+def trip(b, calls=4):
+    for _ in range(calls):
+        b.record(True, b.allow())
+
+
+def test_breaker_opens_once_enough_calls_fail():
+    b = breaker()
+    for failed in (False, True, False):
+        b.record(failed, b.allow())
+    assert b.state == CLOSED # Below min_calls
+    b.record(True, b.allow())
+    assert b.state == OPEN # 2 of 4 failed
+    with pytest.raises(CircuitOpenError) as e:
+        b.allow()
+    assert 0 < e.value.retry_after <= 0.05
+
+
+def test_breaker_ignores_calls_that_were_never_sent():
+    b = breaker()
+    for _ in range(10):
+        b.record(None, b.allow()) # e.g. refused by the rate limiter
+    assert b.state == CLOSED
+
+
+def test_half_open_closes_after_successful_trials():
+    changes = []
+    b = breaker(on_state_change=lambda host, old, new: changes.append((old, new)))
+    trip(b)
+    time.sleep(0.06)
+    first = b.allow()
+    assert b.state == HALF_OPEN
+    second = b.allow()
+    with pytest.raises(CircuitOpenError):
+        b.allow() # Only trial_calls probes at a time
+    b.record(False, first)
+    b.record(False, second)
+    assert b.state == CLOSED
+    assert changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_failed_trial_reopens():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    b.record(True, b.allow())
+    assert b.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        b.allow()
+
+
+def test_calls_admitted_before_a_state_change_are_ignored():
+    b = breaker()
+    slow = b.allow() # Admitted while CLOSED, still in flight when the breaker opens
+    trip(b)
+    time.sleep(0.06)
+    trial = b.allow()
+    assert b.state == HALF_OPEN
+    b.record(False, slow) # Must not use up a trial slot or count as a trial success
+    b.allow() # The second trial slot is still free
+    with pytest.raises(CircuitOpenError):
+        b.allow()
+    b.record(False, trial)
+    assert b.state == HALF_OPEN # One real trial success of two
+    b.record(True, slow) # Nor reopen the circuit
+    assert b.state == HALF_OPEN
+
+
+def test_latency_tracker_quantile():
+    tracker = LatencyTracker(quantile=0.9, min_samples=10)
+    for i in range(9):
+        tracker.observe("k", i / 100)
+    assert tracker.threshold("k") is None # Not enough samples yet
+    tracker.observe("k", 0.09)
+    assert tracker.threshold("k") == pytest.approx(0.09)
+    assert tracker.threshold("other") is None
+
+
+# --- RiotClient integration (no network: the session's get() is replaced) ---
+
+def client(get, **kwargs):
+    c = RiotClient("RGAPI-test", base_url="http://riot.invalid/{region}", caller_threads=2, **kwargs)
+    c.session.get = get
+    return c
+
+
+def test_client_short_circuits_a_failing_host():
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        return FakeResponse(503)
+
+    c = client(get, breaker_enabled=True, hedge_enabled=False)
+    for _ in range(10): # RIOT_BREAKER_MIN_CALLS failures open it
+        assert c.get("na", "/val/ranked", "ranked").status_code == 503
+    with pytest.raises(CircuitOpenError):
+        c.get("na", "/val/ranked", "ranked")
+    assert len(calls) == 10 # Failed fast without sending
+    assert c.get("eu", "/val/ranked", "ranked").status_code == 503 # Per host
+
+
+def test_client_counts_network_errors_as_failures():
+    def get(url, **kwargs):
+        raise requests.exceptions.ConnectionError("refused")
+
+    c = client(get, breaker_enabled=True, hedge_enabled=False)
+    for _ in range(10):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            c.get("na", "/val/mmr", "mmr")
+    assert c.breaker("na").state == OPEN
+
+
+def slow_then_fast(first_delay):
+    """A get() whose first call takes `first_delay` seconds and later calls answer at once."""
+    calls = []
+    lock = threading.Lock()
+
+    def get(url, **kwargs):
+        with lock:
+            calls.append(time.monotonic())
+            first = len(calls) == 1
+        if first:
+            time.sleep(first_delay)
+            return FakeResponse(200)
+        return FakeResponse(204)
+
+    return get, calls
+
+
+def warm(c, method, region, seconds=0.01, samples=30):
+    for _ in range(samples):
+        c.latencies.observe((method, region), seconds)
+
+
+def test_slow_get_is_hedged_and_the_first_answer_wins():
+    get, calls = slow_then_fast(1.0)
+    c = client(get, breaker_enabled=False, hedge_enabled=True)
+    warm(c, "mmr", "na")
+    started = time.monotonic()
+    response = c.get("na", "/val/mmr", "mmr")
+    assert time.monotonic() - started < 0.5
+    assert response.status_code == 204 # The duplicate answered first
+    assert len(calls) == 2
+
+
+def test_no_hedge_without_latency_samples():
+    get, calls = slow_then_fast(0.2)
+    c = client(get, breaker_enabled=False, hedge_enabled=True)
+    assert c.get("na", "/val/mmr", "mmr").status_code == 200
+    assert len(calls) == 1
+
+
+def test_fast_get_is_not_hedged():
+    get, calls = slow_then_fast(0.0)
+    c = client(get, breaker_enabled=False, hedge_enabled=True)
+    warm(c, "mmr", "na", seconds=0.5)
+    assert c.get("na", "/val/mmr", "mmr").status_code == 200
+    assert len(calls) == 1
+
+
+def test_hedge_falls_back_to_the_original_when_the_duplicate_fails():
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return FakeResponse(200)
+        raise requests.exceptions.ConnectionError("reset")
+
+    c = client(get, breaker_enabled=False, hedge_enabled=True)
+    warm(c, "mmr", "na")
+    assert c.get("na", "/val/mmr", "mmr").status_code == 200
+    assert len(calls) == 2
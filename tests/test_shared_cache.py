@@ -0,0 +1,164 @@
+# Filename: tests/test_shared_cache.py
+# --- SharedHashTable / shared cache behaviour: fork sharing, expiry, eviction, lock timeouts, rank codec ---
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+import shared_cache
+from cache import MISSING, FRESH, STALE, MISS
+from shared_cache import SharedHashTable, SharedTTLCache, SharedStaleWhileRevalidateCache, PROBE_LIMIT
+
+fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="shared caches need fork()")
+
+
+def _child_set(cache, key, value):
+    cache.set(key, value)
+
+
+def _child_check(cache, key, expected, result):
+    result.put(cache.get(key) == expected)
+
+
+def _child_hold_lock(table, segment, held):
+    table._locks[segment].acquire()
+    held.set()
+    time.sleep(60)
+
+
+@fork
+def test_round_trip_across_fork():
+    ctx = multiprocessing.get_context("fork")
+    cache = SharedTTLCache("t", 100, 60, slot_size=160)
+    cache.set(("americas", "alice", "na1"), "puuid-a") # Written before the fork: the child sees it
+
+    result = ctx.Queue()
+    child = ctx.Process(target=_child_check, args=(cache, ("americas", "alice", "na1"), "puuid-a", result))
+    child.start()
+    child.join(10)
+    assert result.get(timeout=1) is True
+
+    child = ctx.Process(target=_child_set, args=(cache, ("americas", "bob", "euw"), "puuid-b"))
+    child.start()
+    child.join(10)
+    assert child.exitcode == 0
+    assert cache.get(("americas", "bob", "euw")) == "puuid-b" # Written by the child: the parent sees it
+
+
+@fork
+def test_expired_entries_are_misses():
+    cache = SharedTTLCache("t", 100, 60, slot_size=160)
+    cache.set("gone", "x", ttl=-1)
+    cache.set("kept", "y")
+    assert cache.get("gone") is MISSING
+    assert cache.get("kept") == "y"
+    assert len(cache) == 1
+
+    swr = SharedStaleWhileRevalidateCache("r", 100, fresh_ttl=10, stale_ttl=20, slot_size=256)
+    swr.set("fresh", {"tier": "Gold 1"})
+    swr.set("stale", {"tier": "Gold 2"}, age=15)
+    swr.set("expired", {"tier": "Gold 3"}, age=31)
+    assert swr.get("fresh") == ({"tier": "Gold 1"}, FRESH)
+    assert swr.get("stale") == ({"tier": "Gold 2"}, STALE)
+    assert swr.get("expired") == (MISSING, MISS)
+
+
+@fork
+def test_expired_slot_is_reused_before_evicting():
+    table = SharedHashTable("t", PROBE_LIMIT, slot_size=64, stripes=1)
+    now = time.monotonic()
+    keys = [f"k{i}".encode() for i in range(PROBE_LIMIT)]
+    for i, key in enumerate(keys):
+        expires = now - 1 if i == 5 else now + 60
+        assert table.put(key, b"v", now + i, expires)
+    assert table.put(b"new", b"v", now + 100, now + 160)
+    assert table.get(b"new", now) is not None
+    assert all(table.get(key, now) is not None for i, key in enumerate(keys) if i != 5)
+
+
+@fork
+def test_full_probe_window_evicts_the_oldest_entry():
+    table = SharedHashTable("t", PROBE_LIMIT, slot_size=64, stripes=1) # One segment, exactly one probe window
+    assert table.segment_slots == table.probe_limit == PROBE_LIMIT
+    now = time.monotonic()
+    keys = [f"k{i}".encode() for i in range(PROBE_LIMIT)]
+    for i, key in enumerate(keys):
+        assert table.put(key, b"v%d" % i, now - 100 + i, now + 60) # k0 stored longest ago
+    assert table.count(now) == PROBE_LIMIT
+
+    assert table.put(b"new", b"fresh", now, now + 60)
+    assert table.get(b"new", now)[2] == b"fresh"
+    assert table.get(keys[0], now) is None # Evicted
+    assert all(table.get(key, now) is not None for key in keys[1:])
+    assert table.count(now) == PROBE_LIMIT # Memory never grows
+
+
+@fork
+def test_oversized_entries_are_not_stored():
+    table = SharedHashTable("t", 32, slot_size=64, stripes=1)
+    assert not table.put(b"k", b"x" * table.max_payload, 0, time.monotonic() + 60)
+    assert table.get(b"k", time.monotonic()) is None
+
+
+@fork
+def test_lock_held_by_a_killed_worker_times_out_instead_of_hanging():
+    ctx = multiprocessing.get_context("fork")
+    table = SharedHashTable("t", 64, slot_size=64, stripes=4, lock_timeout=0.1)
+    now = time.monotonic()
+    key = b"stuck"
+    segment, _ = table._segment(shared_cache._key_hash(key))
+    other = next(f"k{i}".encode() for i in range(100) if table._segment(shared_cache._key_hash(f"k{i}".encode()))[0] != segment)
+    assert table.put(key, b"v", now, now + 60)
+
+    held = ctx.Event()
+    child = ctx.Process(target=_child_hold_lock, args=(table, segment, held))
+    child.start()
+    try:
+        assert held.wait(10)
+        os.kill(child.pid, signal.SIGKILL) # Dies holding the segment lock
+        child.join(10)
+
+        started = time.monotonic()
+        assert table.get(key, time.monotonic()) is None # Treated as a miss
+        assert not table.put(key, b"w", now, now + 60) # Write skipped
+        assert time.monotonic() - started < 1.0
+        # Other segments keep working
+        assert table.put(other, b"v", now, now + 60)
+        assert table.get(other, time.monotonic())[2] == b"v"
+    finally:
+        if child.is_alive():
+            child.kill()
+
+
+@fork
+def test_lock_timeout_recovers_once_the_lock_is_released():
+    table = SharedHashTable("t", 64, slot_size=64, stripes=1, lock_timeout=0.05)
+    now = time.monotonic()
+    table._locks[0].acquire()
+    try:
+        assert table.get(b"k", now) is None
+        assert not table.put(b"k", b"v", now, now + 60)
+    finally:
+        table._locks[0].release()
+    assert table.put(b"k", b"v", now, now + 60)
+    assert table.get(b"k", now)[2] == b"v"
+
+
+@pytest.mark.parametrize("rank_data", [
+    {"tier": "Immortal 1", "currenttier": 21, "lp": 55, "wins": 12, "losses": 9, "rank_icon_url": None, "fetched_at": 1700000000},
+    {"tier": "Unranked", "currenttier": 0, "lp": 0, "wins": 0, "losses": 0, "fetched_at": 1700000000},
+    {"tier": "Radiant", "currenttier": 27, "lp": 1197, "wins": 77, "losses": "--", "leaderboard_rank": 4,
+     "rank_icon_url": "https://example.invalid/icon.png", "fetched_at": 1700000000},
+    {"tier": "Gold 2", "lp": "--", "wins": "--", "losses": "--"},
+])
+def test_rank_codec_round_trip(rank_data):
+    encoded = shared_cache.encode_value(rank_data)
+    assert encoded[0] == shared_cache._RANK
+    assert shared_cache.decode_value(encoded) == rank_data
+
+
+@pytest.mark.parametrize("value", [None, "puuid-123", "na", {"any": ["json", 1]}])
+def test_value_codec_round_trip(value):
+    assert shared_cache.decode_value(shared_cache.encode_value(value)) == value
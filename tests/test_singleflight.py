@@ -0,0 +1,109 @@
+# Filename: tests/test_singleflight.py
+# --- SingleFlight: in-process coalescing and cross-worker sharing through flock()ed files ---
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="cross-worker coalescing needs fork()")
+
+
+def run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("t", shared_dir="")
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return "puuid-a"
+
+    assert run_concurrently(8, lambda: flight.do("k", fetch)) == ["puuid-a"] * 8
+    assert len(calls) == 1
+    assert flight.do("k", lambda: "again") == "again" # Nothing is cached once the call finished
+
+
+def test_waiters_get_the_leaders_error():
+    flight = SingleFlight("t", shared_dir="")
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("not found")
+
+    results = run_concurrently(4, lambda: flight.do("k", fail))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len({id(result) for result in results}) == 1 # The same exception object
+
+
+def test_keys_are_independent():
+    flight = SingleFlight("t", shared_dir="")
+    results = run_concurrently(4, lambda: flight.do(threading.get_ident(), threading.get_ident))
+    assert len(set(results)) == 4
+
+
+def _child_do(flight, key, value, counter):
+    def fetch():
+        with open(counter, "a") as f:
+            f.write("child\n")
+        time.sleep(0.3)
+        return value
+    flight.do(key, fetch)
+
+
+def _calls(counter):
+    with open(counter) as f:
+        return f.read().split()
+
+
+@fork
+def test_workers_reuse_a_result_another_worker_just_fetched(tmp_path):
+    flight = SingleFlight("t", shared_dir=str(tmp_path), share_ttl=5)
+    counter = tmp_path / "calls.txt"
+    counter.write_text("")
+    child = multiprocessing.get_context("fork").Process(target=_child_do, args=(flight, "k", {"tier": "Gold 1"}, counter))
+    child.start()
+    time.sleep(0.1) # The child holds the key's lock now
+    assert flight.do("k", lambda: pytest.fail("should reuse the other worker's result")) == {"tier": "Gold 1"}
+    child.join(10)
+    assert _calls(counter) == ["child"]
+
+
+@fork
+def test_old_or_unshareable_results_are_not_reused(tmp_path):
+    flight = SingleFlight("t", shared_dir=str(tmp_path), share_ttl=0.1)
+    counter = tmp_path / "calls.txt"
+    counter.write_text("")
+    ctx = multiprocessing.get_context("fork")
+    child = ctx.Process(target=_child_do, args=(flight, "old", "v", counter))
+    child.start()
+    child.join(10)
+    time.sleep(0.15)
+    assert flight.do("old", lambda: "fresh") == "fresh" # Older than share_ttl
+
+    child = ctx.Process(target=_child_do, args=(flight, "object", object(), counter)) # Not JSON
+    child.start()
+    time.sleep(0.1)
+    assert flight.do("object", lambda: "own call") == "own call"
+    child.join(10)
@@ -0,0 +1,105 @@
+# Filename: tests/test_snapshot_store.py
+# --- SnapshotStore: queued SQLite writes, compact rank history, tallies, forked writers ---
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from snapshot_store import SnapshotStore
+
+fork = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+
+
+def store(tmp_path, **kwargs):
+    return SnapshotStore(path=str(tmp_path / "snapshots.sqlite3"), flush_interval=0.01, **kwargs)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the snapshot writer"
+        time.sleep(0.01)
+
+
+def rank(tier, lp, wins="--", losses="--", fetched_at=None):
+    return {"tier": tier, "currenttier": 12, "lp": lp, "wins": wins, "losses": losses, "fetched_at": fetched_at or time.time()}
+
+
+def _child_record(snapshots):
+    snapshots.record_puuid(("europe", "bob", "euw"), "puuid-b")
+    time.sleep(0.5) # Let this process's own writer thread commit
+
+
+def test_puuids_round_trip(tmp_path):
+    snapshots = store(tmp_path)
+    snapshots.record_puuid(("americas", "alice", "na1"), "puuid-a")
+    wait_for(lambda: snapshots.lookup_puuid(("americas", "alice", "na1")) == "puuid-a")
+    [(cache_key, puuid, age)] = snapshots.recent_puuids(3600, 10)
+    assert (cache_key, puuid) == (("americas", "alice", "na1"), "puuid-a") and 0 <= age < 5
+    assert snapshots.recent_puuids(-1, 10) == [] # Older than max_age
+
+
+def test_rank_history_only_records_tier_or_rr_changes(tmp_path):
+    snapshots = store(tmp_path)
+    now = time.time()
+    snapshots.record_rank("na", "p", rank("Gold 1", 50, 3, 2, fetched_at=now - 30))
+    snapshots.record_rank("na", "p", rank("Gold 1", 50, 4, 2, fetched_at=now - 20)) # W/L only: same rank
+    snapshots.record_rank("na", "p", rank("Gold 1", 71, 5, 2, fetched_at=now - 10))
+    snapshots.record_rank("na", "p", rank("Gold 2", 3, 6, 2, fetched_at=now))
+    wait_for(lambda: len(snapshots.rank_history("p", 10)) == 3)
+    history = snapshots.rank_history("p", 10)
+    assert [(entry["tier"], entry["lp"]) for entry in history] == [("Gold 2", 3), ("Gold 1", 71), ("Gold 1", 50)]
+    assert snapshots.latest_rank("na", "p")[0]["tier"] == "Gold 2"
+    assert [entry[2]["tier"] for entry in snapshots.recent_ranks(3600, 10)] == ["Gold 2"]
+
+
+def test_rank_history_is_trimmed(tmp_path):
+    snapshots = store(tmp_path, history_keep=3)
+    now = time.time()
+    for i in range(5):
+        snapshots.record_rank("na", "p", rank("Gold 1", i, fetched_at=now - 10 + i))
+    wait_for(lambda: snapshots.latest_rank("na", "p") is not None and snapshots.latest_rank("na", "p")[0]["lp"] == 4)
+    assert [entry["lp"] for entry in snapshots.rank_history("p", 10)] == [4, 3, 2]
+
+
+def test_match_tally_round_trip(tmp_path):
+    snapshots = store(tmp_path)
+    partial = {"act": "a1", "wins": 3, "losses": 1, "last_match_id": "m9", "last_match_start": 900, "backfill_before": 600}
+    snapshots.record_match_tally("na", "partial", dict(partial, complete=False))
+    snapshots.record_match_tally("na", "done", dict(partial, backfill_before=0, complete=True))
+    wait_for(lambda: snapshots.match_tally("na", "done") is not None)
+    assert snapshots.match_tally("na", "partial") == dict(partial, complete=False)
+    assert snapshots.match_tally("na", "done") == dict(partial, backfill_before=0, complete=True)
+    assert snapshots.match_tally("eu", "done") is None
+
+
+def test_lookup_counts_are_added(tmp_path):
+    snapshots = store(tmp_path)
+    snapshots.record_puuid(("americas", "tenz", "0505"), "puuid-t")
+    snapshots.record_lookups({("americas", "tenz", "0505"): (2, "tenz#0505")})
+    snapshots.record_lookups({("americas", "tenz", "0505"): (1, "TenZ#0505"), ("eu", "ace", "1"): (5, "Ace#1")})
+    wait_for(lambda: len(snapshots.popular_riot_ids(10)) == 2)
+    assert snapshots.popular_riot_ids(10) == [("Ace#1", 5), ("TenZ#0505", 3)]
+
+
+def test_disabled_store_is_a_no_op():
+    snapshots = SnapshotStore(path="")
+    assert not snapshots.enabled
+    snapshots.record_puuid(("americas", "alice", "na1"), "puuid-a")
+    assert snapshots.lookup_puuid(("americas", "alice", "na1")) is None
+    assert snapshots.rank_history("p", 10) == [] and snapshots.recent_puuids(3600, 10) == []
+
+
+@fork
+def test_forked_workers_write_through_their_own_writer(tmp_path):
+    # Forks before any writer thread exists, like gunicorn workers forking from a master that only read the
+    # store: SQLite is not fork-safe while another thread is inside it
+    snapshots = store(tmp_path)
+    child = multiprocessing.get_context("fork").Process(target=_child_record, args=(snapshots,))
+    child.start()
+    snapshots.record_puuid(("americas", "alice", "na1"), "puuid-a") # Both processes write at once
+    child.join(10)
+    assert child.exitcode == 0
+    wait_for(lambda: snapshots.lookup_puuid(("europe", "bob", "euw")) == "puuid-b")
+    assert snapshots.lookup_puuid(("americas", "alice", "na1")) == "puuid-a"
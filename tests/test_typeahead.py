@@ -0,0 +1,119 @@
+# Filename: tests/test_typeahead.py
+# --- RiotIdIndex: prefix suggestions, ranking, display spelling and reloading from the snapshot store ---
+import time
+
+from snapshot_store import SnapshotStore
+from typeahead import RiotIdIndex
+
+
+class FakeStore:
+    enabled = False  # No background reload: tests call refresh()/rebuild() themselves
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.batches = []
+
+    def record_lookups(self, counts):
+        self.batches.append(dict(counts))
+
+    def popular_riot_ids(self, limit):
+        return self.rows[:limit]
+
+
+def key(riot_id, region="americas"):
+    username, _, tag = riot_id.lower().rpartition("#")
+    return (region, username, tag)
+
+
+def index(rows=(), store=None, **kwargs):
+    options = dict(flush_interval=3600, refresh_interval=0)
+    options.update(kwargs)
+    ids = RiotIdIndex(store or FakeStore(), **options)
+    ids.rebuild(rows)
+    return ids
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_suggestions_are_most_looked_up_first():
+    ids = index([("TenZ#0505", 50), ("Tenacious#NA1", 80), ("tarik#1337", 10), ("Shroud#NA1", 99)])
+    assert ids.suggest("ten", 10) == ["Tenacious#NA1", "TenZ#0505"]
+    assert ids.suggest("t", 2) == ["Tenacious#NA1", "TenZ#0505"]
+    assert ids.suggest("tenz#", 10) == ["TenZ#0505"]
+    assert ids.suggest("x", 10) == [] and ids.suggest("  ", 10) == []
+
+
+def test_matching_ignores_case_and_keeps_the_display_spelling():
+    ids = index([("TenZ#0505", 5)])
+    assert ids.suggest("TENZ", 10) == ["TenZ#0505"]
+    ids.record(key("tenz#0505"), "tenz#0505") # Typed in lowercase: the known spelling stays
+    assert ids.suggest("tenz", 10) == ["TenZ#0505"]
+    ids.record(key("newplayer#euw"), "newplayer#euw") # Spelled as typed until Riot's spelling is known
+    assert ids.suggest("new", 10) == ["newplayer#euw"]
+    ids.set_display(key("newplayer#euw"), "NewPlayer#EUW")
+    assert ids.suggest("new", 10) == ["NewPlayer#EUW"]
+
+
+def test_regions_are_summed_on_rebuild():
+    ids = index([("Ace#1", 5), ("Alpha#1", 8), ("ace#1", 4)]) # Same ID in two regions: 9 lookups
+    assert ids.suggest("a", 10) == ["Ace#1", "Alpha#1"]
+
+
+def test_record_counts_and_reorders():
+    ids = index([("Ace#1", 2), ("Alpha#1", 3)])
+    for _ in range(2):
+        ids.record(key("ace#1"), "ace#1")
+    assert ids.suggest("a", 10) == ["Ace#1", "Alpha#1"]
+
+
+def test_broad_prefixes_are_memoized():
+    ids = index([(f"Player{i}#NA1", i) for i in range(20)], scan=5, memo_ttl=60)
+    assert ids.suggest("p", 3) == ["Player19#NA1", "Player18#NA1", "Player17#NA1"]
+    ids.record(key("player0#na1"), "player0#na1") # Not enough to matter, and the memo is reused anyway
+    assert ids.suggest("p", 3) == ["Player19#NA1", "Player18#NA1", "Player17#NA1"]
+
+
+def test_index_size_is_bounded():
+    ids = index([("A#1", 3), ("B#1", 2), ("C#1", 1)], max_ids=2)
+    assert len(ids) == 2 and ids.suggest("c", 10) == [] # The least looked-up is dropped
+    ids.record(key("d#1"), "D#1")
+    assert len(ids) == 2 and ids.suggest("d", 10) == []
+
+
+def test_counts_are_flushed_in_batches():
+    store = FakeStore()
+    ids = index(store=store, flush_interval=0)
+    ids.record(key("ace#1"), "Ace#1")
+    ids.record(key("ace#1"), "Ace#1")
+    assert store.batches == [{key("ace#1"): (1, "Ace#1")}, {key("ace#1"): (1, "Ace#1")}]
+    ids.flush()
+    assert len(store.batches) == 2 # Nothing new
+
+
+def test_rebuild_keeps_counts_not_persisted_yet():
+    store = FakeStore([("Ace#1", 5), ("Alpha#1", 6)])
+    ids = index(store=store)
+    ids.record(key("ace#1"), "ace#1")
+    ids.record(key("ace#1"), "ace#1")
+    ids.record(key("new#1"), "New#1")
+    ids.rebuild(store.rows) # Read before this worker flushed
+    assert ids.suggest("a", 10) == ["Ace#1", "Alpha#1"] # 5 + 2 pending
+    assert ids.suggest("new", 10) == ["New#1"]
+
+
+def test_workers_see_each_others_ids_through_the_store(tmp_path):
+    store = SnapshotStore(path=str(tmp_path / "snapshots.sqlite3"), flush_interval=0.01)
+    worker_a, worker_b = index(store=store), index(store=store)
+    worker_a.record(key("tenz#0505"), "tenz#0505")
+    worker_a.set_display(key("tenz#0505"), "TenZ#0505")
+    assert worker_b.suggest("tenz", 10) == []
+    worker_a.refresh() # Persists worker A's counts
+    wait_for(lambda: store.popular_riot_ids(10) == [("TenZ#0505", 1)])
+    worker_b.refresh()
+    assert worker_b.suggest("tenz", 10) == ["TenZ#0505"]
+    assert worker_a.suggest("tenz", 10) == ["TenZ#0505"]
@@ -0,0 +1,192 @@
+# Filename: typeahead.py
+# --- Riot ID typeahead: prefix search over every Riot ID resolved so far ---
+# A mistyped tag costs a full Account API round trip that ends in a 404; suggesting IDs that
+# already resolved avoids most of them. IDs are kept lowercase in one sorted list, with
+# parallel lists of lookup counts and display spellings, so a prefix is two bisects and the
+# suggestions are the most looked-up IDs in that range. The index is rebuilt from the snapshot store at startup and
+# grows as lookups succeed; lookup counts are persisted in batches. Each worker holds its own index, so a background
+# thread reloads it from the snapshot store periodically to pick up the IDs other workers resolved.
+import heapq
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from structured_log import get_logger
+
+log = get_logger("typeahead")
+
+# --- Configuration ---
+TYPEAHEAD_ENABLED = os.environ.get("TYPEAHEAD_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+TYPEAHEAD_MAX_IDS = int(os.environ.get("TYPEAHEAD_MAX_IDS", 200000))  # Riot IDs held (memory bound)
+TYPEAHEAD_SCAN = int(os.environ.get("TYPEAHEAD_SCAN", 2000))  # Matches ranked per query; broader prefixes are memoized
+TYPEAHEAD_MEMO_TTL = float(os.environ.get("TYPEAHEAD_MEMO_TTL", 60))  # Seconds a broad prefix's ranking is reused
+TYPEAHEAD_FLUSH_INTERVAL = float(os.environ.get("TYPEAHEAD_FLUSH_INTERVAL", 30))  # Seconds between persisting counts
+# Seconds between reloads from the snapshot store; an ID resolved by one worker reaches the others within about twice this
+TYPEAHEAD_REFRESH_INTERVAL = float(os.environ.get("TYPEAHEAD_REFRESH_INTERVAL", 60))
+
+_MEMO_SIZE = 4096  # Broad prefixes memoized before the memo is cleared
+
+
+class RiotIdIndex:
+    """Case-insensitive prefix index of "name#tag" Riot IDs, ranked by lookup count.
+
+    Matching uses the lowercase key; suggestions use the display spelling, which
+    is Riot's (gameName#tagLine) once set_display() has seen it, else as typed.
+
+    record() is cheap enough for the request path (a bisect, plus a list
+    insert for a new ID). suggest() ranks at most `scan` matches per query;
+    prefixes matching more than that (one or two letters) reuse a ranking
+    computed at most every `memo_ttl` seconds.
+
+    Every `refresh_interval` seconds a background thread (started on first
+    use in each process, after a gunicorn fork) flushes this worker's counts
+    and rebuilds the index from the snapshot store, which every worker
+    writes to.
+    """
+
+    def __init__(self, store, max_ids=TYPEAHEAD_MAX_IDS, scan=TYPEAHEAD_SCAN, memo_ttl=TYPEAHEAD_MEMO_TTL,
+                 flush_interval=TYPEAHEAD_FLUSH_INTERVAL, refresh_interval=TYPEAHEAD_REFRESH_INTERVAL, enabled=TYPEAHEAD_ENABLED):
+        self.store = store
+        self.max_ids = max_ids
+        self.scan = scan
+        self.memo_ttl = memo_ttl
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.enabled = enabled
+        self._keys = []  # Sorted lowercase "name#tag"
+        self._counts = array("I")  # Lookups of _keys[i]
+        self._names = []  # Display spelling of _keys[i]
+        self._memo = {}  # Broad prefix -> (expires at, suggestions)
+        self._pending = {}  # Normalized (account_region, username, tag) -> (lookups not yet persisted, display spelling)
+        self._flushed = {}  # The last batch handed to the store, possibly not committed yet
+        self._flushed_at = time.monotonic()
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rebuild(self, rows):
+        """Replaces the index with `rows` of (riot_id, lookups); IDs repeated across regions are summed.
+
+        Counts not persisted yet are added back, and IDs in the last flushed
+        batch are kept even if `rows` was read before the store committed them.
+        """
+        counts, names = {}, {}
+        for riot_id, lookups in rows:
+            key = riot_id.lower()
+            counts[key] = counts.get(key, 0) + lookups
+            names.setdefault(key, riot_id) # Rows come most looked-up first: that region's spelling wins
+        if len(counts) > self.max_ids: # Keep the most looked-up
+            counts = dict(heapq.nlargest(self.max_ids, counts.items(), key=lambda item: item[1]))
+        keys = sorted(counts)
+        with self._lock:
+            self._keys = keys
+            self._counts = array("I", (min(counts[key], 0xFFFFFFFF) for key in keys))
+            self._names = [names[key] for key in keys]
+            self._memo = {}
+            for cache_key, (_, riot_id) in self._flushed.items():
+                self._find_or_insert(cache_key, riot_id, 0)
+            for cache_key, (lookups, riot_id) in self._pending.items():
+                i = self._find_or_insert(cache_key, riot_id, 0)
+                if i is not None:
+                    self._counts[i] = min(self._counts[i] + lookups, 0xFFFFFFFF)
+        log.debug("typeahead.rebuilt", "Rebuilt Riot ID index", riot_ids=len(keys))
+
+    def record(self, cache_key, riot_id):
+        """Counts one successful lookup of a normalized (account_region, username, tag); `riot_id` spells a new ID."""
+        if not self.enabled:
+            return
+        with self._lock:
+            i = self._find_or_insert(cache_key, riot_id, 1)
+            if i is None:
+                riot_id = self._pending.get(cache_key, (0, riot_id))[1]
+            else:
+                riot_id = self._names[i]
+                if self._counts[i] < 0xFFFFFFFF:
+                    self._counts[i] += 1
+            self._pending[cache_key] = (self._pending.get(cache_key, (0,))[0] + 1, riot_id)
+            if time.monotonic() - self._flushed_at < self.flush_interval:
+                return
+        self.flush()
+
+    def flush(self):
+        """Hands the counts recorded since the last flush to the snapshot store."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            if not pending:
+                return
+            self._flushed = pending
+        self.store.record_lookups(pending) # Queued; the snapshot writer commits it in the background
+
+    def set_display(self, cache_key, riot_id):
+        """Records Riot's spelling ("GameName#TagLine") of a normalized (account_region, username, tag)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            i = self._find_or_insert(cache_key, riot_id, 0)
+            if i is not None:
+                self._names[i] = riot_id
+            if cache_key in self._pending:
+                self._pending[cache_key] = (self._pending[cache_key][0], riot_id)
+
+    def _find_or_insert(self, cache_key, riot_id, count):
+        """Position of the key (inserted with `count` lookups if new), or None when the index is full."""
+        key = f"{cache_key[1]}#{cache_key[2]}"
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        if len(self._keys) >= self.max_ids:
+            return None
+        self._keys.insert(i, key)
+        self._counts.insert(i, count)
+        self._names.insert(i, riot_id)
+        return i
+
+    def suggest(self, prefix, limit=10):
+        """Up to `limit` resolved Riot IDs (display spelling) starting with `prefix` (any case), most looked-up first."""
+        prefix = prefix.strip().lower()
+        if not prefix or limit <= 0:
+            return []
+        self._ensure_refresher()
+        with self._lock:
+            keys, counts, names = self._keys, self._counts, self._names
+            lo = bisect_left(keys, prefix)
+            hi = bisect_left(keys, prefix + "\U0010ffff", lo)
+            if hi - lo <= self.scan:
+                return [names[i] for i in heapq.nlargest(limit, range(lo, hi), key=counts.__getitem__)]
+            memo = self._memo.get(prefix)
+            if memo is not None and memo[0] > time.monotonic() and len(memo[1]) >= limit:
+                return memo[1][:limit]
+            ranked = list(zip(counts[lo:hi], keys[lo:hi], names[lo:hi])) # Broad prefix: rank a snapshot outside the lock
+        suggestions = [name for _, _, name in heapq.nlargest(max(limit, 25), ranked)]
+        with self._lock:
+            if len(self._memo) >= _MEMO_SIZE:
+                self._memo = {}
+            self._memo[prefix] = (time.monotonic() + self.memo_ttl, suggestions)
+        return suggestions[:limit]
+
+    # --- Background reload ---
+
+    def _ensure_refresher(self):
+        if self._thread_pid != os.getpid() and self.enabled and self.refresh_interval > 0 and self.store.enabled:
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self._thread_pid = os.getpid()
+                    threading.Thread(target=self._run, name="typeahead-refresh", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("typeahead.refresh_failed", "Could not reload the Riot ID index", error=str(e))
+
+    def refresh(self):
+        """Reloads the index from the snapshot store, then persists this worker's new counts for the others."""
+        self.rebuild(self.store.popular_riot_ids(self.max_ids))
+        self.flush()